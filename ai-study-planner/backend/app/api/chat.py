@@ -1,11 +1,13 @@
+import json
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 from ..core.database import get_db
-from ..models.user_profile import UserProfile
 from ..services.ai_service import AIService
+from ..services.chat_pipeline import ChatPipeline
 
 router = APIRouter(
     prefix="/api/chat",
@@ -32,43 +34,31 @@ class ChatResponse(BaseModel):
     timestamp: str
 
 
+def _build_messages(request: ChatRequest) -> List[dict]:
+    """构建消息历史并追加当前用户消息"""
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.history or []]
+    messages.append({"role": "user", "content": request.message})
+    return messages
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.post("/", response_model=ChatResponse)
 async def chat(
-    request: ChatRequest,
-    db: Session = Depends(get_db)
+    request: ChatRequest
 ):
     """AI对话接口"""
     try:
-        # 获取用户画像信息
-        user_profile = None
-        if request.user_id:
-            user_profile = db.query(UserProfile).filter(
-                UserProfile.user_id == request.user_id
-            ).first()
-        
-        # 构建消息历史
-        messages = []
-        if request.history:
-            for msg in request.history:
-                messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        # 添加当前用户消息
-        messages.append({
-            "role": "user",
-            "content": request.message
-        })
-        
-        # 调用AI服务(传递数据库会话以启用知识库检索)
-        ai_service = AIService(db)
-        response_content = await ai_service.chat(
-            messages=messages,
-            user_profile=user_profile,
+        # 并发获取用户画像和知识库上下文,再调用AI服务
+        ai_service = AIService()
+        prepared = await ChatPipeline(ai_service).prepare(
+            messages=_build_messages(request),
             user_id=request.user_id,
             enable_knowledge_base=True
         )
+        response_content = await ai_service.complete(prepared.full_messages)
         
         return ChatResponse(
             message=response_content,
@@ -79,6 +69,48 @@ async def chat(
         raise HTTPException(status_code=500, detail=f"对话处理失败: {str(e)}")
 
 
+@router.post("/stream")
+async def chat_stream(
+    request: ChatRequest
+):
+    """
+    流式AI对话接口(Server-Sent Events)
+    
+    用户画像查询和知识库检索在返回响应前并发完成(失败时直接返回500),之后逐段转发模型输出:
+    - `event: delta`, `data: {"content": 增量文本}`
+    - `event: done`, `data: {"timestamp": 时间}` 正常结束
+    - `event: error`, `data: {"detail": 错误信息}` 生成过程中出错
+    
+    客户端断开连接时流被取消,上游模型请求随之关闭,不再继续生成。
+    """
+    try:
+        ai_service = AIService()
+        prepared = await ChatPipeline(ai_service).prepare(
+            messages=_build_messages(request),
+            user_id=request.user_id,
+            enable_knowledge_base=True
+        )
+        full_messages = prepared.full_messages
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"对话处理失败: {str(e)}")
+    
+    async def event_stream():
+        try:
+            async for delta in ai_service.stream_completion(full_messages):
+                yield _sse_event("delta", {"content": delta})
+        except Exception as e:
+            yield _sse_event("error", {"detail": f"AI对话服务异常: {str(e)}"})
+            return
+        yield _sse_event("done", {"timestamp": datetime.now().isoformat()})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 禁止缓存和反向代理(如nginx)缓冲,保证每段输出立即送达浏览器
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/history/{user_id}")
 async def get_chat_history(
     user_id: str,
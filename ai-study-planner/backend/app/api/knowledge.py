@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 from ..core.database import get_db
 from ..services.knowledge_service import KnowledgeService
+from ..services.query_warmup import get_query_warmer
+from ..services.upload_ingest import get_upload_ingest_manager
 from ..models.knowledge_base import KnowledgeDocument
 
 router = APIRouter(
@@ -18,8 +21,7 @@ class DocumentCreate(BaseModel):
     title: str
     content: str
     category: str
-    tags: Optional[List[str]] = []
-    is_active: bool = True
+    tags: Optional[List[str]] = []  # 作为文档关键词保存
 
 
 class DocumentUpdate(BaseModel):
@@ -32,24 +34,65 @@ class DocumentUpdate(BaseModel):
 
 
 class DocumentResponse(BaseModel):
-    """文档响应模型"""
-    id: str
+    """文档响应模型(不含content/summary)"""
+    id: int
     title: str
-    category: str
-    tags: List[str]
-    is_active: bool
-    created_at: datetime
-    updated_at: datetime
+    category: Optional[str] = None
+    sub_category: Optional[str] = None
+    keywords: Optional[List[str]] = None
+    source: Optional[str] = None
+    author: Optional[str] = None
+    difficulty_level: Optional[str] = None
+    applicable_stage: Optional[str] = None
+    chunk_count: Optional[int] = None
+    duplicate_of: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
 
+class DocumentPage(BaseModel):
+    """文档列表的一页"""
+    items: List[DocumentResponse]
+    next_cursor: Optional[int] = None  # 传给下一次请求的cursor,为空表示没有更多数据
+
+
+class VectorizationStatus(BaseModel):
+    """文档向量化状态"""
+    document_id: int
+    status: str  # pending / running / done / failed
+    retries: int
+    error: Optional[str] = None
+    chunk_count: int
+    queue_state: Optional[str] = None  # queued / running / retry_scheduled
+
+
+class UploadJobStatus(BaseModel):
+    """上传文件导入任务状态"""
+    job_id: str
+    status: str  # queued / running / done / failed
+    filename: str
+    document_id: Optional[int] = None
+    bytes_total: int
+    bytes_read: int
+    progress: float
+    chunks: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
 class SearchRequest(BaseModel):
     """知识库搜索请求"""
     query: str
     top_k: int = 5
     category: Optional[str] = None
+    difficulty_level: Optional[str] = None
+    mode: Optional[Literal["vector", "lexical", "hybrid", "cascade"]] = None  # 默认KNOWLEDGE_SEARCH_MODE
+    applicable_stage: Optional[str] = None  # cascade模式的排序偏好
+    preferred_difficulty: Optional[str] = None  # cascade模式的排序偏好
 
 
 class SearchResultItem(BaseModel):
@@ -78,32 +121,36 @@ async def create_document(
             title=doc.title,
             content=doc.content,
             category=doc.category,
-            tags=doc.tags,
-            is_active=doc.is_active
+            keywords=doc.tags or None
         )
         return document
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建文档失败: {str(e)}")
 
 
-@router.get("/documents/", response_model=List[DocumentResponse])
+@router.get("/documents/", response_model=DocumentPage)
 async def list_documents(
     category: Optional[str] = None,
-    is_active: Optional[bool] = None,
+    difficulty_level: Optional[str] = None,
+    applicable_stage: Optional[str] = None,
+    cursor: Optional[int] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(50, ge=1, le=500),
     db: Session = Depends(get_db)
 ):
-    """获取文档列表"""
+    """获取文档列表(按ID降序,用上一页返回的next_cursor翻页;skip仅为兼容保留)"""
     try:
         knowledge_service = KnowledgeService(db)
-        documents = knowledge_service.get_documents(
+        documents = knowledge_service.list_documents(
             category=category,
-            is_active=is_active,
+            difficulty_level=difficulty_level,
+            applicable_stage=applicable_stage,
             skip=skip,
-            limit=limit
+            limit=limit,
+            cursor=cursor
         )
-        return documents
+        next_cursor = documents[-1].id if len(documents) == limit else None
+        return DocumentPage(items=documents, next_cursor=next_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文档列表失败: {str(e)}")
 
@@ -144,19 +191,21 @@ async def update_document(
         return document
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"更新文档失败: {str(e)}")
 
 
 @router.delete("/documents/{document_id}")
 async def delete_document(
-    document_id: str,
+    document_id: int,
     db: Session = Depends(get_db)
 ):
     """删除文档"""
     try:
         knowledge_service = KnowledgeService(db)
-        success = knowledge_service.delete_document(document_id)
+        success = await knowledge_service.delete_document(document_id)
         if not success:
             raise HTTPException(status_code=404, detail="文档不存在")
         return {"message": "文档删除成功"}
@@ -166,6 +215,61 @@ async def delete_document(
         raise HTTPException(status_code=500, detail=f"删除文档失败: {str(e)}")
 
 
+@router.get("/vectorization/status")
+async def get_vectorization_summary(db: Session = Depends(get_db)):
+    """获取各向量化状态的文档数量及后台队列情况"""
+    knowledge_service = KnowledgeService(db)
+    return knowledge_service.get_vectorization_summary()
+
+
+@router.get("/documents/{document_id}/vectorization", response_model=VectorizationStatus)
+async def get_vectorization_status(
+    document_id: int,
+    db: Session = Depends(get_db)
+):
+    """获取文档向量化状态"""
+    knowledge_service = KnowledgeService(db)
+    status = knowledge_service.get_vectorization_status(document_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return status
+
+
+@router.post("/documents/{document_id}/vectorization", response_model=VectorizationStatus)
+async def retry_vectorization(
+    document_id: int,
+    db: Session = Depends(get_db)
+):
+    """重新提交文档向量化任务(如失败后手动重试)"""
+    knowledge_service = KnowledgeService(db)
+    try:
+        found = knowledge_service.request_vectorization(document_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return knowledge_service.get_vectorization_status(document_id)
+
+
+@router.post("/index/rebuild")
+async def rebuild_vector_index(
+    category: Optional[str] = None,
+    all_categories: bool = False,
+    db: Session = Depends(get_db)
+):
+    """从数据库重建向量索引(按分类分片时只重建category对应的分片)"""
+    knowledge_service = KnowledgeService(db)
+    return await asyncio.to_thread(knowledge_service.rebuild_vector_index, category, all_categories)
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取检索缓存的命中统计和热门查询预热状态"""
+    stats = KnowledgeService.get_cache_stats()
+    stats["warmup"] = get_query_warmer().stats()
+    return stats
+
+
 @router.post("/search/", response_model=SearchResponse)
 async def search_knowledge(
     search_req: SearchRequest,
@@ -174,17 +278,21 @@ async def search_knowledge(
     """搜索知识库"""
     try:
         knowledge_service = KnowledgeService(db)
-        results = await knowledge_service.search_knowledge(
+        results = await knowledge_service.search(
             query=search_req.query,
             top_k=search_req.top_k,
-            category=search_req.category
+            category=search_req.category,
+            mode=search_req.mode,
+            difficulty_level=search_req.difficulty_level,
+            applicable_stage=search_req.applicable_stage,
+            preferred_difficulty=search_req.preferred_difficulty
         )
         
         search_results = [
             SearchResultItem(
-                document_id=r["document_id"],
-                document_title=r["document_title"],
-                chunk_content=r["chunk_content"],
+                document_id=str(r["document_id"]),
+                document_title=r["metadata"]["document_title"],
+                chunk_content=r["content"],
                 relevance_score=r["score"]
             )
             for r in results
@@ -198,39 +306,34 @@ async def search_knowledge(
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
 
-@router.post("/upload/")
+@router.post("/upload/", response_model=UploadJobStatus)
 async def upload_document(
     file: UploadFile = File(...),
     category: str = "general",
-    tags: Optional[str] = None,
-    db: Session = Depends(get_db)
+    tags: Optional[str] = None
 ):
-    """上传文档文件(文本文件)"""
+    """
+    上传文档文件(UTF-8文本文件)
+    
+    文件在后台流式切分和向量化,接口立即返回导入任务,通过GET /upload/jobs/{job_id}查询进度
+    """
+    keywords = [t.strip() for t in tags.split(',') if t.strip()] if tags else None
     try:
-        # 读取文件内容
-        content = await file.read()
-        content_str = content.decode('utf-8')
-        
-        # 解析tags
-        tag_list = []
-        if tags:
-            tag_list = [t.strip() for t in tags.split(',')]
-        
-        # 创建文档
-        knowledge_service = KnowledgeService(db)
-        document = await knowledge_service.add_document(
-            title=file.filename,
-            content=content_str,
+        job = await get_upload_ingest_manager().submit(
+            file.file,
+            filename=file.filename,
             category=category,
-            tags=tag_list
+            keywords=keywords
         )
-        
-        return {
-            "message": "文档上传成功",
-            "document_id": document.id,
-            "title": document.title
-        }
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="文件格式不支持,请上传UTF-8编码的文本文件")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    return job.to_dict()
+
+
+@router.get("/upload/jobs/{job_id}", response_model=UploadJobStatus)
+async def get_upload_job(job_id: str):
+    """获取上传导入任务的状态和进度"""
+    job = get_upload_ingest_manager().get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job.to_dict()
\ No newline at end of file
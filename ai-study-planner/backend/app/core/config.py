@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import List
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -29,6 +29,106 @@ class Settings(BaseSettings):
     AI_MAX_TOKENS: int = Field(default=2000, env="AI_MAX_TOKENS")
     AI_TEMPERATURE: float = Field(default=0.7, env="AI_TEMPERATURE")
     
+    # 对话模型前处理的时间预算秒数(画像查询与知识库检索并发执行,超时则跳过该步骤;<=0不限制)
+    CHAT_PROFILE_TIMEOUT: float = Field(default=1.0, env="CHAT_PROFILE_TIMEOUT")
+    CHAT_RETRIEVAL_TIMEOUT: float = Field(default=2.5, env="CHAT_RETRIEVAL_TIMEOUT")
+    
+    # 系统提示词中用户画像描述的缓存条目数(按user_id和画像更新时间缓存)
+    PROMPT_USER_CONTEXT_CACHE_SIZE: int = Field(default=4096, env="PROMPT_USER_CONTEXT_CACHE_SIZE")
+    
+    # 共享HTTP客户端配置(对话和embedding接口共用连接池,保持长连接)
+    HTTP_MAX_CONNECTIONS: int = Field(default=100, env="HTTP_MAX_CONNECTIONS")
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    HTTP_KEEPALIVE_EXPIRY: float = Field(default=30.0, env="HTTP_KEEPALIVE_EXPIRY")
+    HTTP_CONNECT_TIMEOUT: float = Field(default=5.0, env="HTTP_CONNECT_TIMEOUT")
+    HTTP_READ_TIMEOUT: float = Field(default=60.0, env="HTTP_READ_TIMEOUT")
+    HTTP_POOL_TIMEOUT: float = Field(default=10.0, env="HTTP_POOL_TIMEOUT")
+    HTTP2_ENABLED: bool = Field(default=False, env="HTTP2_ENABLED")
+    
+    # Embedding配置(EMBEDDING_PROVIDER: hashing本地特征哈希, openai为OpenAI兼容接口)
+    EMBEDDING_PROVIDER: str = Field(default="hashing", env="EMBEDDING_PROVIDER")
+    EMBEDDING_MODEL_NAME: str = Field(default="text-embedding-v3", env="EMBEDDING_MODEL_NAME")
+    EMBEDDING_API_KEY: Optional[str] = Field(default=None, env="EMBEDDING_API_KEY")
+    EMBEDDING_ENDPOINT: Optional[str] = Field(default=None, env="EMBEDDING_ENDPOINT")
+    EMBEDDING_DIMENSION: Optional[int] = Field(default=None, env="EMBEDDING_DIMENSION")
+    EMBEDDING_BATCH_SIZE: int = Field(default=10, env="EMBEDDING_BATCH_SIZE")
+    EMBEDDING_MAX_CONCURRENCY: int = Field(default=4, env="EMBEDDING_MAX_CONCURRENCY")
+    EMBEDDING_MAX_RETRIES: int = Field(default=3, env="EMBEDDING_MAX_RETRIES")
+    EMBEDDING_STORAGE_CODEC: str = Field(default="float32", env="EMBEDDING_STORAGE_CODEC")
+    
+    # 后台向量化任务配置
+    VECTORIZE_WORKERS: int = Field(default=2, env="VECTORIZE_WORKERS")
+    VECTORIZE_MAX_RETRIES: int = Field(default=3, env="VECTORIZE_MAX_RETRIES")
+    VECTORIZE_RETRY_DELAY: float = Field(default=5.0, env="VECTORIZE_RETRY_DELAY")
+
+    # 文件上传流式导入配置(读取块大小、每批embedding的chunk数、排队批次数上限、并发任务数)
+    KNOWLEDGE_UPLOAD_READ_SIZE: int = Field(default=65536, env="KNOWLEDGE_UPLOAD_READ_SIZE")
+    KNOWLEDGE_UPLOAD_BATCH_CHUNKS: int = Field(default=64, env="KNOWLEDGE_UPLOAD_BATCH_CHUNKS")
+    KNOWLEDGE_UPLOAD_MAX_PENDING_BATCHES: int = Field(default=4, env="KNOWLEDGE_UPLOAD_MAX_PENDING_BATCHES")
+    KNOWLEDGE_UPLOAD_MAX_JOBS: int = Field(default=2, env="KNOWLEDGE_UPLOAD_MAX_JOBS")
+    
+    # 知识库文本切分配置(KNOWLEDGE_CHUNK_UNIT: char按字符数, token按估算的token数)
+    KNOWLEDGE_CHUNK_SIZE: int = Field(default=500, env="KNOWLEDGE_CHUNK_SIZE")
+    KNOWLEDGE_CHUNK_OVERLAP: int = Field(default=100, env="KNOWLEDGE_CHUNK_OVERLAP")
+    KNOWLEDGE_CHUNK_UNIT: str = Field(default="char", env="KNOWLEDGE_CHUNK_UNIT")
+    
+    # 知识库检索配置
+    KNOWLEDGE_SEARCH_MODE: str = Field(default="vector", env="KNOWLEDGE_SEARCH_MODE")
+    KNOWLEDGE_HYBRID_DEPTH_FACTOR: int = Field(default=4, env="KNOWLEDGE_HYBRID_DEPTH_FACTOR")
+    KNOWLEDGE_RRF_K: int = Field(default=60, env="KNOWLEDGE_RRF_K")
+
+    # 级联检索配置(第一阶段召回候选数、两个阶段的时间预算毫秒数)
+    KNOWLEDGE_CASCADE_CANDIDATES: int = Field(default=200, env="KNOWLEDGE_CASCADE_CANDIDATES")
+    KNOWLEDGE_CASCADE_STAGE1_BUDGET_MS: float = Field(default=80.0, env="KNOWLEDGE_CASCADE_STAGE1_BUDGET_MS")
+    KNOWLEDGE_CASCADE_STAGE2_BUDGET_MS: float = Field(default=40.0, env="KNOWLEDGE_CASCADE_STAGE2_BUDGET_MS")
+    
+    # 对话知识库上下文配置(token预算、候选数量、MMR相关性权重、近似重复阈值)
+    KNOWLEDGE_CONTEXT_MAX_TOKENS: int = Field(default=1500, env="KNOWLEDGE_CONTEXT_MAX_TOKENS")
+    KNOWLEDGE_CONTEXT_CANDIDATES: int = Field(default=8, env="KNOWLEDGE_CONTEXT_CANDIDATES")
+    KNOWLEDGE_CONTEXT_MMR_LAMBDA: float = Field(default=0.7, env="KNOWLEDGE_CONTEXT_MMR_LAMBDA")
+    KNOWLEDGE_CONTEXT_DUP_THRESHOLD: float = Field(default=0.8, env="KNOWLEDGE_CONTEXT_DUP_THRESHOLD")
+    # 对话候选的最低向量相似度(默认不设阈值,由上下文打包按相关性和预算取舍;不同embedding模型的相似度尺度差别很大)
+    KNOWLEDGE_CONTEXT_MIN_SCORE: Optional[float] = Field(default=None, env="KNOWLEDGE_CONTEXT_MIN_SCORE")
+
+    # 知识库检索缓存(条目数上限、有效期秒数)
+    KNOWLEDGE_QUERY_CACHE_SIZE: int = Field(default=2048, env="KNOWLEDGE_QUERY_CACHE_SIZE")
+    KNOWLEDGE_QUERY_CACHE_TTL: float = Field(default=3600.0, env="KNOWLEDGE_QUERY_CACHE_TTL")
+    KNOWLEDGE_RESULT_CACHE_SIZE: int = Field(default=1024, env="KNOWLEDGE_RESULT_CACHE_SIZE")
+    KNOWLEDGE_RESULT_CACHE_TTL: float = Field(default=300.0, env="KNOWLEDGE_RESULT_CACHE_TTL")
+    
+    # 热门查询预热配置(查询数量、统计窗口天数、定期刷新间隔秒数、知识库变更后等待稳定的秒数、是否预生成查询向量、启动时最长等待秒数)
+    KNOWLEDGE_WARMUP_ENABLED: bool = Field(default=True, env="KNOWLEDGE_WARMUP_ENABLED")
+    KNOWLEDGE_WARMUP_QUERIES: int = Field(default=200, env="KNOWLEDGE_WARMUP_QUERIES")
+    KNOWLEDGE_WARMUP_WINDOW_DAYS: int = Field(default=7, env="KNOWLEDGE_WARMUP_WINDOW_DAYS")
+    KNOWLEDGE_WARMUP_INTERVAL: float = Field(default=1800.0, env="KNOWLEDGE_WARMUP_INTERVAL")
+    KNOWLEDGE_WARMUP_DEBOUNCE: float = Field(default=10.0, env="KNOWLEDGE_WARMUP_DEBOUNCE")
+    KNOWLEDGE_WARMUP_EMBEDDINGS: bool = Field(default=True, env="KNOWLEDGE_WARMUP_EMBEDDINGS")
+    KNOWLEDGE_WARMUP_STARTUP_TIMEOUT: float = Field(default=15.0, env="KNOWLEDGE_WARMUP_STARTUP_TIMEOUT")
+
+    # 检索历史缓冲写入配置(队列容量、每批条数、最长攒批秒数、队列满时的策略drop/block及block最长等待秒数)
+    SEARCH_HISTORY_QUEUE_SIZE: int = Field(default=10000, env="SEARCH_HISTORY_QUEUE_SIZE")
+    SEARCH_HISTORY_BATCH_SIZE: int = Field(default=200, env="SEARCH_HISTORY_BATCH_SIZE")
+    SEARCH_HISTORY_FLUSH_INTERVAL: float = Field(default=1.0, env="SEARCH_HISTORY_FLUSH_INTERVAL")
+    SEARCH_HISTORY_OVERFLOW: str = Field(default="drop", env="SEARCH_HISTORY_OVERFLOW")
+    SEARCH_HISTORY_BLOCK_TIMEOUT: float = Field(default=0.05, env="SEARCH_HISTORY_BLOCK_TIMEOUT")
+
+    # 近似重复检测配置(文档策略off/flag/skip/merge、Jaccard相似度阈值、是否检测chunk、MinHash参数)
+    KNOWLEDGE_DEDUP_POLICY: str = Field(default="flag", env="KNOWLEDGE_DEDUP_POLICY")
+    KNOWLEDGE_DEDUP_THRESHOLD: float = Field(default=0.85, env="KNOWLEDGE_DEDUP_THRESHOLD")
+    KNOWLEDGE_DEDUP_CHUNKS: bool = Field(default=True, env="KNOWLEDGE_DEDUP_CHUNKS")
+    KNOWLEDGE_MINHASH_PERM: int = Field(default=64, env="KNOWLEDGE_MINHASH_PERM")
+    KNOWLEDGE_MINHASH_BANDS: int = Field(default=16, env="KNOWLEDGE_MINHASH_BANDS")
+    KNOWLEDGE_MINHASH_SHINGLE: int = Field(default=5, env="KNOWLEDGE_MINHASH_SHINGLE")
+
+    # 知识库向量索引配置
+    KNOWLEDGE_INDEX_BACKEND: str = Field(default="flat", env="KNOWLEDGE_INDEX_BACKEND")
+    KNOWLEDGE_INDEX_PATH: str = Field(default="data/knowledge_index.npz", env="KNOWLEDGE_INDEX_PATH")
+    KNOWLEDGE_INDEX_SAVE_INTERVAL: float = Field(default=30.0, env="KNOWLEDGE_INDEX_SAVE_INTERVAL")
+    KNOWLEDGE_IVF_NLIST: int = Field(default=256, env="KNOWLEDGE_IVF_NLIST")
+    KNOWLEDGE_IVF_NPROBE: int = Field(default=16, env="KNOWLEDGE_IVF_NPROBE")
+    KNOWLEDGE_INDEX_SHARDING: str = Field(default="none", env="KNOWLEDGE_INDEX_SHARDING")  # none / category
+    KNOWLEDGE_INDEX_SHARD_WORKERS: int = Field(default=4, env="KNOWLEDGE_INDEX_SHARD_WORKERS")
+    
     @property
     def cors_origins_list(self) -> List[str]:
         """将CORS_ORIGINS字符串转换为列表"""
@@ -0,0 +1,57 @@
+from typing import Optional
+
+import httpx
+
+from .config import settings
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """按HTTP_*配置创建带连接池的异步HTTP客户端"""
+    http2 = settings.HTTP2_ENABLED
+    if http2 and not _http2_available():
+        print("未安装h2,HTTP/2不可用,使用HTTP/1.1 (pip install 'httpx[http2]')")
+        http2 = False
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            settings.HTTP_READ_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            pool=settings.HTTP_POOL_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        http2=http2
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取进程内共享的HTTP客户端
+
+    应用启动时由lifespan创建、停止时关闭;连接按目标地址保持长连接复用,
+    对话和embedding请求不再每次重新建立TCP/TLS连接。脚本等未经过lifespan的场景首次调用时创建。
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+
+async def close_http_client():
+    """关闭共享的HTTP客户端,释放连接池中的全部连接"""
+    global _http_client
+    if _http_client is not None:
+        client, _http_client = _http_client, None
+        await client.aclose()
@@ -1,17 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
 from .core.database import engine, Base
+from .core.http_client import close_http_client, get_http_client
 from .api import user_profile, chat, knowledge
+from .services.query_warmup import get_query_warmer
+from .services.search_history_writer import get_search_history_writer
+from .services.upload_ingest import get_upload_ingest_manager
+from .services.vector_index import close_vector_index
+from .services.vectorization_worker import get_vectorization_worker
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期: 创建共享HTTP客户端,启动/停止文档向量化、检索历史写入和热门查询预热后台任务,
+    停止时取消未完成的上传导入,保存向量索引,最后关闭HTTP连接池
+    """
+    get_http_client()
+    get_upload_ingest_manager().recover_interrupted()
+    worker = get_vectorization_worker()
+    history_writer = get_search_history_writer()
+    await worker.start()
+    history_writer.start()
+    if settings.KNOWLEDGE_WARMUP_ENABLED:
+        await get_query_warmer().start(settings.KNOWLEDGE_WARMUP_STARTUP_TIMEOUT)
+    yield
+    await get_query_warmer().stop()
+    await get_upload_ingest_manager().shutdown()
+    await worker.stop()
+    await history_writer.stop()
+    await asyncio.to_thread(close_vector_index)
+    await close_http_client()
+
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    description="基于AI的考研学习规划系统"
+    description="基于AI的考研学习规划系统",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -1,7 +1,23 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, JSON, ForeignKey, Index
+from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, Float, JSON, ForeignKey, Index, LargeBinary
 from sqlalchemy.sql import func
 from ..core.database import Base
 
+# 文档向量化状态(is_vectorized字段取值,兼容原有的0/1含义)
+VECTORIZE_PENDING = 0
+VECTORIZE_DONE = 1
+VECTORIZE_RUNNING = 2
+VECTORIZE_FAILED = 3
+# 上传文件正在流式导入(chunks由导入任务直接写入,不经过向量化任务)
+VECTORIZE_IMPORTING = 4
+
+VECTORIZE_STATUS_NAMES = {
+    VECTORIZE_PENDING: "pending",
+    VECTORIZE_DONE: "done",
+    VECTORIZE_RUNNING: "running",
+    VECTORIZE_FAILED: "failed",
+    VECTORIZE_IMPORTING: "importing",
+}
+
 
 class KnowledgeDocument(Base):
     """知识库文档模型"""
@@ -22,17 +38,30 @@ class KnowledgeDocument(Base):
     # 元数据
     source = Column(String(100), comment="来源(如:官方考纲/真题解析/名师笔记等)")
     author = Column(String(100), comment="作者/来源机构")
-    difficulty_level = Column(String(20), comment="难度等级(基础/中等/困难)")
-    applicable_stage = Column(String(50), comment="适用备考阶段(基础期/强化期/冲刺期)")
+    difficulty_level = Column(String(20), index=True, comment="难度等级(基础/中等/困难)")
+    applicable_stage = Column(String(50), index=True, comment="适用备考阶段(基础期/强化期/冲刺期)")
     
     # 向量化标识
-    is_vectorized = Column(Integer, default=0, comment="是否已向量化(0:未向量化 1:已向量化)")
+    is_vectorized = Column(Integer, default=VECTORIZE_PENDING, index=True, comment="向量化状态(0:待处理 1:已完成 2:处理中 3:失败 4:上传导入中)")
+    vectorize_retries = Column(Integer, default=0, comment="向量化失败重试次数")
+    vectorize_error = Column(Text, comment="最近一次向量化失败的错误信息")
     chunk_count = Column(Integer, default=0, comment="切分的chunk数量")
+    # 上传的大文件content只保存开头预览,完整内容只在chunks中,不能按content重新切分
+    content_is_preview = Column(Boolean, default=False, comment="content是否只是上传文件的开头预览")
+    
+    # 近似重复检测
+    minhash = Column(LargeBinary, comment="内容的MinHash签名(uint32数组)")
+    duplicate_of = Column(Integer, index=True, comment="与之近似重复的已有文档ID")
     
     # 时间戳
     created_at = Column(DateTime, server_default=func.now(), comment="创建时间")
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), comment="更新时间")
     
+    # 文档列表按分类+难度组合筛选时使用
+    __table_args__ = (
+        Index('idx_doc_category_difficulty', 'category', 'difficulty_level'),
+    )
+    
     def __repr__(self):
         return f"<KnowledgeDocument(id={self.id}, title={self.title}, category={self.category})>"
 
@@ -49,10 +78,17 @@ class KnowledgeChunk(Base):
     # 切片内容
     content = Column(Text, nullable=False, comment="切片内容")
     chunk_index = Column(Integer, nullable=False, comment="在原文档中的顺序")
+    content_hash = Column(String(64), comment="切片内容的SHA-256(与embedding_model一起作为向量缓存键)")
     
     # 向量存储(预留字段,实际向量可能存储在专门的向量数据库中)
     embedding_model = Column(String(50), comment="使用的embedding模型名称")
-    embedding_vector = Column(JSON, comment="向量表示(JSON格式存储,实际项目可能使用专门向量数据库)")
+    embedding_codec = Column(String(10), comment="向量存储格式(float32/float16/int8)")
+    embedding_blob = Column(LargeBinary, comment="向量的二进制表示(格式见embedding_codec)")
+    embedding_vector = Column(JSON, comment="向量表示(旧版JSON格式,可用scripts/migrate_embeddings.py迁移为embedding_blob)")
+    
+    # 近似重复检测(被标记为重复的chunk不进入向量索引和BM25索引)
+    minhash = Column(LargeBinary, comment="内容的MinHash签名(uint32数组)")
+    duplicate_of = Column(Integer, index=True, comment="与之近似重复的其他文档chunk ID")
     
     # 元数据(继承自文档)
     category = Column(String(50), index=True, comment="文档分类")
@@ -65,6 +101,7 @@ class KnowledgeChunk(Base):
     # 创建复合索引以优化检索性能
     __table_args__ = (
         Index('idx_category_difficulty', 'category', 'difficulty_level'),
+        Index('idx_content_hash_model', 'content_hash', 'embedding_model'),
     )
     
     def __repr__(self):
@@ -86,7 +123,7 @@ class SearchHistory(Base):
     relevance_scores = Column(JSON, comment="各chunk的相关性得分")
     
     # 时间戳
-    created_at = Column(DateTime, server_default=func.now(), comment="检索时间")
+    created_at = Column(DateTime, server_default=func.now(), index=True, comment="检索时间")
     
     def __repr__(self):
         return f"<SearchHistory(id={self.id}, user_id={self.user_id}, query={self.query[:50]})>"
\ No newline at end of file
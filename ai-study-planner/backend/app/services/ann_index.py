@@ -0,0 +1,515 @@
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models.knowledge_base import KnowledgeChunk
+from .embedding_service import get_embedding_provider
+from .vector_index import FlatVectorIndex, fetch_chunk_vectors, vectorized_chunk_filter, _normalize_rows
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = 10,
+    sample_size: int = 256,
+    seed: int = 0,
+    batch_size: int = 16384
+) -> np.ndarray:
+    """
+    球面k-means训练IVF聚类中心
+
+    Args:
+        vectors: 已归一化的训练向量
+        nlist: 聚类中心数量
+        iterations: 迭代次数
+        sample_size: 每个聚类中心最多使用的训练样本数
+        seed: 随机种子(保证同样的数据训练出同样的中心)
+        batch_size: 分配阶段的分批大小,限制临时打分矩阵的内存
+
+    Returns:
+        形如(nlist, dim)的归一化聚类中心
+    """
+    rng = np.random.default_rng(seed)
+    if vectors.shape[0] > nlist * sample_size:
+        vectors = vectors[rng.choice(vectors.shape[0], nlist * sample_size, replace=False)]
+    n = vectors.shape[0]
+    centroids = vectors[rng.choice(n, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = assign_to_centroids(vectors, centroids, batch_size)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+        centroids[non_empty] = np.add.reduceat(vectors[order], starts, axis=0)
+        # 空簇重新随机初始化,避免聚类中心退化
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(n, len(empty), replace=False)]
+        centroids = _normalize_rows(centroids)
+
+    return centroids.astype(np.float32)
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 16384) -> np.ndarray:
+    """返回每个向量最近(内积最大)的聚类中心编号"""
+    assign = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], batch_size):
+        block = vectors[start:start + batch_size]
+        assign[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+class IVFVectorIndex:
+    """
+    IVF(倒排文件)近似最近邻向量索引
+
+    用k-means把向量划分到nlist个簇,每个簇是一个FlatVectorIndex;
+    检索时只扫描与查询最接近的n_probe个簇,n_probe越大召回越高、延迟越高。
+    新增向量直接追加到最近的簇,删除只压缩所在的簇,均无需全量重建。
+    向量数量达到训练阈值前,所有向量放在单个簇中(等价于精确检索)。
+    训练聚类中心和保存本地文件在后台线程中进行,写入路径上不做这两件事。
+    """
+
+    def __init__(
+        self,
+        nlist: int = 256,
+        n_probe: int = 16,
+        path: Optional[str] = None,
+        save_interval: float = 30.0,
+        min_points_per_list: int = 39
+    ):
+        self.nlist = nlist
+        self.n_probe = n_probe
+        self.path = path
+        self.save_interval = save_interval
+        self.min_points_per_list = min_points_per_list
+        self.dim: Optional[int] = None
+        self.loaded = False
+        self.centroids: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+        self._lists: List[FlatVectorIndex] = [FlatVectorIndex()]
+        self._assignments: Dict[int, int] = {}
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        # 后台任务(训练/保存)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Future] = []
+        self._train_scheduled = False
+        self._save_scheduled = False
+        self._save_lock = threading.Lock()
+        # 训练进行中时记录期间被写入或删除的chunk ID,替换簇时按最新内容重放
+        self._training_log: Optional[Set[int]] = None
+
+    def __len__(self) -> int:
+        return len(self._assignments)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_ids: Sequence[int],
+        categories: Sequence[Optional[str]],
+        vectors
+    ):
+        """增量写入向量,按最近的聚类中心分配到对应的簇(已存在的chunk ID会被覆盖)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(chunk_ids):
+            raise ValueError("向量数量与chunk数量不一致")
+        if len(chunk_ids) == 0:
+            return
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: 期望{self.dim}, 实际{vectors.shape[1]}")
+
+            self.remove([cid for cid in chunk_ids if int(cid) in self._assignments])
+            if self._training_log is not None:
+                self._training_log.update(int(cid) for cid in chunk_ids)
+            self._insert(self._lists, self._assignments, self.centroids, chunk_ids, document_ids, categories, vectors)
+
+            if (not self.is_trained and not self._train_scheduled
+                    and len(self) >= self.nlist * self.min_points_per_list):
+                self._train_scheduled = True
+                self._schedule(self._train_task)
+
+            self._mark_dirty()
+
+    @staticmethod
+    def _insert(
+        lists: List[FlatVectorIndex],
+        assignments: Dict[int, int],
+        centroids: Optional[np.ndarray],
+        chunk_ids,
+        document_ids,
+        categories,
+        vectors
+    ):
+        """把向量写入最近的簇(未训练时全部写入0号簇),同时更新chunk到簇的映射"""
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        document_ids = np.asarray(document_ids, dtype=np.int64)
+        categories = list(categories)
+
+        if centroids is not None:
+            assign = assign_to_centroids(vectors, centroids)
+        else:
+            assign = np.zeros(len(chunk_ids), dtype=np.int64)
+
+        for list_no in np.unique(assign):
+            rows = np.flatnonzero(assign == list_no)
+            lists[list_no].add(
+                chunk_ids[rows],
+                document_ids[rows],
+                [categories[i] for i in rows],
+                vectors[rows]
+            )
+            for chunk_id in chunk_ids[rows]:
+                assignments[int(chunk_id)] = int(list_no)
+
+    def remove(self, chunk_ids: Sequence[int]) -> int:
+        """删除指定chunk的向量,只压缩其所在的簇"""
+        with self._lock:
+            if self._training_log is not None:
+                self._training_log.update(int(cid) for cid in chunk_ids)
+            removed = self._delete(self._lists, self._assignments, chunk_ids)
+            if removed:
+                self._mark_dirty()
+            return removed
+
+    @staticmethod
+    def _delete(lists: List[FlatVectorIndex], assignments: Dict[int, int], chunk_ids) -> int:
+        groups: Dict[int, List[int]] = {}
+        for chunk_id in chunk_ids:
+            list_no = assignments.pop(int(chunk_id), None)
+            if list_no is not None:
+                groups.setdefault(list_no, []).append(int(chunk_id))
+        return sum(lists[list_no].remove(ids) for list_no, ids in groups.items())
+
+    def train(self):
+        """
+        用当前全部向量训练聚类中心并重新分配(数据分布明显变化时也可手动调用)
+
+        只在导出快照和替换簇时持有锁,k-means和重新分配在锁外进行,期间检索和写入照常;
+        训练期间写入或删除的chunk在替换时按索引中的最新内容重放到新的簇。
+        """
+        with self._lock:
+            if self._training_log is not None:
+                return
+            chunk_ids, document_ids, categories, vectors = self._export()
+            if len(chunk_ids) < self.nlist:
+                return
+            self._training_log = set()
+
+        try:
+            centroids = train_centroids(vectors, self.nlist)
+            lists = [FlatVectorIndex(self.dim) for _ in range(self.nlist)]
+            assignments: Dict[int, int] = {}
+            self._insert(lists, assignments, centroids, chunk_ids, document_ids, categories, vectors)
+        except BaseException:
+            with self._lock:
+                self._training_log = None
+            raise
+
+        with self._lock:
+            touched, self._training_log = self._training_log, None
+            if touched:
+                self._delete(lists, assignments, touched)
+                current = self._export(touched)
+                if len(current[0]):
+                    self._insert(lists, assignments, centroids, *current)
+            self.centroids = centroids
+            self._lists = lists
+            self._assignments = assignments
+            self._dirty = True
+            # 簇分配整体变化,尽快落盘,不等保存间隔
+            self._schedule_save()
+        print(f"IVF索引训练完成: {len(assignments)}个向量, {self.nlist}个簇")
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        category: Optional[str] = None,
+        min_score: Optional[float] = None,
+        n_probe: Optional[int] = None,
+        candidate_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        近似检索与查询向量最相似的chunk
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回结果数
+            category: 限定分类
+            min_score: 最小余弦相似度
+            n_probe: 本次检索扫描的簇数量(默认使用实例配置)
+            candidate_ids: 预过滤得到的候选chunk ID,指定后直接对候选做精确打分,不再按簇探测
+
+        Returns:
+            按得分降序排列的(chunk_id, score)列表
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        # 只在取簇列表和聚类中心时持有锁,各簇的打分在锁外进行(训练替换的是新列表,不修改旧列表)
+        with self._lock:
+            if not self._assignments or top_k <= 0:
+                return []
+            lists, centroids = self._lists, self.centroids
+            groups: Dict[int, List[int]] = {}
+            if candidate_ids is not None:
+                for chunk_id in candidate_ids:
+                    list_no = self._assignments.get(int(chunk_id))
+                    if list_no is not None:
+                        groups.setdefault(list_no, []).append(int(chunk_id))
+
+        hits: List[Tuple[int, float]] = []
+        if candidate_ids is not None:
+            for list_no, ids in groups.items():
+                hits.extend(lists[list_no].search(query, top_k, category, min_score, ids))
+        else:
+            if centroids is not None:
+                n_probe = min(n_probe or self.n_probe, len(centroids))
+                centroid_scores = centroids @ query
+                probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+            else:
+                probes = [0]
+            for list_no in probes:
+                hits.extend(lists[list_no].search(query, top_k, category, min_score))
+
+        return heapq.nlargest(top_k, hits, key=lambda hit: hit[1])
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]], np.ndarray]:
+        """导出索引内容的副本: (chunk_ids, document_ids, categories, 归一化后的向量矩阵)"""
+        with self._lock:
+            return self._export()
+
+    def _export(self, chunk_ids: Optional[Sequence[int]] = None):
+        """导出全部(或指定chunk的)内容,调用方需持有锁"""
+        if chunk_ids is None:
+            parts = [index.export() for index in self._lists if len(index)]
+        else:
+            groups: Dict[int, List[int]] = {}
+            for chunk_id in chunk_ids:
+                list_no = self._assignments.get(int(chunk_id))
+                if list_no is not None:
+                    groups.setdefault(list_no, []).append(int(chunk_id))
+            parts = [self._lists[list_no].export(ids) for list_no, ids in groups.items()]
+        if not parts:
+            empty_ids = np.empty(0, dtype=np.int64)
+            return empty_ids, empty_ids, [], np.empty((0, self.dim or 0), dtype=np.float32)
+        return (
+            np.concatenate([p[0] for p in parts]),
+            np.concatenate([p[1] for p in parts]),
+            [c for p in parts for c in p[2]],
+            np.concatenate([p[3] for p in parts])
+        )
+
+    # ==================== 后台任务 ====================
+
+    def _schedule(self, task: Callable[[], None]):
+        """提交后台任务(单线程依次执行,调用方需持有锁)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="ivf-index")
+        self._pending = [future for future in self._pending if not future.done()]
+        self._pending.append(self._executor.submit(self._run_task, task))
+
+    @staticmethod
+    def _run_task(task: Callable[[], None]):
+        try:
+            task()
+        except Exception as e:
+            print(f"IVF索引后台任务失败: {str(e)}")
+
+    def _train_task(self):
+        try:
+            self.train()
+        finally:
+            with self._lock:
+                self._train_scheduled = False
+
+    def _save_task(self):
+        with self._lock:
+            self._save_scheduled = False
+        self.save()
+
+    def _schedule_save(self):
+        if self.path and not self._save_scheduled:
+            self._save_scheduled = True
+            self._schedule(self._save_task)
+
+    def wait(self):
+        """等待已提交的后台训练和保存完成(脚本批量写入后需要立即使用训练好的索引时调用)"""
+        while True:
+            with self._lock:
+                pending = [future for future in self._pending if not future.done()]
+                self._pending = pending
+            if not pending:
+                return
+            futures_wait(pending)
+
+    def close(self):
+        """等待后台任务完成,并保存尚未落盘的修改(进程退出前调用)"""
+        self.wait()
+        if self._dirty:
+            self.save()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    # ==================== 持久化 ====================
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if time.monotonic() - self._last_saved >= self.save_interval:
+            self._schedule_save()
+
+    def save(self, path: Optional[str] = None):
+        """
+        保存索引到本地文件(先写临时文件再原子替换)
+
+        只在导出快照时持有索引锁,序列化和写文件在锁外进行。
+        文件中同时记录embedding模型和内容指纹,加载时据此判断文件是否过期。
+        """
+        path = path or self.path
+        if not path:
+            return
+        with self._save_lock:
+            with self._lock:
+                list_sizes = np.array([len(index) for index in self._lists], dtype=np.int64)
+                chunk_ids, document_ids, categories, vectors = self._export()
+                centroids = self.centroids if self.is_trained else np.empty((0, self.dim or 0), dtype=np.float32)
+                self._dirty = False
+                self._last_saved = time.monotonic()
+
+            names = sorted({c for c in categories if c is not None})
+            codes = {name: i for i, name in enumerate(names)}
+            category_codes = np.array([codes.get(c, -1) for c in categories], dtype=np.int32)
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.savez(
+                        f,
+                        centroids=centroids,
+                        list_sizes=list_sizes,
+                        chunk_ids=chunk_ids,
+                        document_ids=document_ids,
+                        category_codes=category_codes,
+                        category_names=np.array(names, dtype=str),
+                        vectors=vectors,
+                        embedding_model=np.array(get_embedding_provider().model_name),
+                        fingerprint=np.array(index_fingerprint(chunk_ids, category_codes, names))
+                    )
+                os.replace(tmp_path, path)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def load(self, path: Optional[str] = None) -> Dict[str, Optional[str]]:
+        """
+        从本地文件恢复索引,保持原有的簇分配
+
+        Returns:
+            文件中记录的元数据: embedding_model和fingerprint(旧版文件没有时为None)
+        """
+        path = path or self.path
+        with self._lock, np.load(path) as data:
+            names = list(data["category_names"])
+            category_codes = data["category_codes"]
+            categories = [names[code] if code >= 0 else None for code in category_codes]
+            vectors = data["vectors"]
+            centroids = data["centroids"]
+            chunk_ids = data["chunk_ids"]
+            document_ids = data["document_ids"]
+            metadata = {
+                key: str(data[key]) if key in data.files else None
+                for key in ("embedding_model", "fingerprint")
+            }
+
+            self.dim = vectors.shape[1] if vectors.size else (centroids.shape[1] or None)
+            self.centroids = centroids if len(centroids) else None
+            self._lists = []
+            self._assignments = {}
+            offset = 0
+            for list_no, size in enumerate(data["list_sizes"]):
+                index = FlatVectorIndex(self.dim)
+                end = offset + int(size)
+                if size:
+                    ids = chunk_ids[offset:end]
+                    index.add(ids, document_ids[offset:end], categories[offset:end], vectors[offset:end])
+                    for chunk_id in ids:
+                        self._assignments[int(chunk_id)] = list_no
+                self._lists.append(index)
+                offset = end
+            self._dirty = False
+        return metadata
+
+    def load_from_db(self, db: Session, batch_size: int = 5000):
+        """
+        加载索引: 本地文件与数据库中的已向量化chunk一致时直接读文件,否则从数据库重建并保存
+
+        一致指embedding模型相同,且按分类统计的(chunk数量, ID之和, 最大ID)相同:
+        新增/删除chunk、修改分类、标记近似重复、切换模型后重新向量化都会使文件失效。
+        """
+        if self.path and os.path.exists(self.path):
+            metadata = self.load()
+            if (metadata["embedding_model"] == get_embedding_provider().model_name
+                    and metadata["fingerprint"] == db_fingerprint(db)):
+                self.loaded = True
+                with self._lock:
+                    if (not self.is_trained and not self._train_scheduled
+                            and len(self) >= self.nlist * self.min_points_per_list):
+                        self._train_scheduled = True
+                        self._schedule(self._train_task)
+                return
+            print("本地索引文件与数据库不一致,从数据库重建")
+            # 文件已过期,丢弃后从数据库重建
+            self.centroids = None
+            self._lists = [FlatVectorIndex()]
+            self._assignments = {}
+
+        chunk_ids, document_ids, categories, vectors = fetch_chunk_vectors(db, batch_size)
+        if chunk_ids:
+            self.add(chunk_ids, document_ids, categories, vectors)
+        self.save()
+        self.loaded = True
+
+
+def _dump_fingerprint(stats: Dict[Optional[str], Tuple[int, int, int]]) -> str:
+    items = sorted(stats.items(), key=lambda item: (item[0] is not None, item[0] or ""))
+    return json.dumps([[category, *map(int, values)] for category, values in items], ensure_ascii=False)
+
+
+def index_fingerprint(chunk_ids: np.ndarray, category_codes: np.ndarray, names: Sequence[str]) -> str:
+    """索引内容的指纹: 按分类统计的(chunk数量, ID之和, 最大ID)"""
+    stats = {}
+    for code in np.unique(category_codes):
+        ids = chunk_ids[category_codes == code]
+        stats[names[code] if code >= 0 else None] = (len(ids), int(ids.sum()), int(ids.max()))
+    return _dump_fingerprint(stats)
+
+
+def db_fingerprint(db: Session) -> str:
+    """数据库中当前embedding模型下已向量化chunk的指纹(与index_fingerprint的算法一致)"""
+    rows = db.query(
+        KnowledgeChunk.category,
+        func.count(KnowledgeChunk.id),
+        func.sum(KnowledgeChunk.id),
+        func.max(KnowledgeChunk.id)
+    ).filter(*vectorized_chunk_filter()).group_by(KnowledgeChunk.category).all()
+    return _dump_fingerprint({category: (count, total, max_id) for category, count, total, max_id in rows})
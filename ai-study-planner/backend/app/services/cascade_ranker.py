@@ -0,0 +1,98 @@
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .lexical_index import tokenize
+
+# 第二阶段各特征的权重(特征均已归一化到[0, 1])
+CASCADE_WEIGHTS = {
+    "vector": 0.55,      # 查询向量与chunk向量的精确余弦相似度
+    "lexical": 0.25,     # BM25得分(除以候选中的最高分)
+    "coverage": 0.12,    # 查询词在chunk内容/文档标题/关键词中出现的比例
+    "stage": 0.05,       # 文档适用阶段与期望阶段一致
+    "difficulty": 0.03,  # chunk难度与期望难度一致
+}
+
+# 每处理这么多个候选检查一次是否超出时间预算
+_DEADLINE_CHECK_INTERVAL = 32
+
+
+class CascadeRanker:
+    """
+    级联检索的第二阶段: 对第一阶段召回的少量候选做较精细的打分
+
+    候选按第一阶段的名次依次打分,超出时间预算时停止,已打分的候选按新得分排在前面,
+    未打分的候选保持第一阶段顺序排在其后,因此任何时候都能返回当前最好的结果。
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(CASCADE_WEIGHTS, **(weights or {}))
+
+    def rerank(
+        self,
+        query: str,
+        candidate_ids: Sequence[int],
+        rows: Dict[int, Dict[str, Any]],
+        vector_scores: Optional[Dict[int, float]],
+        lexical_scores: Dict[int, float],
+        applicable_stage: Optional[str] = None,
+        preferred_difficulty: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Tuple[int, float]], int]:
+        """
+        Args:
+            query: 查询文本
+            candidate_ids: 第一阶段的候选chunk ID(按名次排列)
+            rows: chunk ID -> {"search_text"(见build_search_text), "applicable_stage", "difficulty_level"}
+            vector_scores: chunk ID -> 余弦相似度,查询向量不可用时为None(不计向量特征)
+            lexical_scores: chunk ID -> BM25得分
+            applicable_stage: 期望的备考阶段
+            preferred_difficulty: 期望的难度等级
+            deadline: time.perf_counter()截止时间
+
+        Returns:
+            ((chunk_id, score)按得分降序的列表, 实际完成打分的候选数)
+        """
+        terms = set(tokenize(query))
+        top_lexical = max(lexical_scores.values(), default=0.0)
+        weights = self.weights
+
+        scored: List[Tuple[int, float]] = []
+        for position, chunk_id in enumerate(candidate_ids):
+            if (
+                deadline is not None
+                and position % _DEADLINE_CHECK_INTERVAL == 0
+                and position > 0
+                and time.perf_counter() >= deadline
+            ):
+                break
+            row = rows.get(chunk_id)
+            if row is None:
+                continue
+
+            score = 0.0
+            if vector_scores is not None:
+                score += weights["vector"] * max(vector_scores.get(chunk_id, 0.0), 0.0)
+            if top_lexical > 0:
+                score += weights["lexical"] * lexical_scores.get(chunk_id, 0.0) / top_lexical
+            if terms:
+                text = row["search_text"]
+                score += weights["coverage"] * sum(1 for term in terms if term in text) / len(terms)
+            if applicable_stage and row.get("applicable_stage") == applicable_stage:
+                score += weights["stage"]
+            if preferred_difficulty and row.get("difficulty_level") == preferred_difficulty:
+                score += weights["difficulty"]
+            scored.append((chunk_id, score))
+
+        completed = len(scored)
+        scored.sort(key=lambda item: item[1], reverse=True)
+        scored_ids = {chunk_id for chunk_id, _ in scored}
+        # 未来得及打分的候选排在后面,得分取已打分结果的最低分以下,保持第一阶段顺序
+        floor = scored[-1][1] if scored else 0.0
+        rest = [chunk_id for chunk_id in candidate_ids if chunk_id not in scored_ids and chunk_id in rows]
+        scored.extend((chunk_id, floor * (1 - (i + 1) / (len(rest) + 1))) for i, chunk_id in enumerate(rest))
+        return scored, completed
+
+
+def build_search_text(content: str, title: Optional[str], keywords: Optional[Sequence[str]]) -> str:
+    """覆盖率特征匹配的文本(小写,与tokenize一致)"""
+    return "\n".join([content, title or "", " ".join(keywords or [])]).lower()
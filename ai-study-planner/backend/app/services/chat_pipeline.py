@@ -0,0 +1,145 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.user_profile import UserProfile
+from .ai_service import AIService
+from .knowledge_service import KnowledgeService
+from .user_profile_service import UserProfileService
+
+
+class PreparedChat:
+    """调用模型前准备好的对话数据"""
+
+    def __init__(
+        self,
+        full_messages: List[Dict[str, str]],
+        user_profile: Optional[UserProfile],
+        knowledge_context: str,
+        timings: Dict[str, Any]
+    ):
+        self.full_messages = full_messages
+        self.user_profile = user_profile
+        self.knowledge_context = knowledge_context
+        self.timings = timings
+
+
+class ChatPipeline:
+    """
+    对话请求的模型前处理流水线
+
+    用户画像查询和知识库检索互不依赖,并发执行,各自有时间预算:
+    - 画像查询在线程中用独立的数据库会话执行,超时或失败时不带画像继续
+    - 知识库检索(查询向量、检索、写检索历史)使用独立的数据库会话,阻塞的查询和打分都在线程中执行,
+      超时或失败时跳过,不带知识库上下文继续
+    两者都完成(或超时)后再构建系统提示词,模型前的耗时取决于较慢的一步而不是各步之和。
+    """
+
+    def __init__(
+        self,
+        ai_service: Optional[AIService] = None,
+        profile_timeout: Optional[float] = None,
+        retrieval_timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            ai_service: 构建提示词和调用模型的AI服务
+            profile_timeout: 画像查询的时间预算秒数(默认CHAT_PROFILE_TIMEOUT,<=0不限制)
+            retrieval_timeout: 知识库检索的时间预算秒数(默认CHAT_RETRIEVAL_TIMEOUT,<=0不限制)
+        """
+        self.ai_service = ai_service or AIService()
+        self.profile_timeout = settings.CHAT_PROFILE_TIMEOUT if profile_timeout is None else profile_timeout
+        self.retrieval_timeout = settings.CHAT_RETRIEVAL_TIMEOUT if retrieval_timeout is None else retrieval_timeout
+
+    async def prepare(
+        self,
+        messages: List[Dict[str, str]],
+        user_id: Optional[str] = None,
+        enable_knowledge_base: bool = True
+    ) -> PreparedChat:
+        """
+        并发获取用户画像和知识库上下文,构建发送给模型的完整消息列表
+
+        Args:
+            messages: 对话历史(最后一条为当前用户消息)
+            user_id: 用户ID(为空时不查询画像、不检索知识库)
+            enable_knowledge_base: 是否检索知识库
+        """
+        started = time.perf_counter()
+        timings: Dict[str, Any] = {}
+
+        profile_step = self._run_step(
+            "profile", asyncio.to_thread(self._load_profile, user_id), self.profile_timeout, timings
+        ) if user_id else _none()
+        retrieval_step = self._run_step(
+            "retrieval", self._retrieve(messages, user_id), self.retrieval_timeout, timings
+        ) if enable_knowledge_base and user_id else _none()
+        user_profile, knowledge_context = await asyncio.gather(profile_step, retrieval_step)
+
+        full_messages = await self.ai_service.build_messages(
+            messages,
+            user_profile=user_profile,
+            user_id=user_id,
+            knowledge_context=knowledge_context or ""
+        )
+        timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        return PreparedChat(full_messages, user_profile, knowledge_context or "", timings)
+
+    @staticmethod
+    async def _run_step(
+        name: str,
+        step: Awaitable[Any],
+        timeout: float,
+        timings: Dict[str, Any]
+    ) -> Any:
+        """执行一步并记录耗时(毫秒),超时或失败时返回None"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(step, timeout) if timeout and timeout > 0 else await step
+        except asyncio.TimeoutError:
+            timings[f"{name}_skipped"] = "timeout"
+            print(f"对话流水线步骤{name}超过{timeout}秒,已跳过")
+        except Exception as e:
+            timings[f"{name}_skipped"] = "error"
+            print(f"对话流水线步骤{name}失败,已跳过: {str(e)}")
+        finally:
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        return None
+
+    @staticmethod
+    def _load_profile(user_id: str) -> Optional[UserProfile]:
+        """在独立会话中查询用户画像(请求的会话不能跨线程使用);关闭会话后已加载的字段仍可读取"""
+        db = SessionLocal()
+        try:
+            return UserProfileService.get_profile_by_user_id(db, user_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def _retrieve(messages: List[Dict[str, str]], user_id: str) -> str:
+        """
+        检索知识库上下文
+
+        超时时只取消对检索结果的等待,检索任务本身继续执行到结束再关闭自己的会话
+        (线程中可能仍在使用该会话,不能在取消时关闭)
+        """
+        task = asyncio.ensure_future(ChatPipeline._retrieve_in_session(
+            messages[-1]["content"] if messages else "",
+            str(user_id)
+        ))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _retrieve_in_session(user_message: str, user_id: str) -> str:
+        db = SessionLocal()
+        try:
+            return await KnowledgeService(db).get_context_for_chat(user_message=user_message, user_id=user_id)
+        finally:
+            db.close()
+
+
+async def _none() -> None:
+    return None
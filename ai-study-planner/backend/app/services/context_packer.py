@@ -0,0 +1,238 @@
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from .text_splitter import estimate_tokens, sentence_ends
+
+# 每条参考内容的格式开销("\n参考1: "等)按token计
+_PASSAGE_OVERHEAD_TOKENS = 4
+
+# 相邻chunk的重叠部分至少这么长才会被识别并去除,避免偶然相同的标点被当作重叠
+_MIN_OVERLAP_CHARS = 8
+
+
+class ContextPassage(NamedTuple):
+    """装入对话上下文的一段知识"""
+    text: str
+    document_id: int
+    document_title: str
+    chunk_indexes: Tuple[int, ...]
+    score: float
+    tokens: int
+    trimmed: bool
+
+
+class _Candidate(NamedTuple):
+    text: str
+    document_id: int
+    document_title: str
+    chunk_indexes: Tuple[int, ...]
+    score: float
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[str]:
+    """字符n-gram集合(忽略空白)"""
+    compact = "".join(text.split())
+    if len(compact) <= size:
+        return frozenset([compact]) if compact else frozenset()
+    return frozenset(compact[i:i + size] for i in range(len(compact) - size + 1))
+
+
+def shingle_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """重叠系数 |A∩B| / min(|A|, |B|),一段内容被另一段包含时也接近1"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def strip_overlap(previous: str, text: str) -> str:
+    """去掉text开头与previous末尾重复的部分(切分时相邻chunk的重叠)"""
+    for k in range(min(len(previous), len(text)), _MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:k]):
+            return text[k:].lstrip()
+    return text
+
+
+class ContextPacker:
+    """
+    在token预算内组装对话用的知识库上下文
+
+    1. 同一文档中相邻的chunk合并为一段,去掉切分时产生的重叠部分
+    2. 按最大边际相关性(MMR)排序,与已选内容的字符n-gram相似度超过阈值的近似重复内容直接丢弃
+    3. 以MMR得分为价值、估算token数为代价做分组背包: 每段可以整段装入,也可以在句子边界截取前半部分
+       (价值按保留比例折算),在预算内取总价值最大的组合,而不是遇到第一段放不下就停止
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1500,
+        mmr_lambda: float = 0.7,
+        duplicate_threshold: float = 0.8,
+        budget_resolution: int = 128,
+        max_trim_options: int = 8
+    ):
+        """
+        Args:
+            max_tokens: 上下文的token预算
+            mmr_lambda: MMR中相关性的权重(其余为与已选内容相似度的惩罚权重)
+            duplicate_threshold: 相似度达到该值视为近似重复
+            budget_resolution: 背包求解时预算划分的格数(代价按格向上取整,控制计算量)
+            max_trim_options: 每段内容最多考虑的截断位置数
+        """
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.budget_resolution = budget_resolution
+        self.max_trim_options = max(2, max_trim_options)
+
+    def pack(self, results: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> List[ContextPassage]:
+        """
+        Args:
+            results: KnowledgeService.search()的结果(按相关性降序)
+            max_tokens: 覆盖默认的token预算
+
+        Returns:
+            装入的内容,按MMR顺序排列
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        candidates = self._merge_adjacent(results)
+        if not candidates or budget <= 0:
+            return []
+
+        ranked = self._rank_mmr(candidates)
+        options = [self._options(candidate, value, budget) for candidate, value in ranked]
+        chosen = self._knapsack(options, budget)
+
+        passages = []
+        for (candidate, _), choice in zip(ranked, chosen):
+            if choice is None:
+                continue
+            tokens, _, text = choice
+            passages.append(ContextPassage(
+                text=text,
+                document_id=candidate.document_id,
+                document_title=candidate.document_title,
+                chunk_indexes=candidate.chunk_indexes,
+                score=candidate.score,
+                tokens=tokens,
+                trimmed=len(text) < len(candidate.text)
+            ))
+        return passages
+
+    @staticmethod
+    def _merge_adjacent(results: List[Dict[str, Any]]) -> List[_Candidate]:
+        """同一文档中chunk_index连续的结果合并为一段(得分取最高值)"""
+        by_document: Dict[int, List[Dict[str, Any]]] = {}
+        for result in results:
+            by_document.setdefault(result["document_id"], []).append(result)
+
+        candidates = []
+        for document_id, items in by_document.items():
+            items.sort(key=lambda item: item["metadata"].get("chunk_index", 0))
+            run: List[Dict[str, Any]] = []
+            for item in items + [None]:
+                if run and item is not None and (
+                    item["metadata"].get("chunk_index", 0) == run[-1]["metadata"].get("chunk_index", 0) + 1
+                ):
+                    run.append(item)
+                    continue
+                if run:
+                    text = run[0]["content"]
+                    for previous, current in zip(run, run[1:]):
+                        addition = strip_overlap(previous["content"], current["content"])
+                        if addition:
+                            text += "\n" + addition
+                    candidates.append(_Candidate(
+                        text=text,
+                        document_id=document_id,
+                        document_title=run[0]["metadata"].get("document_title", ""),
+                        chunk_indexes=tuple(r["metadata"].get("chunk_index", 0) for r in run),
+                        score=max(r["score"] for r in run)
+                    ))
+                run = [item] if item is not None else []
+        return candidates
+
+    def _rank_mmr(self, candidates: List[_Candidate]) -> List[Tuple[_Candidate, float]]:
+        """按MMR贪心排序,返回(候选, MMR得分);近似重复的候选被丢弃"""
+        top_score = max(candidate.score for candidate in candidates)
+        relevance = [candidate.score / top_score if top_score > 0 else 1.0 for candidate in candidates]
+        features = [shingles(candidate.text) for candidate in candidates]
+        max_similarity = [0.0] * len(candidates)
+        remaining = set(range(len(candidates)))
+
+        ranked = []
+        while remaining:
+            best = max(
+                remaining,
+                key=lambda i: (self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * max_similarity[i], -i)
+            )
+            remaining.discard(best)
+            value = self.mmr_lambda * relevance[best] - (1 - self.mmr_lambda) * max_similarity[best]
+            if value > 0:
+                ranked.append((candidates[best], value))
+
+            for i in list(remaining):
+                similarity = shingle_similarity(features[best], features[i])
+                if similarity >= self.duplicate_threshold:
+                    remaining.discard(i)
+                elif similarity > max_similarity[i]:
+                    max_similarity[i] = similarity
+        return ranked
+
+    def _options(self, candidate: _Candidate, value: float, budget: int) -> List[Tuple[int, float, str]]:
+        """候选可装入的方式: 整段或在句子边界截取的前缀,返回[(token数, 价值, 文本)]"""
+        # 句子边界不会落在token内部,前缀token数可以逐句累加
+        prefixes = []
+        tokens = 0
+        start = 0
+        for end in sentence_ends(candidate.text) + [len(candidate.text)]:
+            tokens += estimate_tokens(candidate.text[start:end])
+            start = end
+            if tokens + _PASSAGE_OVERHEAD_TOKENS > budget:
+                break
+            if tokens and (not prefixes or tokens > prefixes[-1][0]):
+                prefixes.append((tokens, end))
+        full_tokens = tokens if start == len(candidate.text) else estimate_tokens(candidate.text)
+        if not prefixes or full_tokens == 0:
+            return []
+
+        # 截断位置过多时均匀保留一部分(始终保留最长的前缀),控制背包计算量
+        if len(prefixes) > self.max_trim_options:
+            step = (len(prefixes) - 1) / (self.max_trim_options - 1)
+            prefixes = [prefixes[round(i * step)] for i in range(self.max_trim_options)]
+
+        return [
+            (
+                tokens + _PASSAGE_OVERHEAD_TOKENS,
+                value * tokens / full_tokens,
+                candidate.text[:end].rstrip()
+            )
+            for tokens, end in prefixes
+        ]
+
+    def _knapsack(
+        self,
+        options: List[List[Tuple[int, float, str]]],
+        budget: int
+    ) -> List[Optional[Tuple[int, float, str]]]:
+        """分组背包: 每个候选至多选一种装入方式,总token数不超过预算,总价值最大"""
+        unit = max(1, -(-budget // self.budget_resolution))
+        capacity = budget // unit
+
+        # 已用格数 -> (总价值, 各候选的选择)
+        states: Dict[int, Tuple[float, Tuple[int, ...]]] = {0: (0.0, ())}
+        for group in options:
+            next_states: Dict[int, Tuple[float, Tuple[int, ...]]] = {}
+            for used, (total, picks) in states.items():
+                transitions = [(used, total, -1)] + [
+                    (used - (-tokens // unit), total + value, j)
+                    for j, (tokens, value, _) in enumerate(group)
+                ]
+                for new_used, new_total, j in transitions:
+                    if new_used > capacity:
+                        continue
+                    current = next_states.get(new_used)
+                    if current is None or new_total > current[0]:
+                        next_states[new_used] = (new_total, picks + (j,))
+            states = next_states
+
+        _, picks = max(states.values(), key=lambda state: state[0])
+        return [group[j] if j >= 0 else None for group, j in zip(options, picks)]
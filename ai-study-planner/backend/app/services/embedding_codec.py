@@ -0,0 +1,118 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 向量的二进制存储格式(均为小端序):
+#   float32: dim个float32
+#   float16: dim个float16
+#   int8:    1个float32缩放系数 + dim个int8,还原时 vector = q * scale
+CODECS = ("float32", "float16", "int8")
+
+_FLOAT_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+
+def _int8_dtype(dim: int) -> np.dtype:
+    return np.dtype([("scale", "<f4"), ("q", "i1", (dim,))])
+
+
+def _check_codec(codec: str):
+    if codec not in CODECS:
+        raise ValueError(f"不支持的向量存储格式: {codec}")
+
+
+def vector_dim(blob_size: int, codec: str) -> int:
+    """根据二进制长度推算向量维度"""
+    _check_codec(codec)
+    if codec == "int8":
+        return blob_size - 4
+    return blob_size // _FLOAT_DTYPES[codec].itemsize
+
+
+def encode_vectors(vectors: np.ndarray, codec: str = "float32") -> List[bytes]:
+    """
+    把向量矩阵逐行编码为二进制
+
+    Args:
+        vectors: 形如(n, dim)的向量矩阵
+        codec: 存储格式(float32/float16/int8)
+
+    Returns:
+        每行向量对应的bytes
+    """
+    _check_codec(codec)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    n, dim = vectors.shape
+
+    if codec == "int8":
+        # 每个向量单独计算缩放系数(对称量化到[-127, 127])
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        records = np.empty(n, dtype=_int8_dtype(dim))
+        records["scale"] = scales
+        records["q"] = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127)
+        return [record.tobytes() for record in records]
+
+    data = vectors.astype(_FLOAT_DTYPES[codec])
+    return [row.tobytes() for row in data]
+
+
+def encode_vector(vector: Sequence[float], codec: str = "float32") -> bytes:
+    """编码单个向量"""
+    return encode_vectors(np.asarray(vector, dtype=np.float32), codec)[0]
+
+
+def decode_vectors(blobs: Sequence[bytes], codec: str = "float32") -> np.ndarray:
+    """
+    批量解码同一格式、同一维度的向量
+
+    先拼接成一整块内存再用np.frombuffer一次性解析,不会为每个浮点数创建Python对象
+
+    Returns:
+        形如(len(blobs), dim)的float32矩阵
+    """
+    _check_codec(codec)
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+
+    size = len(blobs[0])
+    buffer = b"".join(blobs)
+    if len(buffer) != size * len(blobs):
+        raise ValueError("向量维度不一致,无法批量解码")
+    dim = vector_dim(size, codec)
+
+    if codec == "int8":
+        records = np.frombuffer(buffer, dtype=_int8_dtype(dim))
+        return records["q"].astype(np.float32) * records["scale"][:, np.newaxis]
+
+    data = np.frombuffer(buffer, dtype=_FLOAT_DTYPES[codec]).reshape(len(blobs), dim)
+    return data.astype(np.float32)
+
+
+def decode_vector(blob: bytes, codec: str = "float32") -> np.ndarray:
+    """解码单个向量"""
+    return decode_vectors([blob], codec)[0]
+
+
+def decode_mixed(blobs: Sequence[bytes], codecs: Sequence[Optional[str]]) -> np.ndarray:
+    """
+    解码存储格式可能不同的一组向量(按格式分组批量解码,结果保持原顺序)
+
+    codec为空的行按float32处理
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+
+    groups: Dict[str, List[int]] = {}
+    for i, codec in enumerate(codecs):
+        groups.setdefault(codec or "float32", []).append(i)
+    if len(groups) == 1:
+        return decode_vectors(blobs, next(iter(groups)))
+
+    decoded = {codec: decode_vectors([blobs[i] for i in rows], codec) for codec, rows in groups.items()}
+    dim = next(iter(decoded.values())).shape[1]
+    result = np.empty((len(blobs), dim), dtype=np.float32)
+    for codec, rows in groups.items():
+        result[rows] = decoded[codec]
+    return result
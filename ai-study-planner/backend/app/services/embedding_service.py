@@ -0,0 +1,170 @@
+import asyncio
+import zlib
+from typing import List, Optional, Sequence
+
+import httpx
+import numpy as np
+
+from ..core.config import settings
+from ..core.http_client import get_http_client
+from .lexical_index import tokenize
+
+
+class BaseEmbeddingProvider:
+    """embedding提供方基类"""
+
+    model_name: str = ""
+    dimension: Optional[int] = None
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        生成文本向量
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            形如(len(texts), dimension)的float32矩阵
+        """
+        raise NotImplementedError
+
+
+class HashingEmbeddingProvider(BaseEmbeddingProvider):
+    """
+    本地特征哈希embedding(确定性、无需网络)
+
+    复用词法检索的中文n-gram分词,每个词项用crc32哈希到固定维度并带符号累加,
+    最后做L2归一化。相同文本在任何进程中都得到相同向量,适合离线环境和测试。
+    """
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+        self.model_name = f"hashing-{dimension}"
+
+    def embed_sync(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            hashes = np.fromiter(
+                (zlib.crc32(token.encode("utf-8")) for token in tokens),
+                dtype=np.uint32,
+                count=len(tokens)
+            )
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dimension, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # 纯CPU计算,放到线程池中避免阻塞事件循环
+        return await asyncio.to_thread(self.embed_sync, texts)
+
+
+class OpenAIEmbeddingProvider(BaseEmbeddingProvider):
+    """
+    OpenAI兼容的embedding接口(如阿里云百炼compatible-mode)
+
+    按batch_size分批请求,最多max_concurrency个批次并发,共享同一个HTTP连接池;
+    单个批次失败时只重试该批次,已成功的批次不会重复请求。
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        endpoint: str,
+        model_name: str,
+        dimension: Optional[int] = None,
+        batch_size: int = 16,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        timeout: float = 30.0
+    ):
+        self.api_key = api_key
+        self.endpoint = endpoint.rstrip("/")
+        self.model_name = model_name
+        self.dimension = dimension
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的HTTP客户端(并发批次数由max_concurrency控制)"""
+        return get_http_client()
+
+    async def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        payload = {"model": self.model_name, "input": batch}
+        if self.dimension:
+            payload["dimensions"] = self.dimension
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.post(
+                    f"{self.endpoint}/embeddings",
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json=payload,
+                    timeout=httpx.Timeout(self.timeout, connect=settings.HTTP_CONNECT_TIMEOUT)
+                )
+                if response.status_code == 200:
+                    data = sorted(response.json()["data"], key=lambda item: item["index"])
+                    return np.asarray([item["embedding"] for item in data], dtype=np.float32)
+                # 只有限流和服务端错误值得重试
+                if response.status_code != 429 and response.status_code < 500:
+                    raise Exception(f"Embedding API调用失败: {response.status_code} - {response.text}")
+                error = Exception(f"Embedding API调用失败: {response.status_code} - {response.text}")
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+        raise Exception(f"Embedding批次重试{self.max_retries}次后仍失败: {error}")
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results: List[Optional[np.ndarray]] = [None] * len(batches)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(i: int, batch: List[str]):
+            async with semaphore:
+                results[i] = await self._embed_batch(batch)
+
+        outcomes = await asyncio.gather(*(run(i, b) for i, b in enumerate(batches)), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return np.vstack(results)
+
+
+_embedding_provider: Optional[BaseEmbeddingProvider] = None
+
+
+def get_embedding_provider() -> BaseEmbeddingProvider:
+    """获取进程内共享的embedding提供方(由EMBEDDING_PROVIDER配置决定)"""
+    global _embedding_provider
+    if _embedding_provider is None:
+        provider = settings.EMBEDDING_PROVIDER.lower()
+        if provider == "hashing":
+            _embedding_provider = HashingEmbeddingProvider(settings.EMBEDDING_DIMENSION or 512)
+        elif provider == "openai":
+            _embedding_provider = OpenAIEmbeddingProvider(
+                api_key=settings.EMBEDDING_API_KEY or settings.AI_API_KEY,
+                endpoint=settings.EMBEDDING_ENDPOINT or settings.AI_ENDPOINT,
+                model_name=settings.EMBEDDING_MODEL_NAME,
+                dimension=settings.EMBEDDING_DIMENSION,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+                max_retries=settings.EMBEDDING_MAX_RETRIES
+            )
+        else:
+            raise ValueError(f"不支持的embedding提供方: {settings.EMBEDDING_PROVIDER}")
+    return _embedding_provider
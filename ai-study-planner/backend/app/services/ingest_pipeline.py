@@ -0,0 +1,452 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import insert
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.knowledge_base import KnowledgeChunk, VECTORIZE_DONE, VECTORIZE_PENDING
+from .embedding_codec import encode_vectors
+from .embedding_service import get_embedding_provider
+from .knowledge_service import KnowledgeService, chunk_content_hash
+from .text_splitter import TextSplitter
+
+# 支持的输入文件: JSONL每行一个文档;Markdown/文本文件每个文件一个文档
+JSONL_SUFFIXES = {".jsonl"}
+TEXT_SUFFIXES = {".md", ".markdown", ".txt"}
+
+
+# ==================== 解析与切分(在子进程中执行) ====================
+
+def _parse_text_file(path: str, default_category: Optional[str]) -> Dict[str, Any]:
+    """Markdown/文本文件: 首个一级标题作为文档标题(没有则用文件名),所在目录名作为默认分类"""
+    content = Path(path).read_text(encoding="utf-8")
+    title = Path(path).stem
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("# "):
+            title = stripped[2:].strip() or title
+            break
+        if stripped:
+            break
+    return {
+        "title": title,
+        "content": content,
+        "category": default_category or Path(path).parent.name,
+        "source": Path(path).name,
+    }
+
+
+def parse_unit(
+    unit: List[Tuple[int, str, str, str]],
+    chunk_size: int,
+    chunk_overlap: int,
+    length_unit: str,
+    default_category: Optional[str]
+) -> List[Dict[str, Any]]:
+    """
+    解析并切分一组输入记录(子进程入口,参数和返回值都需可pickle)
+
+    Args:
+        unit: [(序号, 类型jsonl/text, 来源描述, JSON行内容或文件路径)]
+
+    Returns:
+        每条记录对应 {seq, source, row, chunks, hashes} 或 {seq, source, error}
+    """
+    splitter = TextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_unit=length_unit)
+    parsed = []
+    for seq, kind, source, payload in unit:
+        try:
+            if kind == "jsonl":
+                data = json.loads(payload)
+                if isinstance(data, dict) and not data.get("category") and default_category:
+                    data["category"] = default_category
+            else:
+                data = _parse_text_file(payload, default_category)
+            row = KnowledgeService.validate_import_row(data)
+            chunks = [chunk.text for chunk in splitter.split(row["content"])]
+            parsed.append({
+                "seq": seq,
+                "source": source,
+                "row": row,
+                "chunks": chunks,
+                "hashes": [chunk_content_hash(chunk) for chunk in chunks],
+            })
+        except Exception as e:
+            parsed.append({"seq": seq, "source": source, "error": f"{type(e).__name__}: {e}"})
+    return parsed
+
+
+# ==================== 输入与断点 ====================
+
+def collect_input_files(paths: Sequence[str]) -> List[Path]:
+    """展开输入路径(目录递归查找),按路径排序保证每次运行的记录顺序一致"""
+    suffixes = JSONL_SUFFIXES | TEXT_SUFFIXES
+    files = set()
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            files.update(p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in suffixes)
+        elif path.is_file():
+            files.add(path)
+        else:
+            raise FileNotFoundError(f"输入路径不存在: {raw}")
+    return sorted(files)
+
+
+class IngestCheckpoint:
+    """
+    导入断点
+
+    每条输入记录按读取顺序编号。写入阶段的提交顺序与读取顺序不一定一致,
+    因此记录"连续完成的最大序号"以及其后零散完成的序号,恢复时跳过这两部分记录。
+    断点在每次数据库提交之后保存,进程在两者之间中断时最多重复导入一个提交批次。
+    """
+
+    def __init__(self, path: Optional[str], fingerprint: List[List[Any]]):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.committed_through = 0
+        self.extra: Set[int] = set()
+        self.imported = 0
+        self.failed = 0
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("fingerprint") != self.fingerprint:
+            raise ValueError(f"断点文件{self.path}与当前输入文件不一致,如需重新导入请使用--reset-checkpoint")
+        self.committed_through = state["committed_through"]
+        self.extra = set(state.get("extra", []))
+        self.imported = state.get("imported", 0)
+        self.failed = state.get("failed", 0)
+
+    def is_done(self, seq: int) -> bool:
+        return seq < self.committed_through or seq in self.extra
+
+    def mark_done(self, seqs: Sequence[int]):
+        self.extra.update(seqs)
+        while self.committed_through in self.extra:
+            self.extra.discard(self.committed_through)
+            self.committed_through += 1
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "fingerprint": self.fingerprint,
+                "committed_through": self.committed_through,
+                "extra": sorted(self.extra),
+                "imported": self.imported,
+                "failed": self.failed,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StageStats:
+    """单个阶段的吞吐统计(文档数、chunk数、处理耗时)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = 0
+        self.chunks = 0
+        self.busy = 0.0
+
+    def record(self, docs: int, chunks: int, elapsed: float):
+        self.docs += docs
+        self.chunks += chunks
+        self.busy += elapsed
+
+    def format(self, wall: float) -> str:
+        wall = max(wall, 1e-9)
+        return (
+            f"[{self.name}] {self.docs}篇 {self.docs / wall:.1f}篇/s, "
+            f"{self.chunks}个chunk {self.chunks / wall:.1f}个/s, 处理耗时{self.busy:.1f}s"
+        )
+
+
+# ==================== 流水线 ====================
+
+class IngestPipeline:
+    """
+    流式导入流水线: 读取 → 解析切分(进程池) → 生成向量(异步批量) → 写库(单写入者批量提交)
+
+    阶段之间用有界队列连接,下游变慢时上游自动阻塞(背压),内存占用与输入总量无关。
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        default_category: Optional[str] = None,
+        workers: Optional[int] = None,
+        parse_batch: int = 64,
+        embed_batch: int = 256,
+        embed_concurrency: int = 2,
+        commit_batch: int = 500,
+        queue_size: int = 8,
+        checkpoint_path: Optional[str] = None,
+        reset_checkpoint: bool = False,
+        skip_embedding: bool = False,
+        progress_interval: float = 10.0,
+        max_errors: int = 1000
+    ):
+        self.files = collect_input_files(paths)
+        self.default_category = default_category
+        self.workers = workers or os.cpu_count() or 1
+        self.parse_batch = parse_batch
+        self.embed_batch = embed_batch
+        self.embed_concurrency = embed_concurrency
+        self.commit_batch = commit_batch
+        self.queue_size = queue_size
+        self.skip_embedding = skip_embedding
+        self.progress_interval = progress_interval
+        self.max_errors = max_errors
+
+        fingerprint = [[str(path), path.stat().st_size] for path in self.files]
+        self.checkpoint = IngestCheckpoint(checkpoint_path, fingerprint)
+        if reset_checkpoint:
+            self.checkpoint.reset()
+        self.checkpoint.load()
+
+        self.errors: List[Dict[str, Any]] = []
+        self.stats = {name: StageStats(name) for name in ("read", "parse", "embed", "write")}
+        self._started = 0.0
+
+    def _iter_records(self) -> Iterator[Tuple[int, str, str, str]]:
+        """按固定顺序为全部输入记录编号,跳过断点中已完成的记录"""
+        seq = 0
+        for path in self.files:
+            if path.suffix.lower() in JSONL_SUFFIXES:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line_no, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        if not self.checkpoint.is_done(seq):
+                            yield seq, "jsonl", f"{path}:{line_no}", line
+                        seq += 1
+            else:
+                if not self.checkpoint.is_done(seq):
+                    yield seq, "text", str(path), str(path)
+                seq += 1
+
+    def _iter_units(self) -> Iterator[List[Tuple[int, str, str, str]]]:
+        unit = []
+        for record in self._iter_records():
+            unit.append(record)
+            if len(unit) >= self.parse_batch:
+                yield unit
+                unit = []
+        if unit:
+            yield unit
+
+    async def _read(self, out_queue: asyncio.Queue):
+        units = self._iter_units()
+        while True:
+            started = time.perf_counter()
+            unit = await asyncio.to_thread(next, units, None)
+            if unit is None:
+                return
+            self.stats["read"].record(len(unit), 0, time.perf_counter() - started)
+            await out_queue.put(unit)
+
+    async def _parse(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue, pool: ProcessPoolExecutor):
+        loop = asyncio.get_running_loop()
+        while True:
+            unit = await in_queue.get()
+            if unit is None:
+                return
+            started = time.perf_counter()
+            docs = await loop.run_in_executor(
+                pool, parse_unit, unit,
+                settings.KNOWLEDGE_CHUNK_SIZE, settings.KNOWLEDGE_CHUNK_OVERLAP,
+                settings.KNOWLEDGE_CHUNK_UNIT, self.default_category
+            )
+            self.stats["parse"].record(
+                len(docs), sum(len(doc.get("chunks", ())) for doc in docs), time.perf_counter() - started
+            )
+            await out_queue.put(docs)
+
+    async def _embed(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        provider = get_embedding_provider()
+        while True:
+            docs = await in_queue.get()
+            if docs is None:
+                in_queue.put_nowait(None)  # 留给其他embed任务
+                return
+            # 凑够embed_batch个chunk再请求,减少小批次调用
+            n_chunks = sum(len(doc.get("chunks", ())) for doc in docs)
+            while n_chunks < self.embed_batch:
+                try:
+                    more = in_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if more is None:
+                    in_queue.put_nowait(None)  # 留给其他embed任务
+                    break
+                docs.extend(more)
+                n_chunks += sum(len(doc.get("chunks", ())) for doc in more)
+
+            started = time.perf_counter()
+            texts = [chunk for doc in docs if "row" in doc for chunk in doc["chunks"]]
+            if texts and not self.skip_embedding:
+                vectors = await provider.embed(texts)
+                offset = 0
+                for doc in docs:
+                    if "row" in doc:
+                        doc["vectors"] = vectors[offset:offset + len(doc["chunks"])]
+                        offset += len(doc["chunks"])
+            self.stats["embed"].record(
+                sum(1 for doc in docs if "row" in doc), len(texts), time.perf_counter() - started
+            )
+            await out_queue.put(docs)
+
+    async def _write(self, in_queue: asyncio.Queue):
+        pending: List[Dict[str, Any]] = []
+        while True:
+            docs = await in_queue.get()
+            if docs is None:
+                break
+            pending.extend(docs)
+            if len(pending) >= self.commit_batch:
+                await asyncio.to_thread(self._commit, pending)
+                pending = []
+        if pending:
+            await asyncio.to_thread(self._commit, pending)
+
+    def _commit(self, docs: List[Dict[str, Any]]):
+        """在一个事务中写入一批文档及其chunks,提交后保存断点"""
+        started = time.perf_counter()
+        valid = [doc for doc in docs if "row" in doc]
+        for doc in docs:
+            if "error" in doc:
+                self._record_error(doc["source"], doc["error"])
+
+        db = SessionLocal()
+        try:
+            try:
+                self._insert(db, valid)
+                db.commit()
+                written = valid
+            except Exception:
+                # 整批失败时逐篇写入,定位出错的文档
+                db.rollback()
+                written = []
+                for doc in valid:
+                    try:
+                        self._insert(db, [doc])
+                        db.commit()
+                        written.append(doc)
+                    except Exception as e:
+                        db.rollback()
+                        self._record_error(doc["source"], str(e))
+        finally:
+            db.close()
+
+        self.checkpoint.imported += len(written)
+        self.checkpoint.failed += len(docs) - len(written)
+        self.checkpoint.mark_done([doc["seq"] for doc in docs])
+        self.checkpoint.save()
+        self.stats["write"].record(
+            len(written), sum(len(doc["chunks"]) for doc in written), time.perf_counter() - started
+        )
+
+    def _record_error(self, source: str, error: str):
+        # 只保留前max_errors条错误详情,避免大批量导入时错误列表无限增长
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"source": source, "error": error})
+
+    def _insert(self, db, docs: List[Dict[str, Any]]):
+        if not docs:
+            return
+        embedded = not self.skip_embedding
+        rows = []
+        for doc in docs:
+            row = dict(doc["row"])
+            row["is_vectorized"] = VECTORIZE_DONE if embedded else VECTORIZE_PENDING
+            row["chunk_count"] = len(doc["chunks"]) if embedded else 0
+            rows.append(row)
+        document_ids = KnowledgeService(db).insert_document_rows(rows)
+        if not embedded:
+            return
+
+        model_name = get_embedding_provider().model_name
+        codec = settings.EMBEDDING_STORAGE_CODEC
+        chunk_rows = []
+        for document_id, doc, row in zip(document_ids, docs, rows):
+            blobs = encode_vectors(doc["vectors"], codec) if doc["chunks"] else []
+            for i, (chunk, content_hash, blob) in enumerate(zip(doc["chunks"], doc["hashes"], blobs)):
+                chunk_rows.append({
+                    "document_id": document_id,
+                    "content": chunk,
+                    "chunk_index": i,
+                    "content_hash": content_hash,
+                    "embedding_model": model_name,
+                    "embedding_codec": codec,
+                    "embedding_blob": blob,
+                    "category": row["category"],
+                    "sub_category": row["sub_category"],
+                    "difficulty_level": row["difficulty_level"],
+                })
+        if chunk_rows:
+            db.execute(insert(KnowledgeChunk.__table__), chunk_rows)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.print_stats()
+
+    def print_stats(self):
+        wall = time.perf_counter() - self._started
+        print(f"--- 已运行{wall:.1f}s, 累计导入{self.checkpoint.imported}篇, 失败{self.checkpoint.failed}篇 ---")
+        for stage in self.stats.values():
+            print("  " + stage.format(wall))
+
+    async def run(self) -> Dict[str, Any]:
+        """执行导入,返回汇总结果"""
+        self._started = time.perf_counter()
+        units: asyncio.Queue = asyncio.Queue(self.queue_size)
+        parsed: asyncio.Queue = asyncio.Queue(self.queue_size)
+        embedded: asyncio.Queue = asyncio.Queue(self.queue_size)
+
+        async def read_stage():
+            await self._read(units)
+            for _ in range(self.workers):
+                await units.put(None)
+
+        async def parse_stage(pool):
+            await asyncio.gather(*(self._parse(units, parsed, pool) for _ in range(self.workers)))
+            await parsed.put(None)
+
+        async def embed_stage():
+            await asyncio.gather(*(self._embed(parsed, embedded) for _ in range(self.embed_concurrency)))
+            await embedded.put(None)
+
+        reporter = asyncio.create_task(self._report())
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                await asyncio.gather(read_stage(), parse_stage(pool), embed_stage(), self._write(embedded))
+        finally:
+            reporter.cancel()
+
+        return {
+            "imported": self.checkpoint.imported,
+            "failed": self.checkpoint.failed,
+            "errors": self.errors,
+            "elapsed": time.perf_counter() - self._started,
+        }
@@ -1,21 +1,143 @@
-from typing import List, Dict, Optional, Tuple, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from typing import List, Dict, Iterator, Optional, Tuple, Any, Callable, TypeVar
+from sqlalchemy.orm import Session, defer
+from sqlalchemy import or_, and_, func, insert, text
+from collections import defaultdict
+import asyncio
+import hashlib
 import json
+import time
+import unicodedata
+import numpy as np
 from datetime import datetime
 
-from ..models.knowledge_base import KnowledgeDocument, KnowledgeChunk, SearchHistory
+from ..models.knowledge_base import (
+    KnowledgeDocument,
+    KnowledgeChunk,
+    VECTORIZE_DONE,
+    VECTORIZE_IMPORTING,
+    VECTORIZE_PENDING,
+    VECTORIZE_STATUS_NAMES,
+)
+from ..core.cache import GenerationCounter, TTLLRUCache
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .cascade_ranker import CascadeRanker, build_search_text
+from .context_packer import ContextPacker
+from .embedding_codec import decode_vector, encode_vectors
+from .embedding_service import get_embedding_provider
+from .lexical_index import build_chunk_text, get_lexical_index
+from .near_duplicate import (
+    content_signature,
+    decode_signature,
+    encode_signature,
+    forget_chunks,
+    forget_document,
+    get_chunk_lsh,
+    get_document_lsh,
+    MinHashLSH,
+)
+from .search_history_writer import get_search_history_writer
+from .text_splitter import TextChunk, TextSplitter
+from .vector_index import get_vector_index, rebuild_vector_index
+from .vectorization_worker import get_vectorization_worker
+
+
+# 知识库版本号: 文档增删改及向量化完成时递增,检索结果缓存键包含版本号,因此写入后旧结果不会再被命中。
+# 版本号只在进程内有效,多进程部署时其他进程的缓存依靠TTL过期。
+knowledge_generation = GenerationCounter()
+
+# 查询向量缓存(与知识库内容无关,不随版本号失效)和检索结果缓存
+query_embedding_cache = TTLLRUCache(settings.KNOWLEDGE_QUERY_CACHE_SIZE, settings.KNOWLEDGE_QUERY_CACHE_TTL)
+search_result_cache = TTLLRUCache(settings.KNOWLEDGE_RESULT_CACHE_SIZE, settings.KNOWLEDGE_RESULT_CACHE_TTL)
+
+# 热门查询的预计算结果(由query_warmup定期刷新,不设过期时间;键与结果缓存相同,版本号变化后自然失效)
+hot_query_cache = TTLLRUCache(settings.KNOWLEDGE_WARMUP_QUERIES * 4, None)
+
+
+# MySQL自增锁模式检测结果(进程内只查询一次)
+_mysql_autoinc_consecutive: Optional[bool] = None
+
+
+def normalize_query(query: str) -> str:
+    """查询归一化(全角转半角、转小写、合并空白),作为缓存键"""
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+def chunk_content_hash(text: str) -> str:
+    """chunk内容的SHA-256十六进制摘要"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[int, float]]],
+    k: int = 60,
+    top_k: int = 5
+) -> List[Tuple[int, float]]:
+    """
+    倒数排名融合(RRF): score(d) = Σ 1 / (k + rank_i(d))
+    
+    只依赖各路结果的排名,不需要对不同量纲的得分(BM25/余弦相似度)做归一化
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+T = TypeVar("T")
+
+
+def run_in_session(fn: Callable[["KnowledgeService"], T]) -> T:
+    """
+    用独立的数据库会话执行fn(KnowledgeService),供asyncio.to_thread调用
+
+    后台任务把切分、比对、写库和写索引放到线程中执行,会话不能跨线程共享,每个线程步骤使用自己的会话
+    """
+    db = SessionLocal()
+    try:
+        return fn(KnowledgeService(db))
+    finally:
+        db.close()
+
+
+class VectorizationPlan:
+    """向量化的切分与比对结果(在线程中计算,embedding完成后据此写库)"""
+
+    def __init__(
+        self,
+        document_id: int,
+        chunk_count: int,
+        kept: List[Tuple[int, int, str]],
+        stale_ids: List[int],
+        new_chunks: List[str],
+        new_positions: List[int],
+        new_hashes: List[str]
+    ):
+        self.document_id = document_id
+        self.chunk_count = chunk_count
+        # 复用的chunk: (chunk ID, 新的顺序, 内容哈希)
+        self.kept = kept
+        self.stale_ids = stale_ids
+        self.new_chunks = new_chunks
+        self.new_positions = new_positions
+        self.new_hashes = new_hashes
 
 
 class KnowledgeService:
     """知识库服务 - 处理文档管理、向量检索和RAG集成"""
     
-    def __init__(self, db: Session):
+    # 冗余存储在chunk上或参与BM25检索的文档字段,变化后需同步到chunks和索引(无需重新生成向量)
+    CHUNK_METADATA_FIELDS = {"title", "keywords", "category", "sub_category", "difficulty_level"}
+    
+    def __init__(self, db: Optional[Session] = None):
+        """
+        Args:
+            db: 数据库会话(后台向量化的各步骤在线程中使用各自的会话,见run_in_session,可不传)
+        """
         self.db = db
-        # TODO: 后续集成向量数据库客户端(如Milvus、Qdrant、Chroma等)
-        self.vector_db = None
-        # TODO: 后续集成embedding模型(如OpenAI embeddings、本地模型等)
-        self.embedding_model = None
+        # 向量索引为进程级单例,首次检索时从数据库加载(见vector_index.get_vector_index)
+        self.embedding_provider = get_embedding_provider()
     
     # ==================== 文档管理 ====================
     
@@ -30,11 +152,15 @@ class KnowledgeService:
         source: Optional[str] = None,
         author: Optional[str] = None,
         difficulty_level: Optional[str] = None,
-        applicable_stage: Optional[str] = None
+        applicable_stage: Optional[str] = None,
+        dedup_policy: Optional[str] = None
     ) -> KnowledgeDocument:
         """
         添加知识库文档
         
+        内容与已有文档近似重复(MinHash估计的Jaccard相似度达到KNOWLEDGE_DEDUP_THRESHOLD)时按策略处理:
+        flag: 正常添加并在duplicate_of中记录原文档; skip: 不添加,返回原文档; merge: 用新内容更新原文档并返回
+        
         Args:
             title: 文档标题
             content: 文档内容
@@ -46,10 +172,26 @@ class KnowledgeService:
             author: 作者
             difficulty_level: 难度等级(基础/中等/困难)
             applicable_stage: 适用备考阶段(基础期/强化期/冲刺期)
+            dedup_policy: 近似重复处理策略(off/flag/skip/merge),默认使用配置KNOWLEDGE_DEDUP_POLICY
         
         Returns:
-            创建的文档对象
+            创建的文档对象(skip/merge时为已有文档)
         """
+        policy = self._resolve_dedup_policy(dedup_policy)
+        # 签名计算(大文档可达秒级)和LSH查找在线程中执行,不阻塞事件循环
+        signature = await asyncio.to_thread(content_signature, content)
+        original = await asyncio.to_thread(self._find_duplicate_document, signature) if policy != "off" else None
+        if original is not None:
+            # 原文档内容不能重新切分(上传的大文件)时无法合并,改为只标记
+            if policy == "merge" and self.resplit_blocked_reason(original):
+                policy = "flag"
+            if policy in ("skip", "merge"):
+                print(f"文档《{title}》与已有文档{original.id}《{original.title}》近似重复,处理策略: {policy}")
+            if policy == "skip":
+                return original
+            if policy == "merge":
+                return await self._merge_into(original, content, keywords)
+        
         document = KnowledgeDocument(
             title=title,
             content=content,
@@ -61,15 +203,19 @@ class KnowledgeService:
             author=author,
             difficulty_level=difficulty_level,
             applicable_stage=applicable_stage,
-            is_vectorized=0
+            is_vectorized=VECTORIZE_PENDING,
+            minhash=encode_signature(signature),
+            duplicate_of=original.id if original is not None else None
         )
         
         self.db.add(document)
         self.db.commit()
         self.db.refresh(document)
+        knowledge_generation.bump()
+        await asyncio.to_thread(self._remember_signature, document.id, signature)
         
-        # TODO: 异步触发文档向量化任务
-        # await self._vectorize_document(document.id)
+        # 向量化由后台任务完成,接口立即返回
+        get_vectorization_worker().enqueue(document.id)
         
         return document
     
@@ -87,6 +233,9 @@ class KnowledgeService:
         
         Returns:
             更新后的文档对象
+        
+        Raises:
+            ValueError: 修改不能重新切分的文档(上传导入中或content只是预览)的内容
         """
         document = self.db.query(KnowledgeDocument).filter(
             KnowledgeDocument.id == document_id
@@ -94,19 +243,42 @@ class KnowledgeService:
         
         if not document:
             return None
+        if 'content' in kwargs and kwargs['content'] != document.content:
+            reason = self.resplit_blocked_reason(document)
+            if reason:
+                raise ValueError(reason)
         
+        changed = set()
         for key, value in kwargs.items():
-            if hasattr(document, key):
+            if hasattr(document, key) and getattr(document, key) != value:
                 setattr(document, key, value)
+                changed.add(key)
         
-        # 如果内容发生变化,重新向量化
-        if 'content' in kwargs:
-            document.is_vectorized = 0
-            # TODO: 异步触发文档重新向量化任务
-            # await self._vectorize_document(document_id)
+        if changed & self.CHUNK_METADATA_FIELDS:
+            self._sync_chunk_metadata(document, reindex_vectors="category" in changed)
+        
+        # 内容真正发生变化时才需要重新向量化;重新向量化是增量的,未变化的chunk会复用原有向量
+        signature = None
+        if 'content' in changed:
+            document.is_vectorized = VECTORIZE_PENDING
+            document.vectorize_retries = 0
+            document.vectorize_error = None
+            # 重新计算签名并更新近似重复标记(更新时只标记,不做skip/merge)
+            signature = await asyncio.to_thread(content_signature, document.content)
+            document.minhash = encode_signature(signature)
+            if self._resolve_dedup_policy(None) != "off":
+                original = await asyncio.to_thread(self._find_duplicate_document, signature, document.id)
+                document.duplicate_of = original.id if original is not None else None
         
         self.db.commit()
         self.db.refresh(document)
+        if changed:
+            knowledge_generation.bump()
+        if signature is not None:
+            await asyncio.to_thread(self._remember_signature, document.id, signature)
+        
+        if 'content' in changed:
+            get_vectorization_worker().enqueue(document_id)
         
         return document
     
@@ -127,19 +299,64 @@ class KnowledgeService:
         if not document:
             return False
         
-        # 删除关联的chunks
-        self.db.query(KnowledgeChunk).filter(
-            KnowledgeChunk.document_id == document_id
-        ).delete()
+        # 删除关联的chunks及其向量
+        self._delete_chunks(document_id)
         
-        # TODO: 从向量数据库中删除向量
-        # await self._delete_vectors(document_id)
+        # 标记为该文档近似重复的文档不再指向它
+        self.db.query(KnowledgeDocument).filter(
+            KnowledgeDocument.duplicate_of == document_id
+        ).update({KnowledgeDocument.duplicate_of: None}, synchronize_session=False)
         
         self.db.delete(document)
         self.db.commit()
+        forget_document(document_id)
+        knowledge_generation.bump()
         
         return True
     
+    @staticmethod
+    def _resolve_dedup_policy(policy: Optional[str]) -> str:
+        policy = (policy or settings.KNOWLEDGE_DEDUP_POLICY).lower()
+        if policy not in ("off", "flag", "skip", "merge"):
+            raise ValueError(f"不支持的近似重复处理策略: {policy}")
+        return policy
+    
+    def _find_duplicate_document(self, signature: np.ndarray, exclude_id: Optional[int] = None) -> Optional[KnowledgeDocument]:
+        """
+        通过LSH索引查找与签名近似重复的已有文档
+        
+        命中的文档本身被标记为重复时返回其原文档,使同一份内容的所有副本都指向同一篇文档
+        """
+        matches = get_document_lsh(self.db).query(
+            signature, settings.KNOWLEDGE_DEDUP_THRESHOLD, exclude_key=exclude_id
+        )
+        for document_id, _ in matches:
+            document = self.get_document(document_id)
+            if document is None:
+                continue
+            # 指向exclude_id本身的副本不能作为其原文档,否则会形成循环
+            if document.duplicate_of is not None:
+                if document.duplicate_of == exclude_id:
+                    continue
+                document = self.get_document(document.duplicate_of) or document
+            return document
+        return None
+    
+    def _remember_signature(self, document_id: int, signature: np.ndarray):
+        """把文档签名写入LSH索引(全局关闭近似重复检测时不加载索引)"""
+        if settings.KNOWLEDGE_DEDUP_POLICY.lower() != "off":
+            get_document_lsh(self.db).add(document_id, signature)
+    
+    async def _merge_into(
+        self,
+        document: KnowledgeDocument,
+        content: str,
+        keywords: Optional[List[str]]
+    ) -> KnowledgeDocument:
+        """把近似重复的新内容合并到已有文档: 以新内容为准,关键词取并集"""
+        merged_keywords = list(dict.fromkeys((document.keywords or []) + (keywords or []))) or None
+        return await self.update_document(document.id, content=content, keywords=merged_keywords)
+    
     def get_document(self, document_id: int) -> Optional[KnowledgeDocument]:
         """获取文档详情"""
         return self.db.query(KnowledgeDocument).filter(
@@ -152,23 +369,34 @@ class KnowledgeService:
         difficulty_level: Optional[str] = None,
         applicable_stage: Optional[str] = None,
         skip: int = 0,
-        limit: int = 50
+        limit: int = 50,
+        cursor: Optional[int] = None
     ) -> List[KnowledgeDocument]:
         """
-        获取文档列表(支持筛选)
+        获取文档列表(支持筛选),按ID降序(最新的在前)
+        
+        推荐使用游标翻页: 把上一页最后一个文档的ID作为cursor传入,通过主键范围条件定位,
+        任何一页的代价都相同;skip为兼容保留的偏移翻页,页码越深需要扫描的行越多。
+        列表不加载content/summary大字段(访问时才单独查询)。
         
         Args:
             category: 按分类筛选
             difficulty_level: 按难度筛选
             applicable_stage: 按备考阶段筛选
-            skip: 跳过记录数
+            skip: 跳过记录数(传入cursor时忽略)
             limit: 返回记录数
+            cursor: 只返回ID小于该值的文档
         
         Returns:
             文档列表
         """
-        query = self.db.query(KnowledgeDocument)
+        query = self.db.query(KnowledgeDocument).options(
+            defer(KnowledgeDocument.content),
+            defer(KnowledgeDocument.summary),
+            defer(KnowledgeDocument.minhash)
+        )
         
+        # 筛选字段均有索引(InnoDB二级索引隐含主键),与id范围条件组合时可直接按索引顺序取一页
         if category:
             query = query.filter(KnowledgeDocument.category == category)
         if difficulty_level:
@@ -176,121 +404,500 @@ class KnowledgeService:
         if applicable_stage:
             query = query.filter(KnowledgeDocument.applicable_stage == applicable_stage)
         
-        return query.offset(skip).limit(limit).all()
+        query = query.order_by(KnowledgeDocument.id.desc())
+        if cursor is not None:
+            query = query.filter(KnowledgeDocument.id < cursor)
+        elif skip:
+            query = query.offset(skip)
+        
+        return query.limit(limit).all()
     
     # ==================== 文档向量化 ====================
     
+    @staticmethod
+    def resplit_blocked_reason(document: KnowledgeDocument) -> Optional[str]:
+        """
+        文档不能按content重新切分的原因(可以时返回None)
+        
+        上传导入中的文档chunks由导入任务写入;上传的大文件content只是开头预览,
+        按预览重新切分会删除预览之后内容的chunks
+        """
+        if document.is_vectorized == VECTORIZE_IMPORTING:
+            return "文档正在上传导入,请等待导入完成"
+        if document.content_is_preview:
+            return "文档内容来自上传的大文件,只保存了开头预览,请重新上传文件"
+        return None
+    
+    def request_vectorization(self, document_id: int) -> bool:
+        """
+        重新提交文档向量化任务(用于失败后手动重试,会清零重试次数)
+        
+        Args:
+            document_id: 文档ID
+        
+        Returns:
+            文档是否存在
+        
+        Raises:
+            ValueError: 文档不能重新切分(上传导入中或content只是预览)
+        """
+        document = self.get_document(document_id)
+        if not document:
+            return False
+        reason = self.resplit_blocked_reason(document)
+        if reason:
+            raise ValueError(reason)
+        
+        document.is_vectorized = VECTORIZE_PENDING
+        document.vectorize_retries = 0
+        document.vectorize_error = None
+        self.db.commit()
+        
+        get_vectorization_worker().enqueue(document_id)
+        return True
+    
+    def get_vectorization_status(self, document_id: int) -> Optional[Dict[str, Any]]:
+        """
+        查询文档向量化状态
+        
+        Returns:
+            {document_id, status, retries, error, chunk_count, queue_state},文档不存在时返回None
+        """
+        document = self.get_document(document_id)
+        if not document:
+            return None
+        
+        return {
+            "document_id": document.id,
+            "status": VECTORIZE_STATUS_NAMES.get(document.is_vectorized, "unknown"),
+            "retries": document.vectorize_retries or 0,
+            "error": document.vectorize_error,
+            "chunk_count": document.chunk_count or 0,
+            "queue_state": get_vectorization_worker().get_state(document.id)
+        }
+    
+    def get_vectorization_summary(self) -> Dict[str, Any]:
+        """各向量化状态的文档数量及后台队列情况"""
+        rows = self.db.query(
+            KnowledgeDocument.is_vectorized, func.count(KnowledgeDocument.id)
+        ).group_by(KnowledgeDocument.is_vectorized).all()
+        documents = {name: 0 for name in VECTORIZE_STATUS_NAMES.values()}
+        for status, count in rows:
+            documents[VECTORIZE_STATUS_NAMES.get(status, "unknown")] = count
+        return {"documents": documents, "queue": get_vectorization_worker().stats()}
+    
+    def rebuild_vector_index(self, category: Optional[str] = None, all_categories: bool = False) -> Dict[str, Any]:
+        """
+        从数据库重建向量索引(分片索引只重建指定分类的分片)
+        
+        Returns:
+            重建后的索引规模
+        """
+        rebuild_vector_index(self.db, category, all_categories)
+        knowledge_generation.bump()
+        index = get_vector_index(self.db)
+        stats = {"vectors": len(index)}
+        if hasattr(index, "shard_sizes"):
+            stats["shards"] = index.shard_sizes()
+        return stats
+    
     async def _vectorize_document(self, document_id: int):
         """
-        将文档切分并向量化(私有方法)
+        将文档切分并向量化(私有方法,增量执行)
         
         流程:
-        1. 获取文档内容
-        2. 文本切分(chunk)
-        3. 为每个chunk生成embedding
-        4. 存储到向量数据库
+        1. 获取文档内容并切分(chunk)
+        2. 与文档现有chunks按内容哈希比对,内容未变的chunk直接复用(只更新顺序和元数据)
+        3. 新增/变化的chunk先按(内容哈希, embedding模型)查找已有向量,查不到的才调用embedding模型
+        4. 只删除已消失的chunk,只写入新的chunk,并同步向量索引和BM25索引
         5. 更新文档向量化状态
         
-        TODO: 实现具体的向量化逻辑
+        1-2和4-5是同步的数据库与CPU操作,在线程中用各自的会话执行,事件循环上只等待embedding
         """
+        plan = await asyncio.to_thread(run_in_session, lambda service: service._plan_vectorization(document_id))
+        if plan is None:
+            return
+        embeddings = await self._embed_with_cache(plan.new_chunks, plan.new_hashes)
+        await asyncio.to_thread(run_in_session, lambda service: service._apply_vectorization(plan, embeddings))
+    
+    def _plan_vectorization(self, document_id: int) -> Optional[VectorizationPlan]:
+        """切分文档并与现有chunks按内容哈希比对(只读,不修改数据库)"""
         document = self.get_document(document_id)
         if not document:
-            return
+            return None
+        reason = self.resplit_blocked_reason(document)
+        if reason:
+            raise ValueError(reason)
+        
+        model_name = self.embedding_provider.model_name
+        chunks = [chunk.text for chunk in self._split_text(document.content)]
+        hashes = [chunk_content_hash(chunk) for chunk in chunks]
+        
+        # 同一文档中可能出现重复段落,按哈希保存候选行列表,依次复用
+        old_rows = self.db.query(
+            KnowledgeChunk.id,
+            KnowledgeChunk.content,
+            KnowledgeChunk.content_hash,
+            KnowledgeChunk.embedding_model
+        ).filter(
+            KnowledgeChunk.document_id == document_id
+        ).order_by(KnowledgeChunk.chunk_index).all()
+        reusable: Dict[str, List[int]] = defaultdict(list)
+        for row in old_rows:
+            if row.embedding_model == model_name:
+                reusable[row.content_hash or chunk_content_hash(row.content)].append(row.id)
         
-        # TODO: 实现文本切分策略
-        # chunks = self._split_text(document.content)
+        kept_ids: List[Optional[int]] = [
+            reusable[h].pop(0) if reusable.get(h) else None for h in hashes
+        ]
+        kept = [(chunk_id, i, hashes[i]) for i, chunk_id in enumerate(kept_ids) if chunk_id is not None]
+        kept_set = {chunk_id for chunk_id, _, _ in kept}
+        new_positions = [i for i, chunk_id in enumerate(kept_ids) if chunk_id is None]
+        return VectorizationPlan(
+            document_id=document_id,
+            chunk_count=len(chunks),
+            kept=kept,
+            stale_ids=[row.id for row in old_rows if row.id not in kept_set],
+            new_chunks=[chunks[i] for i in new_positions],
+            new_positions=new_positions,
+            new_hashes=[hashes[i] for i in new_positions]
+        )
+    
+    def _apply_vectorization(self, plan: VectorizationPlan, embeddings: np.ndarray):
+        """按比对结果更新复用的chunk、删除消失的chunk、写入新chunk和索引,并更新文档状态"""
+        document = self.get_document(plan.document_id)
+        if not document:
+            return
         
-        # TODO: 为每个chunk生成embedding
-        # embeddings = await self._generate_embeddings(chunks)
+        # 复用的chunk: 更新顺序,并修正与文档不一致的元数据(分类变化时需刷新索引)
+        positions = {chunk_id: (i, content_hash) for chunk_id, i, content_hash in plan.kept}
+        refreshed = []
+        if positions:
+            rows = self.db.query(KnowledgeChunk).options(
+                defer(KnowledgeChunk.embedding_vector),
+                defer(KnowledgeChunk.embedding_blob)
+            ).filter(KnowledgeChunk.id.in_(list(positions))).all()
+            for row in rows:
+                row.chunk_index, content_hash = positions[row.id]
+                if row.content_hash is None:
+                    row.content_hash = content_hash
+                row.sub_category = document.sub_category
+                row.difficulty_level = document.difficulty_level
+                if row.category != document.category:
+                    row.category = document.category
+                    refreshed.append(row.id)
         
-        # TODO: 存储到向量数据库
-        # await self._store_vectors(document_id, chunks, embeddings)
+        self._delete_chunks(plan.document_id, plan.stale_ids)
+        self._store_vectors(plan.document_id, plan.new_chunks, embeddings, plan.new_positions, plan.new_hashes)
+        if refreshed:
+            self._reindex_chunks(refreshed)
         
         # 更新文档向量化状态
-        document.is_vectorized = 1
-        # document.chunk_count = len(chunks)
+        document.is_vectorized = VECTORIZE_DONE
+        document.vectorize_retries = 0
+        document.vectorize_error = None
+        document.chunk_count = plan.chunk_count
         self.db.commit()
+        knowledge_generation.bump()
+    
+    async def _embed_with_cache(self, chunks: List[str], hashes: List[str]) -> np.ndarray:
+        """
+        生成chunk向量,优先复用库中(内容哈希, embedding模型)相同的已有向量
+        
+        Args:
+            chunks: 文本切片列表
+            hashes: 对应的内容哈希
+        
+        Returns:
+            与chunks一一对应的向量矩阵
+        """
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        unique_hashes = set(hashes)
+        cached = await asyncio.to_thread(
+            run_in_session, lambda service: service._lookup_cached_embeddings(unique_hashes)
+        )
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        if missing:
+            generated = await self._generate_embeddings([chunks[i] for i in missing])
+            for i, vector in zip(missing, generated):
+                cached[hashes[i]] = vector
+        return np.vstack([cached[h] for h in hashes]).astype(np.float32, copy=False)
+    
+    def _lookup_cached_embeddings(self, hashes: set, batch_size: int = 500) -> Dict[str, np.ndarray]:
+        """按(内容哈希, 当前embedding模型)查询已有向量"""
+        model_name = self.embedding_provider.model_name
+        hashes = list(hashes)
+        cached: Dict[str, np.ndarray] = {}
+        for i in range(0, len(hashes), batch_size):
+            rows = self.db.query(
+                KnowledgeChunk.content_hash,
+                KnowledgeChunk.embedding_codec,
+                KnowledgeChunk.embedding_blob
+            ).filter(
+                KnowledgeChunk.content_hash.in_(hashes[i:i + batch_size]),
+                KnowledgeChunk.embedding_model == model_name,
+                KnowledgeChunk.embedding_blob.isnot(None)
+            )
+            for content_hash, codec, blob in rows:
+                if content_hash not in cached:
+                    cached[content_hash] = decode_vector(blob, codec or "float32")
+        return cached
     
     def _split_text(
         self,
         text: str,
-        chunk_size: int = 500,
-        chunk_overlap: int = 100
-    ) -> List[str]:
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None
+    ) -> Iterator[TextChunk]:
         """
         文本切分策略
         
+        优先在标题、段落、中文句末标点(。！？；)处断开,逐个产出带字符偏移的chunk
+        
         Args:
             text: 待切分文本
-            chunk_size: 每个chunk的字符数
-            chunk_overlap: chunk之间的重叠字符数
+            chunk_size: 每个chunk的最大长度(默认KNOWLEDGE_CHUNK_SIZE)
+            chunk_overlap: chunk之间的重叠长度(默认KNOWLEDGE_CHUNK_OVERLAP)
         
         Returns:
-            切分后的文本列表
-        
-        TODO: 实现更智能的切分策略(如按段落、句子边界切分)
+            TextChunk(text, start, end)生成器
         """
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - chunk_overlap
-        
-        return chunks
+        return self._text_splitter(chunk_size, chunk_overlap).split(text)
+    
+    def _text_splitter(
+        self,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None
+    ) -> TextSplitter:
+        """按知识库配置创建切分器(流式上传通过其stream()增量切分)"""
+        return TextSplitter(
+            chunk_size=chunk_size or settings.KNOWLEDGE_CHUNK_SIZE,
+            chunk_overlap=settings.KNOWLEDGE_CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap,
+            length_unit=settings.KNOWLEDGE_CHUNK_UNIT
+        )
     
-    async def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    async def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """
-        生成文本向量
+        生成文本向量(由embedding提供方分批、并发请求)
         
         Args:
             texts: 文本列表
         
         Returns:
-            向量列表
-        
-        TODO: 集成embedding模型(OpenAI/本地模型)
+            形如(len(texts), dim)的float32向量矩阵
         """
-        # 示例:使用OpenAI embeddings API
-        # embeddings = []
-        # for text in texts:
-        #     response = await openai.Embeddings.create(
-        #         model="text-embedding-ada-002",
-        #         input=text
-        #     )
-        #     embeddings.append(response['data'][0]['embedding'])
-        # return embeddings
-        
-        raise NotImplementedError("Embedding generation not implemented yet")
+        return await self.embedding_provider.embed(texts)
     
-    async def _store_vectors(
+    def _store_vectors(
         self,
         document_id: int,
         chunks: List[str],
-        embeddings: List[List[float]]
+        embeddings: np.ndarray,
+        chunk_indexes: Optional[List[int]] = None,
+        hashes: Optional[List[str]] = None
     ):
         """
-        存储向量到向量数据库
+        存储chunk及其向量
+        
+        chunk与向量写入knowledge_chunks表,同时增量写入进程内向量索引和BM25索引
+        (同步执行,异步流程中需通过asyncio.to_thread和run_in_session在线程中调用)
         
         Args:
             document_id: 文档ID
             chunks: 文本切片列表
             embeddings: 对应的向量列表
+            chunk_indexes: 各chunk在文档中的顺序(默认从0开始连续编号)
+            hashes: 各chunk的内容哈希(默认现场计算)
+        """
+        if not chunks:
+            return
+        
+        document = self.get_document(document_id)
+        if not document:
+            return
+        
+        chunk_indexes = chunk_indexes if chunk_indexes is not None else list(range(len(chunks)))
+        hashes = hashes if hashes is not None else [chunk_content_hash(chunk) for chunk in chunks]
+        codec = settings.EMBEDDING_STORAGE_CODEC
+        blobs = encode_vectors(embeddings, codec)
+        
+        # 与其他文档中的chunk近似重复时记录原chunk,重复的chunk照常保存但不写入检索索引
+        signatures = [content_signature(chunk) for chunk in chunks]
+        duplicates: List[Optional[int]] = [None] * len(chunks)
+        chunk_lsh = get_chunk_lsh(self.db) if self._dedup_chunks_enabled() else None
+        # 在写入chunk之前取得索引: 首次访问时从数据库加载,此时不会读到本批chunk,之后只写入一次
+        vector_index = get_vector_index(self.db)
+        lexical_index = get_lexical_index(self.db)
+        if chunk_lsh is not None:
+            for i, signature in enumerate(signatures):
+                match = chunk_lsh.best_match(
+                    signature, settings.KNOWLEDGE_DEDUP_THRESHOLD, exclude_group=document_id
+                )
+                duplicates[i] = match[0] if match else None
+        chunk_rows = [
+            KnowledgeChunk(
+                document_id=document_id,
+                content=chunk,
+                chunk_index=chunk_index,
+                content_hash=content_hash,
+                embedding_model=self.embedding_provider.model_name,
+                embedding_codec=codec,
+                embedding_blob=blob,
+                category=document.category,
+                sub_category=document.sub_category,
+                difficulty_level=document.difficulty_level,
+                minhash=encode_signature(signature),
+                duplicate_of=duplicate_of
+            )
+            for chunk, blob, chunk_index, content_hash, signature, duplicate_of in zip(
+                chunks, blobs, chunk_indexes, hashes, signatures, duplicates
+            )
+        ]
+        self.db.add_all(chunk_rows)
+        self.db.flush()
+        category = document.category
+        kept = [i for i, duplicate_of in enumerate(duplicates) if duplicate_of is None]
+        chunk_ids = [chunk_rows[i].id for i in kept]
+        texts = [build_chunk_text(chunks[i], document.title, document.keywords) for i in kept]
+        self.db.commit()
+        if len(kept) < len(chunks):
+            print(f"文档{document_id}有{len(chunks) - len(kept)}个chunk与已有内容近似重复,不写入检索索引")
+        if not kept:
+            return
+        
+        document_ids = [document_id] * len(chunk_ids)
+        categories = [category] * len(chunk_ids)
+        vector_index.add(chunk_ids, document_ids, categories, embeddings[kept])
+        lexical_index.add(chunk_ids, document_ids, categories, texts)
+        if chunk_lsh is not None:
+            for i, chunk_id in zip(kept, chunk_ids):
+                chunk_lsh.add(chunk_id, signatures[i], group=document_id)
+    
+    @staticmethod
+    def _dedup_chunks_enabled() -> bool:
+        return settings.KNOWLEDGE_DEDUP_CHUNKS and settings.KNOWLEDGE_DEDUP_POLICY.lower() != "off"
+    
+    def _sync_chunk_metadata(self, document: KnowledgeDocument, reindex_vectors: bool = False):
+        """把文档元数据同步到其chunks,并刷新BM25索引(分类变化时同时刷新向量索引)"""
+        self.db.flush()
+        self.db.query(KnowledgeChunk).filter(
+            KnowledgeChunk.document_id == document.id
+        ).update({
+            KnowledgeChunk.category: document.category,
+            KnowledgeChunk.sub_category: document.sub_category,
+            KnowledgeChunk.difficulty_level: document.difficulty_level
+        }, synchronize_session=False)
+        chunk_ids = [
+            row.id for row in self.db.query(KnowledgeChunk.id).filter(
+                KnowledgeChunk.document_id == document.id
+            )
+        ]
+        if chunk_ids:
+            self._reindex_chunks(chunk_ids, reindex_vectors=reindex_vectors)
+    
+    def _reindex_chunks(self, chunk_ids: List[int], reindex_vectors: bool = True):
+        """按数据库中的最新内容和元数据重新写入BM25索引和向量索引(不调用embedding模型)"""
+        columns = [
+            KnowledgeChunk.id,
+            KnowledgeChunk.document_id,
+            KnowledgeChunk.category,
+            KnowledgeChunk.content,
+            KnowledgeDocument.title,
+            KnowledgeDocument.keywords
+        ]
+        if reindex_vectors:
+            columns += [KnowledgeChunk.embedding_codec, KnowledgeChunk.embedding_blob, KnowledgeChunk.embedding_vector]
+        rows = self.db.query(*columns).join(
+            KnowledgeDocument, KnowledgeDocument.id == KnowledgeChunk.document_id
+        ).filter(
+            KnowledgeChunk.id.in_(chunk_ids),
+            KnowledgeChunk.duplicate_of.is_(None)
+        ).all()
+        if not rows:
+            return
         
-        TODO: 实现向量数据库存储逻辑
+        ids = [row.id for row in rows]
+        document_ids = [row.document_id for row in rows]
+        categories = [row.category for row in rows]
+        texts = [build_chunk_text(row.content, row.title, row.keywords) for row in rows]
+        get_lexical_index(self.db).add(ids, document_ids, categories, texts)
+        if reindex_vectors:
+            vectorized, vectors = [], []
+            for i, row in enumerate(rows):
+                if row.embedding_blob is not None:
+                    vectorized.append(i)
+                    vectors.append(decode_vector(row.embedding_blob, row.embedding_codec or "float32"))
+                elif row.embedding_vector is not None:
+                    vectorized.append(i)
+                    vectors.append(np.asarray(row.embedding_vector, dtype=np.float32))
+            if vectorized:
+                get_vector_index(self.db).add(
+                    [ids[i] for i in vectorized],
+                    [document_ids[i] for i in vectorized],
+                    [categories[i] for i in vectorized],
+                    np.vstack(vectors)
+                )
+    
+    def _delete_chunks(self, document_id: int, chunk_ids: Optional[List[int]] = None):
         """
-        # 示例:存储到Chroma向量数据库
-        # collection = self.vector_db.get_or_create_collection("knowledge_base")
-        # collection.add(
-        #     documents=chunks,
-        #     embeddings=embeddings,
-        #     metadatas=[{"document_id": document_id, "chunk_index": i} for i in range(len(chunks))],
-        #     ids=[f"doc_{document_id}_chunk_{i}" for i in range(len(chunks))]
-        # )
+        删除文档的chunks,并从向量索引和BM25索引中移除(不提交事务)
+        
+        Args:
+            document_id: 文档ID
+            chunk_ids: 只删除其中的这些chunk(默认删除文档的全部chunks)
+        """
+        if chunk_ids is None:
+            chunk_ids = [
+                row.id for row in self.db.query(KnowledgeChunk.id).filter(
+                    KnowledgeChunk.document_id == document_id
+                )
+            ]
+        if not chunk_ids:
+            return
+        
+        self.db.query(KnowledgeChunk).filter(
+            KnowledgeChunk.document_id == document_id,
+            KnowledgeChunk.id.in_(chunk_ids)
+        ).delete(synchronize_session=False)
+        get_vector_index(self.db).remove(chunk_ids)
+        get_lexical_index(self.db).remove(chunk_ids)
+        forget_chunks(chunk_ids)
+        self._release_duplicate_chunks(chunk_ids)
+    
+    def _release_duplicate_chunks(self, original_ids: List[int]):
+        """
+        原chunk被删除后,重新判定标记为其重复的chunk(不提交事务)
+        
+        仍与其他chunk近似重复的改为指向新的原chunk,否则取消标记并写入检索索引
+        """
+        rows = self.db.query(
+            KnowledgeChunk.id, KnowledgeChunk.document_id, KnowledgeChunk.minhash
+        ).filter(
+            KnowledgeChunk.duplicate_of.in_(original_ids)
+        ).order_by(KnowledgeChunk.id).all()
+        if not rows:
+            return
         
-        raise NotImplementedError("Vector storage not implemented yet")
+        chunk_lsh = get_chunk_lsh(self.db) if self._dedup_chunks_enabled() else None
+        released: List[int] = []
+        for chunk_id, document_id, blob in rows:
+            signature = decode_signature(blob, settings.KNOWLEDGE_MINHASH_PERM)
+            match = None
+            if chunk_lsh is not None and signature is not None:
+                match = chunk_lsh.best_match(
+                    signature, settings.KNOWLEDGE_DEDUP_THRESHOLD, exclude_group=document_id
+                )
+            self.db.query(KnowledgeChunk).filter(KnowledgeChunk.id == chunk_id).update(
+                {KnowledgeChunk.duplicate_of: match[0] if match else None}, synchronize_session=False
+            )
+            if match is None:
+                released.append(chunk_id)
+                if chunk_lsh is not None and signature is not None:
+                    chunk_lsh.add(chunk_id, signature, group=document_id)
+        if released:
+            self._reindex_chunks(released)
     
     # ==================== 知识库检索 ====================
     
@@ -300,17 +907,29 @@ class KnowledgeService:
         user_id: Optional[str] = None,
         category: Optional[str] = None,
         top_k: int = 5,
-        min_score: float = 0.7
+        min_score: float = 0.7,
+        mode: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        applicable_stage: Optional[str] = None,
+        preferred_difficulty: Optional[str] = None
     ) -> List[Dict]:
         """
-        知识库语义检索
+        知识库检索
         
         Args:
             query: 用户查询内容
             user_id: 用户ID(用于记录检索历史)
             category: 限定检索的分类
             top_k: 返回最相关的top_k个结果
-            min_score: 最小相关性阈值
+            min_score: 最小相关性阈值(仅对向量检索的余弦相似度生效)
+            mode: 检索模式,默认使用配置KNOWLEDGE_SEARCH_MODE
+                - vector: 向量检索
+                - lexical: BM25词法检索,无需调用embedding
+                - hybrid: 并发执行词法与向量检索,按倒数排名融合(RRF)
+                - cascade: 级联检索,先廉价召回候选,再对候选精细重排,两个阶段各有时间预算
+            difficulty_level: 限定难度等级
+            applicable_stage: 期望的备考阶段(仅cascade模式作为排序特征,不做过滤)
+            preferred_difficulty: 期望的难度等级(仅cascade模式作为排序特征,不做过滤)
         
         Returns:
             检索结果列表,每个结果包含:
@@ -318,48 +937,361 @@ class KnowledgeService:
                 "chunk_id": chunk的ID,
                 "document_id": 所属文档ID,
                 "content": chunk内容,
-                "score": 相关性得分,
+                "score": 相关性得分(hybrid模式下为RRF融合得分,cascade模式下为重排得分),
                 "metadata": 元数据(分类、难度等)
             }
+        """
+        mode = self._resolve_mode(mode)
         
-        TODO: 实现向量检索逻辑
+        # 版本号必须在检索前读取: 检索过程中发生写入时,结果会存到旧版本下,不会被后续请求命中
+        cache_key = self._search_cache_key(
+            query, mode, category, top_k, min_score, difficulty_level, applicable_stage, preferred_difficulty
+        )
+        results = hot_query_cache.get(cache_key)
+        if results is None:
+            results = search_result_cache.get(cache_key)
+        if results is None:
+            results = await self._search_uncached(
+                query, mode, category, top_k, min_score, difficulty_level,
+                applicable_stage, preferred_difficulty
+            )
+            search_result_cache.set(cache_key, results)
+        results = [dict(r, metadata=dict(r["metadata"])) for r in results]
+        
+        # 记录检索历史(放入缓冲队列由后台批量写入,不在请求中提交数据库)
+        if user_id:
+            await get_search_history_writer().record(
+                user_id,
+                query,
+                [r["chunk_id"] for r in results],
+                [r["score"] for r in results]
+            )
+        
+        return results
+    
+    @staticmethod
+    def _resolve_mode(mode: Optional[str]) -> str:
+        mode = (mode or settings.KNOWLEDGE_SEARCH_MODE).lower()
+        if mode not in ("vector", "lexical", "hybrid", "cascade"):
+            raise ValueError(f"不支持的检索模式: {mode}")
+        return mode
+    
+    @staticmethod
+    def _search_cache_key(
+        query: str,
+        mode: str,
+        category: Optional[str],
+        top_k: int,
+        min_score: Optional[float],
+        difficulty_level: Optional[str] = None,
+        applicable_stage: Optional[str] = None,
+        preferred_difficulty: Optional[str] = None
+    ) -> tuple:
+        """检索结果缓存键(包含当前知识库版本号)"""
+        return (
+            knowledge_generation.value, normalize_query(query), mode,
+            category, difficulty_level, top_k, min_score, applicable_stage, preferred_difficulty
+        )
+    
+    async def warm_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        min_score: Optional[float] = 0.7,
+        mode: Optional[str] = None
+    ) -> bool:
         """
-        # TODO: 1. 将query转换为embedding
-        # query_embedding = await self._generate_embeddings([query])
+        预计算查询结果并放入热门查询缓存(不记录检索历史)
         
-        # TODO: 2. 在向量数据库中检索最相似的chunks
-        # results = await self.vector_db.search(
-        #     query_embedding[0],
-        #     top_k=top_k,
-        #     filter={"category": category} if category else None
-        # )
+        Returns:
+            是否进行了计算(当前版本的结果已在热门缓存中时返回False)
+        """
+        mode = self._resolve_mode(mode)
+        cache_key = self._search_cache_key(query, mode, None, top_k, min_score)
+        if hot_query_cache.get(cache_key) is not None:
+            return False
+        results = await self._search_uncached(query, mode, None, top_k, min_score, None)
+        hot_query_cache.set(cache_key, results)
+        return True
+    
+    async def warm_query_embeddings(self, queries: List[str]):
+        """批量生成查询向量写入查询向量缓存(已缓存的也重新写入,以延长有效期)"""
+        normalized = list(dict.fromkeys(normalize_query(query) for query in queries))
+        if not normalized:
+            return
+        model_name = self.embedding_provider.model_name
+        embeddings = await self._generate_embeddings(normalized)
+        for query, embedding in zip(normalized, embeddings):
+            query_embedding_cache.set((model_name, query), embedding)
+    
+    async def _search_uncached(
+        self,
+        query: str,
+        mode: str,
+        category: Optional[str],
+        top_k: int,
+        min_score: Optional[float],
+        difficulty_level: Optional[str],
+        applicable_stage: Optional[str] = None,
+        preferred_difficulty: Optional[str] = None
+    ) -> List[Dict]:
+        """执行检索(不经过结果缓存)"""
+        # 元数据预过滤: 只有限定难度时才通过idx_category_difficulty复合索引查询候选chunk;
+        # 只限定分类时直接交给索引按分类过滤,不再每次查询出整个分类的chunk ID
+        # 数据库查询和索引检索都在线程中执行(依次使用self.db,不并发),不阻塞事件循环
+        candidate_ids = None
+        if difficulty_level:
+            candidate_ids = await asyncio.to_thread(self._prefilter_chunk_ids, category, difficulty_level)
         
-        # TODO: 3. 过滤低分结果
-        # filtered_results = [r for r in results if r['score'] >= min_score]
+        if candidate_ids is not None and not candidate_ids:
+            hits = []
+        elif mode == "lexical":
+            lexical_index = await asyncio.to_thread(get_lexical_index, self.db)
+            hits = await asyncio.to_thread(lexical_index.search, query, top_k, category, candidate_ids)
+        elif mode == "vector":
+            hits = await self._vector_search(query, top_k, category, min_score, candidate_ids)
+        elif mode == "cascade":
+            hits = await self._cascade_search(
+                query, top_k, category, candidate_ids, applicable_stage, preferred_difficulty
+            )
+        else:
+            hits = await self._hybrid_search(query, top_k, category, min_score, candidate_ids)
+        return await asyncio.to_thread(self._build_search_results, hits)
+    
+    def _prefilter_chunk_ids(
+        self,
+        category: Optional[str],
+        difficulty_level: Optional[str]
+    ) -> List[int]:
+        """按分类/难度查询候选chunk ID(命中knowledge_chunks的idx_category_difficulty索引)"""
+        query = self.db.query(KnowledgeChunk.id)
+        if category:
+            query = query.filter(KnowledgeChunk.category == category)
+        if difficulty_level:
+            query = query.filter(KnowledgeChunk.difficulty_level == difficulty_level)
+        return [row.id for row in query]
+    
+    async def _vector_search(
+        self,
+        query: str,
+        top_k: int,
+        category: Optional[str],
+        min_score: Optional[float],
+        candidate_ids: Optional[List[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """向量检索,返回(chunk_id, score)列表"""
+        index = await asyncio.to_thread(get_vector_index, self.db)
         
-        # 4. 记录检索历史
-        if user_id:
-            self._save_search_history(user_id, query, [], [])
+        # 索引为空时无需生成查询向量
+        if len(index) == 0:
+            return []
         
-        # TODO: 返回实际检索结果
-        return []
+        query_embedding = await self._embed_query(query)
+        # 矩阵运算会释放GIL,放到线程池执行以便与其他检索并发
+        return await asyncio.to_thread(
+            index.search, query_embedding, top_k, category, min_score, candidate_ids=candidate_ids
+        )
+    
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """生成查询向量(按归一化后的查询文本缓存)"""
+        normalized = normalize_query(query)
+        cache_key = (self.embedding_provider.model_name, normalized)
+        embedding = query_embedding_cache.get(cache_key)
+        if embedding is None:
+            embedding = (await self._generate_embeddings([normalized]))[0]
+            query_embedding_cache.set(cache_key, embedding)
+        return embedding
     
-    def _save_search_history(
+    @staticmethod
+    def get_cache_stats() -> Dict[str, Any]:
+        """检索缓存的命中统计(附带检索历史写入队列的情况)"""
+        return {
+            "generation": knowledge_generation.value,
+            "query_embedding": query_embedding_cache.stats(),
+            "search_result": search_result_cache.stats(),
+            "hot_query": hot_query_cache.stats(),
+            "search_history_writer": get_search_history_writer().stats()
+        }
+    
+    async def _hybrid_search(
         self,
-        user_id: str,
         query: str,
-        matched_chunks: List[int],
-        scores: List[float]
-    ):
-        """保存检索历史"""
-        history = SearchHistory(
-            user_id=user_id,
-            query=query,
-            matched_chunks=matched_chunks,
-            relevance_scores=scores
+        top_k: int,
+        category: Optional[str],
+        min_score: Optional[float],
+        candidate_ids: Optional[List[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """并发执行词法检索和向量检索,用RRF融合两路排名"""
+        depth = top_k * settings.KNOWLEDGE_HYBRID_DEPTH_FACTOR
+        # 先取得两个索引(首次访问时从数据库加载),之后的并发检索不再使用数据库会话
+        lexical_index = await asyncio.to_thread(get_lexical_index, self.db)
+        await asyncio.to_thread(get_vector_index, self.db)
+        lexical_hits, vector_hits = await asyncio.gather(
+            asyncio.to_thread(lexical_index.search, query, depth, category, candidate_ids),
+            self._vector_search(query, depth, category, min_score, candidate_ids)
+        )
+        return reciprocal_rank_fusion(
+            [lexical_hits, vector_hits],
+            k=settings.KNOWLEDGE_RRF_K,
+            top_k=top_k
         )
-        self.db.add(history)
-        self.db.commit()
+    
+    async def _cascade_search(
+        self,
+        query: str,
+        top_k: int,
+        category: Optional[str],
+        candidate_ids: Optional[List[int]],
+        applicable_stage: Optional[str],
+        preferred_difficulty: Optional[str]
+    ) -> List[Tuple[int, float]]:
+        """
+        级联检索
+        
+        第一阶段: 并发执行BM25召回和向量索引召回(IVF时为近似检索)各取KNOWLEDGE_CASCADE_CANDIDATES个候选,
+        在阶段预算内完成的召回结果按RRF融合;超出预算的一路不再等待(预算内一路都未完成时等待最先完成的一路)。
+        第二阶段: 对候选计算精确余弦相似度、BM25、查询词覆盖率及阶段/难度匹配等特征加权重排,
+        超出阶段预算时只对已打分的候选重排,其余保持第一阶段顺序。
+        """
+        depth = max(settings.KNOWLEDGE_CASCADE_CANDIDATES, top_k)
+        vector_index = await asyncio.to_thread(get_vector_index, self.db)
+        lexical_index = await asyncio.to_thread(get_lexical_index, self.db)
+        
+        # 查询向量单独生成: 第一阶段超时后仍继续计算,完成后写入查询向量缓存
+        embed_task = None
+        if len(vector_index):
+            embed_task = asyncio.ensure_future(self._embed_query(query))
+            embed_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        
+        stage_one = [asyncio.ensure_future(
+            asyncio.to_thread(lexical_index.search, query, depth, category, candidate_ids)
+        )]
+        if embed_task is not None:
+            stage_one.append(asyncio.ensure_future(
+                self._vector_candidates(embed_task, vector_index, depth, category, candidate_ids)
+            ))
+        done, pending = await asyncio.wait(stage_one, timeout=settings.KNOWLEDGE_CASCADE_STAGE1_BUDGET_MS / 1000)
+        if not done:
+            done, pending = await asyncio.wait(stage_one, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        
+        rankings = [task.result() for task in done if task.exception() is None]
+        if not rankings:
+            raise next(iter(done)).exception()
+        fused = reciprocal_rank_fusion(rankings, k=settings.KNOWLEDGE_RRF_K, top_k=depth)
+        ranked_ids = [chunk_id for chunk_id, _ in fused]
+        if not ranked_ids:
+            return []
+        
+        deadline = time.perf_counter() + settings.KNOWLEDGE_CASCADE_STAGE2_BUDGET_MS / 1000
+        query_vector = None
+        if embed_task is not None and embed_task.done() and not embed_task.cancelled() and embed_task.exception() is None:
+            query_vector = embed_task.result()
+        rows = await asyncio.to_thread(self._load_cascade_rows, ranked_ids)
+        if time.perf_counter() >= deadline:
+            return fused[:top_k]
+        
+        hits = await asyncio.to_thread(
+            self._cascade_rescore, query, query_vector, ranked_ids, rows,
+            vector_index, lexical_index, applicable_stage, preferred_difficulty, deadline
+        )
+        return hits[:top_k]
+    
+    @staticmethod
+    async def _vector_candidates(
+        embed_task: "asyncio.Future",
+        index,
+        depth: int,
+        category: Optional[str],
+        candidate_ids: Optional[List[int]]
+    ) -> List[Tuple[int, float]]:
+        """级联检索第一阶段的向量召回(shield保证本阶段被取消时查询向量仍继续生成)"""
+        query_embedding = await asyncio.shield(embed_task)
+        return await asyncio.to_thread(
+            index.search, query_embedding, depth, category, None, candidate_ids=candidate_ids
+        )
+    
+    def _load_cascade_rows(self, chunk_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """查询候选chunk的内容及文档标题、关键词、适用阶段(重排特征所需字段)"""
+        rows = self.db.query(
+            KnowledgeChunk.id,
+            KnowledgeChunk.content,
+            KnowledgeChunk.difficulty_level,
+            KnowledgeDocument.title,
+            KnowledgeDocument.keywords,
+            KnowledgeDocument.applicable_stage
+        ).join(
+            KnowledgeDocument, KnowledgeDocument.id == KnowledgeChunk.document_id
+        ).filter(
+            KnowledgeChunk.id.in_(chunk_ids)
+        )
+        return {
+            row.id: {
+                "search_text": build_search_text(row.content, row.title, row.keywords),
+                "applicable_stage": row.applicable_stage,
+                "difficulty_level": row.difficulty_level
+            }
+            for row in rows
+        }
+    
+    @staticmethod
+    def _cascade_rescore(
+        query: str,
+        query_vector: Optional[np.ndarray],
+        ranked_ids: List[int],
+        rows: Dict[int, Dict[str, Any]],
+        vector_index,
+        lexical_index,
+        applicable_stage: Optional[str],
+        preferred_difficulty: Optional[str],
+        deadline: float
+    ) -> List[Tuple[int, float]]:
+        """级联检索第二阶段(在线程池中执行)"""
+        lexical_scores = dict(lexical_index.search(query, len(ranked_ids), None, ranked_ids))
+        vector_scores = None
+        if query_vector is not None:
+            vector_scores = dict(vector_index.search(
+                query_vector, len(ranked_ids), None, None, candidate_ids=ranked_ids
+            ))
+        hits, _ = CascadeRanker().rerank(
+            query, ranked_ids, rows, vector_scores, lexical_scores,
+            applicable_stage, preferred_difficulty, deadline
+        )
+        return hits
+    
+    def _build_search_results(self, hits: List[Tuple[int, float]]) -> List[Dict]:
+        """根据索引命中的(chunk_id, score)查询chunk内容,组装检索结果"""
+        if not hits:
+            return []
+        
+        rows = self.db.query(KnowledgeChunk, KnowledgeDocument.title).join(
+            KnowledgeDocument, KnowledgeDocument.id == KnowledgeChunk.document_id
+        ).filter(
+            KnowledgeChunk.id.in_([chunk_id for chunk_id, _ in hits])
+        ).all()
+        chunks = {chunk.id: (chunk, title) for chunk, title in rows}
+        
+        results = []
+        for chunk_id, score in hits:
+            # 索引与数据库之间可能存在短暂不一致(如chunk刚被删除)
+            if chunk_id not in chunks:
+                continue
+            chunk, title = chunks[chunk_id]
+            results.append({
+                "chunk_id": chunk.id,
+                "document_id": chunk.document_id,
+                "content": chunk.content,
+                "score": score,
+                "metadata": {
+                    "document_title": title,
+                    "chunk_index": chunk.chunk_index,
+                    "category": chunk.category,
+                    "sub_category": chunk.sub_category,
+                    "difficulty_level": chunk.difficulty_level
+                }
+            })
+        return results
     
     # ==================== RAG集成 ====================
     
@@ -367,78 +1299,318 @@ class KnowledgeService:
         self,
         user_message: str,
         user_id: Optional[str] = None,
-        max_context_length: int = 2000
+        max_tokens: Optional[int] = None
     ) -> str:
         """
         为对话获取相关知识库上下文
         
+        多取一些候选结果,由ContextPacker合并相邻chunk、去除近似重复内容,
+        再在token预算内选出价值最高的组合(必要时在句子边界截断)
+        
         Args:
             user_message: 用户消息
             user_id: 用户ID
-            max_context_length: 最大上下文长度(字符数)
+            max_tokens: 上下文的token预算(默认KNOWLEDGE_CONTEXT_MAX_TOKENS)
         
         Returns:
             格式化的知识库上下文字符串
         """
-        # 检索相关知识
+        # 检索相关知识(相似度阈值默认不启用,候选的取舍交给ContextPacker)
         search_results = await self.search(
             query=user_message,
             user_id=user_id,
-            top_k=3
+            top_k=settings.KNOWLEDGE_CONTEXT_CANDIDATES,
+            min_score=settings.KNOWLEDGE_CONTEXT_MIN_SCORE
         )
         
         if not search_results:
             return ""
         
+        packer = ContextPacker(
+            max_tokens=settings.KNOWLEDGE_CONTEXT_MAX_TOKENS,
+            mmr_lambda=settings.KNOWLEDGE_CONTEXT_MMR_LAMBDA,
+            duplicate_threshold=settings.KNOWLEDGE_CONTEXT_DUP_THRESHOLD
+        )
+        passages = await asyncio.to_thread(packer.pack, search_results, max_tokens)
+        if not passages:
+            return ""
+        
         # 构建上下文字符串
         context_parts = ["【知识库参考】"]
-        current_length = 0
-        
-        for i, result in enumerate(search_results, 1):
-            chunk_text = f"\n参考{i}: {result['content']}"
-            
-            if current_length + len(chunk_text) > max_context_length:
-                break
-            
-            context_parts.append(chunk_text)
-            current_length += len(chunk_text)
+        for i, passage in enumerate(passages, 1):
+            context_parts.append(f"\n参考{i}: {passage.text}")
         
         return "\n".join(context_parts)
     
     # ==================== 批量导入 ====================
     
+    # 批量导入时允许写入的文档字段
+    IMPORT_FIELDS = (
+        "title", "content", "category", "sub_category", "summary", "keywords",
+        "source", "author", "difficulty_level", "applicable_stage"
+    )
+    
     async def batch_import_documents(
         self,
-        documents: List[Dict[str, Any]]
-    ) -> List[str]:
+        documents: List[Dict[str, Any]],
+        batch_size: int = 500,
+        max_batch_bytes: int = 4 * 1024 * 1024,
+        dedup_policy: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         批量导入文档
         
+        先校验全部数据,再按批次批量插入(每批一次提交),生成的ID直接从插入结果获取,不逐行refresh。
+        导入的文档统一交给后台向量化队列处理。
+        近似重复同时与已有文档和本次导入中靠前的文档比较,处理策略同add_document。
+        
         Args:
             documents: 文档列表,每个文档包含title, content, category等字段
+            batch_size: 每批插入的最大文档数
+            max_batch_bytes: 每批文档内容的最大字节数(避免单条INSERT语句超过max_allowed_packet)
+            dedup_policy: 近似重复处理策略(off/flag/skip/merge),默认使用配置KNOWLEDGE_DEDUP_POLICY
             
         Returns:
-            创建的文档ID列表
+            {
+                "document_ids": 创建的文档ID列表(与成功导入的文档顺序一致),
+                "imported": 成功导入数量,
+                "failed": 失败数量,
+                "skipped": 因近似重复被跳过的数量,
+                "merged": 因近似重复被合并到其他文档的数量,
+                "errors": [{"index": 在documents中的下标, "title": 标题, "error": 错误信息}],
+                "duplicates": [{"index": 下标, "title": 标题, "duplicate_of": 原文档ID, "action": 处理方式}]
+            }
+        """
+        policy = self._resolve_dedup_policy(dedup_policy)
+        # 校验时计算每篇文档的MinHash签名,是CPU密集的操作,在线程中执行
+        valid, errors = await asyncio.to_thread(self._validate_import_rows, documents)
+        
+        duplicates: List[Dict[str, Any]] = []
+        # 原文档在本次导入中时先记录其下标,插入后再换成ID
+        pending_originals: Dict[int, int] = {}
+        if policy != "off":
+            valid = await self._dedup_import_rows(valid, policy, duplicates, pending_originals)
+        
+        inserted: List[Tuple[int, int]] = []
+        batch: List[Tuple[int, Dict[str, Any]]] = []
+        batch_bytes = 0
+        for item in valid:
+            row_bytes = len(item[1]["content"].encode("utf-8"))
+            if batch and (len(batch) >= batch_size or batch_bytes + row_bytes > max_batch_bytes):
+                inserted.extend(self._insert_document_batch(batch, errors))
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += row_bytes
+        if batch:
+            inserted.extend(self._insert_document_batch(batch, errors))
+        document_ids = [document_id for _, document_id in inserted]
+        
+        if pending_originals:
+            self._resolve_import_duplicates(dict(inserted), pending_originals, duplicates)
+        if document_ids:
+            rows = dict(valid)
+            for index, document_id in inserted:
+                self._remember_signature(document_id, decode_signature(rows[index]["minhash"]))
+            knowledge_generation.bump()
+            worker = get_vectorization_worker()
+            for document_id in document_ids:
+                worker.enqueue(document_id)
+        
+        errors.sort(key=lambda error: error["index"])
+        return {
+            "document_ids": document_ids,
+            "imported": len(document_ids),
+            "failed": len(errors),
+            "skipped": sum(1 for duplicate in duplicates if duplicate["action"] == "skip"),
+            "merged": sum(1 for duplicate in duplicates if duplicate["action"] == "merge"),
+            "errors": errors,
+            "duplicates": duplicates
+        }
+    
+    @classmethod
+    def _validate_import_rows(
+        cls,
+        documents: List[Dict[str, Any]]
+    ) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+        """逐条校验导入数据,返回(校验通过的(下标, 行), 错误列表)"""
+        errors: List[Dict[str, Any]] = []
+        valid: List[Tuple[int, Dict[str, Any]]] = []
+        for i, doc_data in enumerate(documents):
+            try:
+                valid.append((i, cls.validate_import_row(doc_data)))
+            except (ValueError, TypeError, AttributeError) as e:
+                title = doc_data.get("title") if isinstance(doc_data, dict) else None
+                errors.append({"index": i, "title": title, "error": str(e)})
+        return valid, errors
+    
+    async def _dedup_import_rows(
+        self,
+        valid: List[Tuple[int, Dict[str, Any]]],
+        policy: str,
+        duplicates: List[Dict[str, Any]],
+        pending_originals: Dict[int, int]
+    ) -> List[Tuple[int, Dict[str, Any]]]:
         """
-        document_ids = []
+        对校验通过的导入数据做近似重复处理,返回需要插入的行
         
-        for doc_data in documents:
+        已有文档通过全局LSH索引查找;本次导入的行之间用一个临时LSH索引(key为下标),只收录非重复的行
+        """
+        batch_lsh = MinHashLSH(settings.KNOWLEDGE_MINHASH_PERM, settings.KNOWLEDGE_MINHASH_BANDS)
+        rows = dict(valid)
+        kept: List[Tuple[int, Dict[str, Any]]] = []
+        for index, row in valid:
+            signature = decode_signature(row["minhash"])
+            original = await asyncio.to_thread(self._find_duplicate_document, signature)
+            batch_match = None if original is not None else batch_lsh.best_match(
+                signature, settings.KNOWLEDGE_DEDUP_THRESHOLD
+            )
+            if original is None and batch_match is None:
+                batch_lsh.add(index, signature)
+                kept.append((index, row))
+                continue
+            
+            action = policy
+            if action == "merge" and original is not None and self.resplit_blocked_reason(original):
+                action = "flag"
+            duplicate = {"index": index, "title": row["title"], "duplicate_of": None, "action": action}
+            duplicates.append(duplicate)
+            if original is not None:
+                duplicate["duplicate_of"] = original.id
+                if action == "merge":
+                    await self._merge_into(original, row["content"], row["keywords"])
+                elif action == "flag":
+                    row["duplicate_of"] = original.id
+                    kept.append((index, row))
+                continue
+            
+            original_index = batch_match[0]
+            pending_originals[index] = original_index
+            if policy == "merge":
+                # 合并到本次导入中靠前的行: 以新内容为准,关键词取并集
+                target = rows[original_index]
+                target["content"] = row["content"]
+                target["keywords"] = list(dict.fromkeys((target["keywords"] or []) + (row["keywords"] or []))) or None
+                target["minhash"] = row["minhash"]
+                batch_lsh.add(original_index, signature)
+            elif policy == "flag":
+                kept.append((index, row))
+        return kept
+    
+    def _resolve_import_duplicates(
+        self,
+        inserted: Dict[int, int],
+        pending_originals: Dict[int, int],
+        duplicates: List[Dict[str, Any]]
+    ):
+        """把指向本次导入中其他行的重复标记换成插入后的文档ID(原文档插入失败时不标记)"""
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for duplicate in duplicates:
+            original_index = pending_originals.get(duplicate["index"])
+            if original_index is None or original_index not in inserted:
+                continue
+            original_id = inserted[original_index]
+            duplicate["duplicate_of"] = original_id
+            if duplicate["action"] == "flag" and duplicate["index"] in inserted:
+                groups[original_id].append(inserted[duplicate["index"]])
+        for original_id, document_ids in groups.items():
+            self.db.query(KnowledgeDocument).filter(
+                KnowledgeDocument.id.in_(document_ids)
+            ).update({KnowledgeDocument.duplicate_of: original_id}, synchronize_session=False)
+        if groups:
+            self.db.commit()
+    
+    @classmethod
+    def validate_import_row(cls, doc_data: Dict[str, Any]) -> Dict[str, Any]:
+        """校验并规范化一条导入数据,不合法时抛出ValueError(不访问数据库,可在子进程中调用)"""
+        if not isinstance(doc_data, dict):
+            raise ValueError("文档数据必须是字典")
+        
+        row = {field: doc_data.get(field) for field in cls.IMPORT_FIELDS}
+        row["title"] = row["title"] or "未命名文档"
+        if not isinstance(row["content"], str) or not row["content"].strip():
+            raise ValueError("content不能为空")
+        if row["keywords"] is not None and (
+            not isinstance(row["keywords"], list) or not all(isinstance(k, str) for k in row["keywords"])
+        ):
+            raise ValueError("keywords必须是字符串列表")
+        
+        # 按表结构检查字符串字段长度,避免整批插入时才因单行超长而失败
+        columns = KnowledgeDocument.__table__.columns
+        for field in cls.IMPORT_FIELDS:
+            value = row[field]
+            length = getattr(columns[field].type, "length", None)
+            if value is None or field == "keywords":
+                continue
+            if not isinstance(value, str):
+                raise ValueError(f"{field}必须是字符串")
+            if length and len(value) > length:
+                raise ValueError(f"{field}长度超过{length}个字符")
+        
+        row["is_vectorized"] = VECTORIZE_PENDING
+        row["vectorize_retries"] = 0
+        row["chunk_count"] = 0
+        row["minhash"] = encode_signature(content_signature(row["content"]))
+        row["duplicate_of"] = None
+        return row
+    
+    def _insert_document_batch(
+        self,
+        batch: List[Tuple[int, Dict[str, Any]]],
+        errors: List[Dict[str, Any]]
+    ) -> List[Tuple[int, int]]:
+        """批量插入一批文档并提交,返回成功插入的(下标, 文档ID);整批失败时回滚,再逐行插入以定位出错的行"""
+        try:
+            ids = self.insert_document_rows([row for _, row in batch])
+            self.db.commit()
+            return [(index, document_id) for (index, _), document_id in zip(batch, ids)]
+        except Exception:
+            self.db.rollback()
+        
+        ids = []
+        for index, row in batch:
             try:
-                document = await self.add_document(
-                    title=doc_data.get("title", "未命名文档"),
-                    content=doc_data["content"],
-                    category=doc_data.get("category"),
-                    sub_category=doc_data.get("sub_category"),
-                    summary=doc_data.get("summary"),
-                    keywords=doc_data.get("keywords"),
-                    source=doc_data.get("source"),
-                    author=doc_data.get("author"),
-                    difficulty_level=doc_data.get("difficulty_level"),
-                    applicable_stage=doc_data.get("applicable_stage")
-                )
-                document_ids.append(document.id)
+                document = KnowledgeDocument(**row)
+                self.db.add(document)
+                self.db.flush()
+                ids.append((index, document.id))
+                self.db.commit()
             except Exception as e:
-                print(f"导入文档失败: {doc_data.get('title', 'unknown')}, 错误: {str(e)}")
-                continue
+                self.db.rollback()
+                errors.append({"index": index, "title": row["title"], "error": str(e)})
+        return ids
+    
+    def insert_document_rows(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        在当前事务中批量插入文档行(不提交),按rows顺序返回生成的ID
         
-        return document_ids
\ No newline at end of file
+        - 支持INSERT ... RETURNING的数据库(PostgreSQL/SQLite/MariaDB): 一次executemany并按参数顺序返回ID
+        - MySQL且自增锁模式保证连续ID(innodb_autoinc_lock_mode为0或1): 单条多行INSERT,由首个ID推算其余ID
+        - 其他情况: ORM批量add后flush一次取回ID
+        """
+        table = KnowledgeDocument.__table__
+        dialect = self.db.get_bind().dialect
+        if dialect.insert_executemany_returning:
+            result = self.db.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True),
+                rows
+            )
+            return [row_id for (row_id,) in result]
+        if dialect.name == "mysql" and self._mysql_autoinc_consecutive():
+            result = self.db.execute(insert(table).values(rows))
+            return list(range(result.lastrowid, result.lastrowid + len(rows)))
+        
+        documents = [KnowledgeDocument(**row) for row in rows]
+        self.db.add_all(documents)
+        self.db.flush()
+        return [document.id for document in documents]
+    
+    def _mysql_autoinc_consecutive(self) -> bool:
+        """MySQL的innodb_autoinc_lock_mode是否保证单条多行INSERT分配连续的自增ID"""
+        global _mysql_autoinc_consecutive
+        if _mysql_autoinc_consecutive is None:
+            try:
+                mode = self.db.execute(text("SELECT @@innodb_autoinc_lock_mode")).scalar()
+                _mysql_autoinc_consecutive = mode is not None and int(mode) in (0, 1)
+            except Exception:
+                _mysql_autoinc_consecutive = False
+        return _mysql_autoinc_consecutive
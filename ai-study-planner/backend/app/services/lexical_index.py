@@ -0,0 +1,268 @@
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models.knowledge_base import KnowledgeChunk, KnowledgeDocument
+
+# 连续的中文字符 或 连续的字母数字(如"408"、"mba")
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文感知的分词: 中文按字符二元组+三元组切分,字母数字按整词保留
+
+    例如"英语二" -> ["英语", "语二", "英语二"],"408" -> ["408"]
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group()
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.extend(run[i:i + 3] for i in range(len(run) - 2))
+    return tokens
+
+
+def build_chunk_text(content: str, title: Optional[str] = None, keywords: Optional[Iterable[str]] = None) -> str:
+    """拼接参与词法检索的文本(标题和关键词各重复一次以提高权重)"""
+    fields = [title or "", " ".join(keywords or [])]
+    return "\n".join([content] + fields * 2)
+
+
+class BM25Index:
+    """
+    基于倒排表的BM25词法检索索引
+
+    每个词项的倒排表用两个紧凑的int32数组(array模块)保存文档槽位和词频,
+    检索时通过np.frombuffer零拷贝转换为NumPy数组做向量化打分,无需调用embedding模型。
+    删除采用标记删除,被删除的文档仍计入df,待删除比例超过阈值后再整体压缩。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, compact_ratio: float = 0.2):
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._vocab: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tfs: List[array] = []
+        self._chunk_ids = array("q")
+        self._document_ids = array("q")
+        self._category_codes = array("i")
+        self._lengths = array("i")
+        self._alive = bytearray()
+        self._categories: Dict[str, int] = {}
+        self._id_to_slot: Dict[int, int] = {}
+        self._total_length = 0
+        self._length_norm: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._id_to_slot)
+
+    def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_ids: Sequence[int],
+        categories: Sequence[Optional[str]],
+        texts: Sequence[str]
+    ):
+        """批量写入chunk文本(已存在的chunk ID会被覆盖)"""
+        with self._lock:
+            self.remove([cid for cid in chunk_ids if int(cid) in self._id_to_slot])
+            for chunk_id, document_id, category, text in zip(chunk_ids, document_ids, categories, texts):
+                slot = len(self._chunk_ids)
+                term_freqs = Counter(tokenize(text))
+                length = sum(term_freqs.values())
+
+                for term, tf in term_freqs.items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = len(self._vocab)
+                        self._vocab[term] = term_id
+                        self._postings_docs.append(array("i"))
+                        self._postings_tfs.append(array("i"))
+                    self._postings_docs[term_id].append(slot)
+                    self._postings_tfs[term_id].append(tf)
+
+                if category is None:
+                    code = -1
+                else:
+                    code = self._categories.setdefault(category, len(self._categories))
+                self._chunk_ids.append(int(chunk_id))
+                self._document_ids.append(int(document_id))
+                self._category_codes.append(code)
+                self._lengths.append(length)
+                self._alive.append(1)
+                self._id_to_slot[int(chunk_id)] = slot
+                self._total_length += length
+            self._length_norm = None
+
+    def remove(self, chunk_ids: Sequence[int]) -> int:
+        """标记删除指定chunk,删除比例过高时自动压缩倒排表"""
+        with self._lock:
+            removed = 0
+            for chunk_id in chunk_ids:
+                slot = self._id_to_slot.pop(int(chunk_id), None)
+                if slot is None:
+                    continue
+                self._alive[slot] = 0
+                self._total_length -= self._lengths[slot]
+                removed += 1
+
+            if removed:
+                self._length_norm = None
+                dead = len(self._alive) - len(self._id_to_slot)
+                if dead > self.compact_ratio * len(self._alive):
+                    self._compact()
+            return removed
+
+    def _compact(self):
+        """清除已删除文档的槽位并重新编号"""
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        new_slot = np.cumsum(alive, dtype=np.int64) - 1
+
+        vocab, postings_docs, postings_tfs = {}, [], []
+        for term, term_id in self._vocab.items():
+            docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int32)
+            keep = alive[docs]
+            if not keep.any():
+                continue
+            tfs = np.frombuffer(self._postings_tfs[term_id], dtype=np.int32)
+            vocab[term] = len(postings_docs)
+            postings_docs.append(array("i", new_slot[docs[keep]].astype(np.int32).tobytes()))
+            postings_tfs.append(array("i", tfs[keep].tobytes()))
+
+        def _filter(values: array) -> array:
+            return array(values.typecode, [v for v, a in zip(values, alive) if a])
+
+        self._vocab = vocab
+        self._postings_docs = postings_docs
+        self._postings_tfs = postings_tfs
+        self._chunk_ids = _filter(self._chunk_ids)
+        self._document_ids = _filter(self._document_ids)
+        self._category_codes = _filter(self._category_codes)
+        self._lengths = _filter(self._lengths)
+        self._alive = bytearray(b"\x01" * len(self._chunk_ids))
+        self._id_to_slot = {cid: slot for slot, cid in enumerate(self._chunk_ids)}
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        category: Optional[str] = None,
+        candidate_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数
+            category: 限定分类
+            candidate_ids: 预过滤得到的候选chunk ID,指定后只返回其中的chunk
+
+        Returns:
+            按BM25得分降序排列的(chunk_id, score)列表(只包含得分大于0的结果)
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_alive = len(self._id_to_slot)
+            if not terms or n_alive == 0 or top_k <= 0:
+                return []
+
+            n_slots = len(self._chunk_ids)
+            if self._length_norm is None:
+                lengths = np.frombuffer(self._lengths, dtype=np.int32).astype(np.float32)
+                avgdl = max(self._total_length / n_alive, 1.0)
+                self._length_norm = self.k1 * (1 - self.b + self.b * lengths / avgdl)
+
+            scores = np.zeros(n_slots, dtype=np.float32)
+            for term in terms:
+                term_id = self._vocab.get(term)
+                if term_id is None:
+                    continue
+                docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int32)
+                tfs = np.frombuffer(self._postings_tfs[term_id], dtype=np.int32).astype(np.float32)
+                df = len(docs)
+                idf = math.log(1 + (n_slots - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[docs])
+
+            # 只对命中的槽位做删除/分类过滤,避免每次查询扫描全部文档
+            candidates = np.flatnonzero(scores > 0)
+            candidates = candidates[np.frombuffer(self._alive, dtype=np.uint8)[candidates] == 1]
+            if category is not None:
+                code = self._categories.get(category)
+                if code is None:
+                    return []
+                candidates = candidates[np.frombuffer(self._category_codes, dtype=np.int32)[candidates] == code]
+            if candidate_ids is not None:
+                allowed = np.zeros(n_slots, dtype=bool)
+                allowed[[self._id_to_slot[int(c)] for c in candidate_ids if int(c) in self._id_to_slot]] = True
+                candidates = candidates[allowed[candidates]]
+
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(self._chunk_ids[slot], float(scores[slot])) for slot in candidates]
+
+    def load_from_db(self, db: Session, batch_size: int = 5000):
+        """
+        从数据库加载全部chunk(不含被标记为近似重复的chunk)及其所属文档的标题、关键词
+
+        按yield_per的批次整批写入;索引中已有的chunk ID跳过,不重复写入
+        """
+        rows = db.query(
+            KnowledgeChunk.id,
+            KnowledgeChunk.document_id,
+            KnowledgeChunk.category,
+            KnowledgeChunk.content,
+            KnowledgeDocument.title,
+            KnowledgeDocument.keywords
+        ).join(
+            KnowledgeDocument, KnowledgeDocument.id == KnowledgeChunk.document_id
+        ).filter(
+            KnowledgeChunk.duplicate_of.is_(None)
+        ).yield_per(batch_size)
+
+        rows = iter(rows)
+        while True:
+            partition = list(islice(rows, batch_size))
+            if not partition:
+                break
+            with self._lock:
+                batch = [row for row in partition if row[0] not in self._id_to_slot]
+                if batch:
+                    self.add(
+                        [row[0] for row in batch],
+                        [row[1] for row in batch],
+                        [row[2] for row in batch],
+                        [build_chunk_text(row[3], row[4], row[5]) for row in batch]
+                    )
+        self.loaded = True
+
+
+# 进程级单例:每个进程只从数据库加载一次
+_lexical_index: Optional[BM25Index] = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index(db: Session) -> BM25Index:
+    """获取进程内共享的BM25索引,首次调用时从数据库加载"""
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                index = BM25Index()
+                index.load_from_db(db)
+                _lexical_index = index
+    return _lexical_index
@@ -0,0 +1,233 @@
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.knowledge_base import KnowledgeChunk, KnowledgeDocument
+from .context_packer import shingles
+
+# 哈希取模用的梅森素数(2^31-1),乘法结果不超过uint64范围
+_PRIME = np.uint64((1 << 31) - 1)
+
+# 计算签名时每次处理的n-gram数量
+_BLOCK = 4096
+
+_permutations: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def _permutation_params(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    """MinHash各哈希函数h(x) = (a*x + b) mod p的参数(固定种子,不同进程生成的签名可以比较)"""
+    params = _permutations.get(num_perm)
+    if params is None:
+        rng = np.random.default_rng(20240601)
+        a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+        params = _permutations[num_perm] = (a, b)
+    return params
+
+
+def minhash_signature(text: str, num_perm: int = 64, shingle_size: int = 5) -> np.ndarray:
+    """
+    计算文本的MinHash签名
+
+    以字符n-gram(忽略空白)为集合元素,两个签名相同位置取值相等的比例是两段文本Jaccard相似度的无偏估计
+
+    Returns:
+        形如(num_perm,)的uint32数组
+    """
+    grams = shingles(text, shingle_size)
+    if not grams:
+        return np.full(num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+    hashes = np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) for gram in grams),
+        dtype=np.uint64,
+        count=len(grams)
+    ) % _PRIME
+    a, b = _permutation_params(num_perm)
+    # 分块计算,长文档的临时矩阵大小不超过num_perm x _BLOCK
+    signature = np.full(num_perm, _PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), _BLOCK):
+        values = (np.outer(a, hashes[start:start + _BLOCK]) + b[:, None]) % _PRIME
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def encode_signature(signature: np.ndarray) -> bytes:
+    return np.asarray(signature, dtype="<u4").tobytes()
+
+
+def decode_signature(blob: Optional[bytes], num_perm: Optional[int] = None) -> Optional[np.ndarray]:
+    """解析存储的签名,长度与当前配置不一致(修改过KNOWLEDGE_MINHASH_PERM)时返回None"""
+    if not blob:
+        return None
+    signature = np.frombuffer(blob, dtype="<u4")
+    if num_perm is not None and len(signature) != num_perm:
+        return None
+    return signature
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """由两个MinHash签名估计Jaccard相似度"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class MinHashLSH:
+    """
+    MinHash签名的LSH分桶索引
+
+    签名切成bands段,每段rows个值;任意一段完全相同的两个签名成为候选,再用完整签名估计相似度确认。
+    Jaccard相似度为s的两段文本成为候选的概率是1-(1-s^rows)^bands,查询只需访问bands个桶,与已有数量无关。
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm必须是bands的整数倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._groups: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: int, signature: np.ndarray, group: Optional[int] = None):
+        """
+        写入签名(已存在的key会被覆盖)
+
+        Args:
+            key: 文档或chunk的ID
+            group: 分组(如chunk所属的文档ID),查询时可排除同组的结果
+        """
+        signature = np.asarray(signature, dtype=np.uint32)
+        with self._lock:
+            self.remove(key)
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+            self._signatures[key] = signature
+            if group is not None:
+                self._groups[key] = group
+
+    def remove(self, key: int) -> bool:
+        with self._lock:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                return False
+            self._groups.pop(key, None)
+            for band_key in self._band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band_key]
+            return True
+
+    def query(
+        self,
+        signature: np.ndarray,
+        threshold: float,
+        exclude_key: Optional[int] = None,
+        exclude_group: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        查找估计相似度不低于threshold的签名
+
+        Returns:
+            按相似度降序(相同时ID小的在前)的(key, 相似度)列表
+        """
+        signature = np.asarray(signature, dtype=np.uint32)
+        with self._lock:
+            candidates: Set[int] = set()
+            for band_key in self._band_keys(signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            candidates.discard(exclude_key)
+
+            matches = []
+            for key in candidates:
+                if exclude_group is not None and self._groups.get(key) == exclude_group:
+                    continue
+                similarity = estimate_similarity(signature, self._signatures[key])
+                if similarity >= threshold:
+                    matches.append((key, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches
+
+    def best_match(self, signature: np.ndarray, threshold: float, **kwargs) -> Optional[Tuple[int, float]]:
+        matches = self.query(signature, threshold, **kwargs)
+        return matches[0] if matches else None
+
+
+def content_signature(content: str) -> np.ndarray:
+    """按配置计算文档/chunk内容的MinHash签名"""
+    return minhash_signature(content, settings.KNOWLEDGE_MINHASH_PERM, settings.KNOWLEDGE_MINHASH_SHINGLE)
+
+
+def _load_signatures(lsh: MinHashLSH, rows: Iterable[Tuple[int, Optional[bytes], Optional[int]]]):
+    for key, blob, group in rows:
+        signature = decode_signature(blob, lsh.num_perm)
+        if signature is not None:
+            lsh.add(key, signature, group)
+    lsh.loaded = True
+
+
+# 进程级单例:每个进程只从数据库加载一次(没有签名的历史数据可用scripts/migrate_embeddings.py补齐)
+_document_lsh: Optional[MinHashLSH] = None
+_chunk_lsh: Optional[MinHashLSH] = None
+_lsh_lock = threading.Lock()
+
+
+def get_document_lsh(db: Session) -> MinHashLSH:
+    """获取进程内共享的文档签名LSH索引,首次调用时从数据库加载"""
+    global _document_lsh
+    if _document_lsh is None:
+        with _lsh_lock:
+            if _document_lsh is None:
+                lsh = MinHashLSH(settings.KNOWLEDGE_MINHASH_PERM, settings.KNOWLEDGE_MINHASH_BANDS)
+                rows = db.query(
+                    KnowledgeDocument.id, KnowledgeDocument.minhash
+                ).filter(KnowledgeDocument.minhash.isnot(None)).yield_per(5000)
+                _load_signatures(lsh, ((document_id, blob, None) for document_id, blob in rows))
+                _document_lsh = lsh
+    return _document_lsh
+
+
+def get_chunk_lsh(db: Session) -> MinHashLSH:
+    """获取进程内共享的chunk签名LSH索引(只包含未被标记为重复的chunk,按文档分组)"""
+    global _chunk_lsh
+    if _chunk_lsh is None:
+        with _lsh_lock:
+            if _chunk_lsh is None:
+                lsh = MinHashLSH(settings.KNOWLEDGE_MINHASH_PERM, settings.KNOWLEDGE_MINHASH_BANDS)
+                _load_signatures(lsh, db.query(
+                    KnowledgeChunk.id, KnowledgeChunk.minhash, KnowledgeChunk.document_id
+                ).filter(
+                    KnowledgeChunk.minhash.isnot(None),
+                    KnowledgeChunk.duplicate_of.is_(None)
+                ).yield_per(5000))
+                _chunk_lsh = lsh
+    return _chunk_lsh
+
+
+def forget_document(document_id: int):
+    """从文档LSH索引中移除(索引尚未加载时无需处理)"""
+    if _document_lsh is not None:
+        _document_lsh.remove(document_id)
+
+
+def forget_chunks(chunk_ids: Iterable[int]):
+    """从chunk LSH索引中移除(索引尚未加载时无需处理)"""
+    if _chunk_lsh is not None:
+        for chunk_id in chunk_ids:
+            _chunk_lsh.remove(int(chunk_id))
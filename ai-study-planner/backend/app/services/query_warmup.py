@@ -0,0 +1,203 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.knowledge_base import SearchHistory
+from .knowledge_service import KnowledgeService, knowledge_generation, normalize_query
+
+
+def mine_hot_queries(db: Session, limit: int = 200, window_days: int = 7) -> List[Tuple[str, int]]:
+    """
+    统计最近window_days天检索次数最多的查询
+
+    先在数据库中按原始查询文本分组计数(多取一些),再按归一化后的文本合并
+
+    Returns:
+        按次数降序的(归一化查询, 次数)列表
+    """
+    since = datetime.now() - timedelta(days=window_days)
+    hits = func.count(SearchHistory.id).label("hits")
+    rows = db.query(SearchHistory.query, hits).filter(
+        SearchHistory.created_at >= since
+    ).group_by(SearchHistory.query).order_by(hits.desc()).limit(limit * 4).all()
+
+    counts: Dict[str, int] = {}
+    for query, count in rows:
+        normalized = normalize_query(query or "")
+        if normalized:
+            counts[normalized] = counts.get(normalized, 0) + count
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+class QueryWarmer:
+    """
+    热门查询预热
+
+    从search_history统计高频查询,预先计算对话(KNOWLEDGE_CONTEXT_CANDIDATES条)和检索接口(默认5条)
+    两种常用参数下的检索结果放入热门查询缓存,并可批量预生成查询向量。
+    启动时执行一次,之后每interval秒重新统计并刷新;知识库版本号变化后等待debounce秒无新变更时重新计算,
+    避免批量导入期间反复刷新。
+    """
+
+    def __init__(
+        self,
+        max_queries: int = 200,
+        window_days: int = 7,
+        interval: float = 1800.0,
+        debounce: float = 10.0,
+        warm_embeddings: bool = True
+    ):
+        self.max_queries = max_queries
+        self.window_days = window_days
+        self.interval = interval
+        self.debounce = debounce
+        self.warm_embeddings = warm_embeddings
+        # (top_k, min_score): 对话上下文检索和检索接口的默认参数
+        self.search_params = list(dict.fromkeys([
+            (settings.KNOWLEDGE_CONTEXT_CANDIDATES, settings.KNOWLEDGE_CONTEXT_MIN_SCORE),
+            (5, 0.7),
+        ]))
+        self._queries: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._warmed_generation: Optional[int] = None
+        self._last_mined = 0.0
+        self._last_stats: Dict[str, Any] = {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queries": len(self._queries),
+            "warmed_generation": self._warmed_generation,
+            "last_refresh": self._last_stats,
+        }
+
+    async def start(self, startup_timeout: float = 15.0):
+        """启动预热: 首次刷新最多等待startup_timeout秒(超时后在后台继续),然后进入定期刷新"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(), name="query-warmer")
+        first = asyncio.ensure_future(self._wait_first_refresh())
+        try:
+            await asyncio.wait_for(asyncio.shield(first), startup_timeout)
+        except asyncio.TimeoutError:
+            print("热门查询预热未在启动等待时间内完成,将在后台继续")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def refresh(self, remine: bool = True) -> Dict[str, Any]:
+        """
+        重新统计热门查询(remine=True时)并预计算当前知识库版本下的检索结果
+
+        Returns:
+            本次刷新的统计信息
+        """
+        async with self._lock:
+            started = time.perf_counter()
+            generation = knowledge_generation.value
+            if remine or not self._queries:
+                self._queries = [query for query, _ in await asyncio.to_thread(self._mine)]
+                self._last_mined = time.monotonic()
+
+            computed = 0
+            failed = 0
+            db = SessionLocal()
+            try:
+                service = KnowledgeService(db)
+                if self.warm_embeddings and self._queries:
+                    try:
+                        await service.warm_query_embeddings(self._queries)
+                    except Exception as e:
+                        print(f"热门查询向量预生成失败: {str(e)}")
+                for query in self._queries:
+                    for top_k, min_score in self.search_params:
+                        try:
+                            computed += await service.warm_search(query, top_k=top_k, min_score=min_score)
+                        except Exception as e:
+                            failed += 1
+                            print(f"热门查询预热失败: {query}, 错误: {str(e)}")
+            finally:
+                db.close()
+
+            self._warmed_generation = generation
+            self._last_stats = {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "queries": len(self._queries),
+                "computed": computed,
+                "failed": failed,
+                "generation": generation,
+                "elapsed": round(time.perf_counter() - started, 3),
+            }
+            return self._last_stats
+
+    def _mine(self) -> List[Tuple[str, int]]:
+        db = SessionLocal()
+        try:
+            return mine_hot_queries(db, self.max_queries, self.window_days)
+        finally:
+            db.close()
+
+    async def _wait_first_refresh(self):
+        while self._warmed_generation is None and self._task is not None and not self._task.done():
+            await asyncio.sleep(0.05)
+
+    async def _run(self):
+        poll = max(0.5, min(self.debounce, 5.0))
+        changed_at: Optional[float] = None
+        last_seen = None
+
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"热门查询预热失败: {str(e)}")
+
+        while True:
+            await asyncio.sleep(poll)
+            now = time.monotonic()
+            generation = knowledge_generation.value
+
+            # 知识库变更: 记录最后一次变化的时间,稳定debounce秒后再刷新
+            if generation != last_seen:
+                last_seen = generation
+                changed_at = now
+            due_to_change = (
+                generation != self._warmed_generation
+                and changed_at is not None
+                and now - changed_at >= self.debounce
+            )
+            due_to_interval = now - self._last_mined >= self.interval
+            if not (due_to_change or due_to_interval):
+                continue
+
+            try:
+                await self.refresh(remine=due_to_interval)
+            except Exception as e:
+                print(f"热门查询预热失败: {str(e)}")
+
+
+_query_warmer: Optional[QueryWarmer] = None
+
+
+def get_query_warmer() -> QueryWarmer:
+    """获取进程内共享的热门查询预热任务"""
+    global _query_warmer
+    if _query_warmer is None:
+        _query_warmer = QueryWarmer(
+            max_queries=settings.KNOWLEDGE_WARMUP_QUERIES,
+            window_days=settings.KNOWLEDGE_WARMUP_WINDOW_DAYS,
+            interval=settings.KNOWLEDGE_WARMUP_INTERVAL,
+            debounce=settings.KNOWLEDGE_WARMUP_DEBOUNCE,
+            warm_embeddings=settings.KNOWLEDGE_WARMUP_EMBEDDINGS
+        )
+    return _query_warmer
@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from ..core.config import settings
+from ..core.database import engine
+from ..models.knowledge_base import SearchHistory
+
+# 溢出策略
+OVERFLOW_DROP = "drop"    # 队列满时直接丢弃新记录
+OVERFLOW_BLOCK = "block"  # 队列满时最多等待block_timeout秒,仍然满则丢弃
+
+_STOP = object()
+
+
+class SearchHistoryWriter:
+    """
+    检索历史的缓冲写入
+
+    检索只把记录放入内存中的有界队列,由后台协程攒批(满batch_size条或距第一条超过flush_interval秒)
+    后在线程池中一次批量插入,检索请求不再等待数据库提交。
+    数据库变慢导致队列积满时按溢出策略丢弃记录(检索历史仅用于统计分析,允许少量丢失);
+    停止时写入队列中剩余的记录。
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        overflow: str = OVERFLOW_DROP,
+        block_timeout: float = 0.05
+    ):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError(f"不支持的溢出策略: {overflow}")
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def start(self):
+        """在当前事件循环中启动写入协程(record()首次调用时也会自动启动)"""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = loop.create_task(self._run(), name="search-history-writer")
+
+    async def stop(self, timeout: float = 10.0):
+        """写入队列中剩余的记录后停止"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            print(f"检索历史写入超时,{self._queue.qsize()}条记录未写入")
+        self._task = None
+
+    async def record(
+        self,
+        user_id: str,
+        query: str,
+        matched_chunks: List[int],
+        scores: List[float]
+    ) -> bool:
+        """
+        提交一条检索历史
+
+        Returns:
+            是否进入了写入队列(被溢出策略丢弃时返回False)
+        """
+        self.start()
+        row = {
+            "user_id": user_id,
+            "query": query,
+            "matched_chunks": matched_chunks,
+            "relevance_scores": scores,
+            "created_at": datetime.now(),
+        }
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow == OVERFLOW_BLOCK:
+            try:
+                await asyncio.wait_for(self._queue.put(row), self.block_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            print(f"检索历史写入队列已满,累计丢弃{self.dropped}条记录")
+        return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._write(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            await asyncio.to_thread(self._insert, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"检索历史批量写入失败({len(batch)}条): {str(e)}")
+
+    @staticmethod
+    def _insert(batch: List[Dict[str, Any]]):
+        with engine.begin() as conn:
+            conn.execute(insert(SearchHistory.__table__), batch)
+
+
+_search_history_writer: Optional[SearchHistoryWriter] = None
+
+
+def get_search_history_writer() -> SearchHistoryWriter:
+    """获取进程内共享的检索历史写入器"""
+    global _search_history_writer
+    if _search_history_writer is None:
+        _search_history_writer = SearchHistoryWriter(
+            max_queue=settings.SEARCH_HISTORY_QUEUE_SIZE,
+            batch_size=settings.SEARCH_HISTORY_BATCH_SIZE,
+            flush_interval=settings.SEARCH_HISTORY_FLUSH_INTERVAL,
+            overflow=settings.SEARCH_HISTORY_OVERFLOW,
+            block_timeout=settings.SEARCH_HISTORY_BLOCK_TIMEOUT
+        )
+    return _search_history_writer
@@ -0,0 +1,244 @@
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models.knowledge_base import KnowledgeChunk
+from .vector_index import fetch_chunk_vectors
+
+
+class ShardedVectorIndex:
+    """
+    按分类分片的向量索引
+
+    每个分类(KnowledgeDocument.category,如政治/英语/数学/专业课)对应一个独立的子索引(FlatVectorIndex或IVFVectorIndex)。
+    限定分类的检索只扫描该分类的分片;不限定分类时在线程池中并发检索各分片
+    (打分是NumPy矩阵运算,执行时释放GIL,多个分片可以真正并行),再用堆合并各分片的top-k。
+    某个分类的内容变化后可以只重建该分片,其他分片不受影响。
+    """
+
+    def __init__(self, shard_factory: Callable[[], object], max_workers: int = 4):
+        """
+        Args:
+            shard_factory: 创建空分片索引的函数
+            max_workers: 并发检索分片的线程数(<=1时逐个分片检索)
+        """
+        self.shard_factory = shard_factory
+        self.max_workers = max_workers
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._shards: Dict[Optional[str], object] = {}
+        self._chunk_shards: Dict[int, Optional[str]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 正在重建的分片: (分类, 重建期间写入该分类的操作日志),替换分片前按顺序重放
+        self._rebuild_logs: List[Tuple[Optional[str], List[tuple]]] = []
+
+    def __len__(self) -> int:
+        return len(self._chunk_shards)
+
+    @property
+    def dim(self) -> Optional[int]:
+        for shard in list(self._shards.values()):
+            if shard.dim is not None:
+                return shard.dim
+        return None
+
+    def shard_sizes(self) -> Dict[Optional[str], int]:
+        """各分片的向量数量"""
+        with self._lock:
+            return {category: len(shard) for category, shard in self._shards.items()}
+
+    def _shard(self, category: Optional[str]):
+        shard = self._shards.get(category)
+        if shard is None:
+            shard = self._shards[category] = self.shard_factory()
+        return shard
+
+    def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_ids: Sequence[int],
+        categories: Sequence[Optional[str]],
+        vectors
+    ):
+        """按分类写入对应分片(已存在的chunk ID会被覆盖,分类变化时从原分片移除)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(chunk_ids):
+            raise ValueError("向量数量与chunk数量不一致")
+        if len(chunk_ids) == 0:
+            return
+
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, category in enumerate(categories):
+            groups.setdefault(category, []).append(i)
+
+        with self._lock:
+            moved = [
+                int(chunk_id) for chunk_id, category in zip(chunk_ids, categories)
+                if int(chunk_id) in self._chunk_shards and self._chunk_shards[int(chunk_id)] != category
+            ]
+            if moved:
+                self.remove(moved)
+
+            for category, rows in groups.items():
+                ids = [chunk_ids[i] for i in rows]
+                shard_document_ids = [document_ids[i] for i in rows]
+                self._shard(category).add(ids, shard_document_ids, [category] * len(rows), vectors[rows])
+                for chunk_id in ids:
+                    self._chunk_shards[int(chunk_id)] = category
+                for rebuilding, log in self._rebuild_logs:
+                    if rebuilding == category:
+                        log.append(("add", ids, shard_document_ids, vectors[rows]))
+
+    def remove(self, chunk_ids: Sequence[int]) -> int:
+        """删除指定chunk的向量,只改动其所在的分片"""
+        with self._lock:
+            # 正在重建的分片可能已从数据库读到这些chunk,无论当前在哪个分片都要在替换前删除
+            for _, log in self._rebuild_logs:
+                log.append(("remove", [int(chunk_id) for chunk_id in chunk_ids]))
+            groups: Dict[Optional[str], List[int]] = {}
+            for chunk_id in chunk_ids:
+                if int(chunk_id) in self._chunk_shards:
+                    category = self._chunk_shards.pop(int(chunk_id))
+                    groups.setdefault(category, []).append(int(chunk_id))
+            return sum(self._shards[category].remove(ids) for category, ids in groups.items())
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        category: Optional[str] = None,
+        min_score: Optional[float] = None,
+        candidate_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        检索与查询向量最相似的chunk
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回结果数
+            category: 限定分类(只检索该分类的分片)
+            min_score: 最小余弦相似度
+            candidate_ids: 预过滤得到的候选chunk ID,指定后只对这些chunk打分
+
+        Returns:
+            按得分降序排列的(chunk_id, score)列表
+        """
+        if top_k <= 0:
+            return []
+
+        # 只在锁内确定要检索的分片,检索本身由各分片自己的锁保护,不阻塞其他分片的写入
+        with self._lock:
+            if candidate_ids is not None:
+                groups: Dict[Optional[str], List[int]] = {}
+                for chunk_id in candidate_ids:
+                    shard_category = self._chunk_shards.get(int(chunk_id), False)
+                    if shard_category is not False and (category is None or shard_category == category):
+                        groups.setdefault(shard_category, []).append(int(chunk_id))
+                tasks = [(self._shards[c], ids) for c, ids in groups.items()]
+            elif category is not None:
+                shard = self._shards.get(category)
+                tasks = [(shard, None)] if shard is not None and len(shard) else []
+            else:
+                tasks = [(shard, None) for shard in self._shards.values() if len(shard)]
+
+        if not tasks:
+            return []
+        if len(tasks) == 1 or self.max_workers <= 1:
+            results = [shard.search(query_vector, top_k, None, min_score, candidate_ids=ids) for shard, ids in tasks]
+        else:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(shard.search, query_vector, top_k, None, min_score, candidate_ids=ids)
+                for shard, ids in tasks
+            ]
+            results = [future.result() for future in futures]
+
+        return heapq.nlargest(top_k, (hit for hits in results for hit in hits), key=lambda hit: hit[1])
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="vector-shard")
+        return self._executor
+
+    def export(self) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]], np.ndarray]:
+        """导出全部分片内容的副本: (chunk_ids, document_ids, categories, 归一化后的向量矩阵)"""
+        with self._lock:
+            parts = [shard.export() for shard in self._shards.values() if len(shard)]
+        if not parts:
+            empty_ids = np.empty(0, dtype=np.int64)
+            return empty_ids, empty_ids, [], np.empty((0, self.dim or 0), dtype=np.float32)
+        return (
+            np.concatenate([p[0] for p in parts]),
+            np.concatenate([p[1] for p in parts]),
+            [c for p in parts for c in p[2]],
+            np.concatenate([p[3] for p in parts])
+        )
+
+    def wait(self):
+        """等待各分片的后台任务(如IVF分片的训练)完成"""
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            if hasattr(shard, "wait"):
+                shard.wait()
+
+    def load_from_db(self, db: Session, batch_size: int = 5000):
+        """从knowledge_chunks表加载全部已向量化的chunk,按分类分配到各分片"""
+        chunk_ids, document_ids, categories, vectors = fetch_chunk_vectors(db, batch_size)
+        if chunk_ids:
+            self.add(chunk_ids, document_ids, categories, vectors)
+        self.loaded = True
+
+    def rebuild_shard(self, db: Session, category: Optional[str], batch_size: int = 5000) -> int:
+        """
+        只从数据库重建一个分类的分片(新分片建好后再替换旧分片,重建期间检索不受影响)
+
+        读取数据库前开始记录写入该分类的操作(及全部删除操作),新分片建好后在锁内按顺序重放再替换,
+        重建期间的增删不会因为替换而丢失。
+
+        Returns:
+            重建后分片中的向量数量
+        """
+        log: List[tuple] = []
+        with self._lock:
+            self._rebuild_logs.append((category, log))
+        try:
+            condition = KnowledgeChunk.category.is_(None) if category is None else KnowledgeChunk.category == category
+            chunk_ids, document_ids, categories, vectors = fetch_chunk_vectors(db, batch_size, condition)
+            shard = self.shard_factory()
+            if chunk_ids:
+                shard.add(chunk_ids, document_ids, categories, vectors)
+            ids = {int(chunk_id) for chunk_id in chunk_ids}
+
+            with self._lock:
+                for op in log:
+                    if op[0] == "add":
+                        _, op_ids, op_document_ids, op_vectors = op
+                        shard.add(op_ids, op_document_ids, [category] * len(op_ids), op_vectors)
+                        ids.update(int(chunk_id) for chunk_id in op_ids)
+                    else:
+                        shard.remove(op[1])
+                        ids.difference_update(op[1])
+
+                for chunk_id in [cid for cid, c in self._chunk_shards.items() if c == category]:
+                    del self._chunk_shards[chunk_id]
+                # 数据库中已属于该分类、索引里还在其他分片的chunk,从其他分片移除
+                elsewhere = [chunk_id for chunk_id in ids if chunk_id in self._chunk_shards]
+                if elsewhere:
+                    self.remove(elsewhere)
+                if ids:
+                    self._shards[category] = shard
+                    for chunk_id in ids:
+                        self._chunk_shards[chunk_id] = category
+                else:
+                    self._shards.pop(category, None)
+                return len(ids)
+        finally:
+            with self._lock:
+                self._rebuild_logs = [entry for entry in self._rebuild_logs if entry[1] is not log]
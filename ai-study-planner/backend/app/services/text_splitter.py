@@ -0,0 +1,274 @@
+import re
+from typing import Iterator, List, NamedTuple, Optional
+
+# 边界强度: 数值越大越适合作为切分点
+SENTENCE = 1
+PARAGRAPH = 2
+HEADING = 3
+END_OF_TEXT = 4
+
+# 标题(#开头或**加粗**开头的行)之前、空行、中英文句末标点/换行
+_BOUNDARY_PATTERN = re.compile(
+    r"(?P<heading>\n(?:[ \t]*\n)*(?=[ \t]*(?:#{1,6}\s|\*\*)))"
+    r"|(?P<paragraph>\n(?:[ \t]*\n)+)"
+    r"|(?P<sentence>[。！？；!?;…]+[”’」』）)\"']*|\n)"
+)
+_BOUNDARY_STRENGTH = {"heading": HEADING, "paragraph": PARAGRAPH, "sentence": SENTENCE}
+
+# token估算: 每个中文字符、每个英文单词/数字串、每个其他可见符号各计1个token
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]|[A-Za-z0-9]+|\S")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的模型token数(不依赖具体tokenizer)"""
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+
+def sentence_ends(text: str) -> List[int]:
+    """文本中各标题/段落/句子边界的结束偏移(不含文本末尾)"""
+    return [match.end() for match in _BOUNDARY_PATTERN.finditer(text) if 0 < match.end() < len(text)]
+
+
+class TextChunk(NamedTuple):
+    """切分结果,start/end为在原文中的字符偏移"""
+    text: str
+    start: int
+    end: int
+
+
+class _Segment(NamedTuple):
+    start: int
+    end: int
+    size: int
+    strength: int
+
+
+class TextSplitter:
+    """
+    按边界切分的流式文本切分器
+
+    单遍扫描文本,把文本拆成以标题/段落/句末标点结尾的片段,再把片段累积成不超过chunk_size的chunk,
+    优先在强边界(标题 > 段落 > 句子)处断开;单个超长片段才会被硬切。
+    split()是生成器,逐个产出带字符偏移的chunk,不会一次性构造完整列表。
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 500,
+        chunk_overlap: int = 100,
+        length_unit: str = "char",
+        min_fill: float = 0.5
+    ):
+        """
+        Args:
+            chunk_size: 每个chunk的最大长度
+            chunk_overlap: 相邻chunk之间的最大重叠长度(按整句重叠)
+            length_unit: 长度单位(char: 字符数, token: 估算的模型token数)
+            min_fill: 选择切分点时chunk至少达到chunk_size的比例
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size必须大于0")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_overlap必须大于等于0且小于chunk_size")
+        if length_unit not in ("char", "token"):
+            raise ValueError(f"不支持的长度单位: {length_unit}")
+
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_unit = length_unit
+        self.min_fill = min_fill
+
+    def _measure(self, text: str, start: int, end: int) -> int:
+        if self.length_unit == "char":
+            return end - start
+        return sum(1 for _ in _TOKEN_PATTERN.finditer(text, start, end))
+
+    def _fit_segment(self, text: str, start: int, end: int, strength: int) -> Iterator[_Segment]:
+        size = self._measure(text, start, end)
+        if size <= self.chunk_size:
+            yield _Segment(start, end, size, strength)
+            return
+
+        # 超长片段: 按长度单位硬切,最后一段保留原边界强度
+        if self.length_unit == "char":
+            cuts = list(range(start + self.chunk_size, end, self.chunk_size))
+        else:
+            cuts = []
+            count = 0
+            for match in _TOKEN_PATTERN.finditer(text, start, end):
+                count += 1
+                if count == self.chunk_size:
+                    cuts.append(match.end())
+                    count = 0
+            if cuts and cuts[-1] >= end:
+                cuts.pop()
+
+        bounds = [start] + cuts + [end]
+        for i in range(len(bounds) - 1):
+            piece_strength = strength if i == len(bounds) - 2 else 0
+            yield _Segment(bounds[i], bounds[i + 1], self._measure(text, bounds[i], bounds[i + 1]), piece_strength)
+
+    def _choose_cut(self, buffer: List[_Segment], n_overlap: int) -> int:
+        """在缓冲区中选择切分点(返回最后一个纳入chunk的片段下标)"""
+        best, best_strength = len(buffer) - 1, -1
+        total = 0
+        min_size = self.chunk_size * self.min_fill
+        for i, segment in enumerate(buffer):
+            total += segment.size
+            if i < n_overlap or total < min_size:
+                continue
+            if segment.strength >= best_strength:
+                best, best_strength = i, segment.strength
+        return max(best, n_overlap)
+
+    def _make_chunk(self, text: str, segments: List[_Segment]):
+        start, end = segments[0].start, segments[-1].end
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            return TextChunk(text[start:end], start, end)
+        return None
+
+    def split(self, text: str) -> Iterator[TextChunk]:
+        """
+        切分文本
+
+        Args:
+            text: 待切分文本
+
+        Yields:
+            TextChunk(text, start, end)
+        """
+        stream = SplitStream(self)
+        stream._text = text
+        yield from stream._consume(final=True)
+
+    def stream(self) -> "SplitStream":
+        """创建增量切分状态,用于分段读入的大文本(见SplitStream)"""
+        return SplitStream(self)
+
+
+class SplitStream:
+    """
+    增量切分: 文本分多次feed,已切出的chunk随时返回,只保留尚未输出的文本
+
+    边界匹配在距末尾_LOOKAHEAD个字符以内时先不处理(后续文本可能改变边界类型,如换行后出现标题),
+    因此切分结果与一次性split()相同。连续很长一段没有任何边界时提前硬切以保证内存占用有界,
+    此时按token计长的切点可能与一次性切分略有不同。
+    """
+
+    _LOOKAHEAD = 64
+
+    def __init__(self, splitter: TextSplitter):
+        self.splitter = splitter
+        self._text = ""
+        self._base = 0  # _text[0]在原文中的偏移
+        self._scan = 0  # _text中已拆分为片段的位置
+        self._buffer: List[_Segment] = []
+        self._buffer_size = 0
+        self._n_overlap = 0  # 缓冲区开头来自上一个chunk的重叠片段数
+
+    @property
+    def pending_chars(self) -> int:
+        """当前保留在内存中的文本长度"""
+        return len(self._text)
+
+    def feed(self, piece: str) -> List[TextChunk]:
+        """追加一段文本,返回因此可以确定的chunk"""
+        self._text += piece
+        chunks = list(self._consume(final=False))
+        self._trim()
+        return chunks
+
+    def finish(self) -> List[TextChunk]:
+        """文本结束,返回剩余的chunk"""
+        chunks = list(self._consume(final=True))
+        self._text, self._base, self._scan = "", self._base + len(self._text), 0
+        return chunks
+
+    def _consume(self, final: bool) -> Iterator[TextChunk]:
+        splitter = self.splitter
+        text = self._text
+        limit = len(text) if final else len(text) - self._LOOKAHEAD
+        pos = self._scan
+
+        for match in _BOUNDARY_PATTERN.finditer(text, pos):
+            end = match.end()
+            if end > limit:
+                break
+            if end > pos:
+                for segment in splitter._fit_segment(text, pos, end, _BOUNDARY_STRENGTH[match.lastgroup]):
+                    yield from self._add(segment)
+                pos = end
+
+        if final:
+            if pos < len(text):
+                for segment in splitter._fit_segment(text, pos, len(text), END_OF_TEXT):
+                    yield from self._add(segment)
+                pos = len(text)
+        elif limit - pos > splitter.chunk_size * 4:
+            # 长段落中没有任何边界: 先硬切已确定的部分(按字符计时切点与一次性切分一致)
+            cut = limit
+            if splitter.length_unit == "char":
+                cut = pos + (limit - pos) // splitter.chunk_size * splitter.chunk_size
+            for segment in splitter._fit_segment(text, pos, cut, 0):
+                yield from self._add(segment)
+            pos = cut
+        self._scan = pos
+
+        if final and len(self._buffer) > self._n_overlap:
+            chunk = self._emit(self._buffer)
+            if chunk:
+                yield chunk
+        if final:
+            self._buffer, self._buffer_size, self._n_overlap = [], 0, 0
+
+    def _add(self, segment: _Segment) -> Iterator[TextChunk]:
+        splitter = self.splitter
+        while self._buffer and self._buffer_size + segment.size > splitter.chunk_size:
+            if self._n_overlap == len(self._buffer):
+                # 缓冲区只剩重叠内容,放弃重叠以容纳新片段
+                self._buffer, self._buffer_size, self._n_overlap = [], 0, 0
+                break
+
+            cut = splitter._choose_cut(self._buffer, self._n_overlap)
+            emitted, rest = self._buffer[:cut + 1], self._buffer[cut + 1:]
+            chunk = self._emit(emitted)
+            if chunk:
+                yield chunk
+
+            # 从已输出部分的末尾取整句作为重叠(不含首个片段,保证起点前进);
+            # 在标题处断开时新章节从标题开始,不再重叠
+            overlap: List[_Segment] = []
+            overlap_size = 0
+            tail = emitted[1:] if emitted[-1].strength < HEADING else []
+            for seg in reversed(tail):
+                if overlap_size + seg.size > splitter.chunk_overlap:
+                    break
+                overlap.insert(0, seg)
+                overlap_size += seg.size
+
+            self._buffer = overlap + rest
+            self._buffer_size = overlap_size + sum(seg.size for seg in rest)
+            self._n_overlap = len(overlap)
+
+        self._buffer.append(segment)
+        self._buffer_size += segment.size
+
+    def _emit(self, segments: List[_Segment]) -> Optional[TextChunk]:
+        chunk = self.splitter._make_chunk(self._text, segments)
+        if chunk and self._base:
+            chunk = TextChunk(chunk.text, chunk.start + self._base, chunk.end + self._base)
+        return chunk
+
+    def _trim(self):
+        """丢弃已输出且不再用作重叠的文本"""
+        keep_from = self._buffer[0].start if self._buffer else self._scan
+        if keep_from <= 0:
+            return
+        self._text = self._text[keep_from:]
+        self._base += keep_from
+        self._scan -= keep_from
+        self._buffer = [seg._replace(start=seg.start - keep_from, end=seg.end - keep_from) for seg in self._buffer]
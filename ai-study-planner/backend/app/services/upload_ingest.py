@@ -0,0 +1,349 @@
+import asyncio
+import codecs
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.knowledge_base import KnowledgeDocument, VECTORIZE_DONE, VECTORIZE_FAILED, VECTORIZE_IMPORTING
+
+# 上传任务状态
+UPLOAD_QUEUED = "queued"
+UPLOAD_RUNNING = "running"
+UPLOAD_DONE = "done"
+UPLOAD_FAILED = "failed"
+
+# 文档content只保存文件开头的预览(MySQL TEXT上限为64KB),完整内容以chunks形式存储,
+# 这类文档标记content_is_preview,不能按content重新向量化或修改内容(需重新上传)。
+# 不超过该长度的文件content即为全文,与直接创建文档完全相同。
+PREVIEW_CHARS = 20000
+
+# 服务重启后仍处于导入中的文档的错误信息
+INTERRUPTED_ERROR = "上传文件导入中断,请删除文档后重新上传"
+
+
+class UploadJob:
+    """单个上传文件的导入任务"""
+
+    def __init__(self, filename: str, path: str, size: int, category: str, keywords: Optional[List[str]]):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.category = category
+        self.keywords = keywords
+        self.status = UPLOAD_QUEUED
+        self.document_id: Optional[int] = None
+        self.bytes_read = 0
+        self.chunks = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (UPLOAD_DONE, UPLOAD_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "filename": self.filename,
+            "document_id": self.document_id,
+            "bytes_total": self.size,
+            "bytes_read": self.bytes_read,
+            "progress": round(self.bytes_read / self.size, 4) if self.size else 1.0,
+            "chunks": self.chunks,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class UploadIngestManager:
+    """
+    上传文件的流式导入
+
+    接口只把上传内容分块拷贝到临时文件并登记任务,随即返回任务ID。后台任务按固定大小读取临时文件,
+    用增量UTF-8解码器解码(多字节字符跨块也能正确处理),送入增量切分器,切出的chunk攒满一批
+    即放入有界队列,由写入协程生成embedding并写库、更新索引。读取与embedding并行进行,
+    队列满时读取暂停,因此内存占用只与配置的块大小和批次数有关,与文件大小无关。
+    导入失败或被取消时删除已写入的部分文档。任务记录只保存在内存中。
+    """
+
+    def __init__(
+        self,
+        read_size: int = 65536,
+        batch_chunks: int = 64,
+        max_pending_batches: int = 4,
+        max_jobs: int = 2,
+        history_size: int = 200
+    ):
+        self.read_size = read_size
+        self.batch_chunks = batch_chunks
+        self.max_pending_batches = max_pending_batches
+        self.history_size = history_size
+        self._semaphore = asyncio.Semaphore(max_jobs)
+        self._jobs: "OrderedDict[str, UploadJob]" = OrderedDict()
+
+    async def submit(
+        self,
+        file: BinaryIO,
+        filename: str,
+        category: str = "general",
+        keywords: Optional[List[str]] = None
+    ) -> UploadJob:
+        """
+        把上传文件拷贝到临时文件并启动后台导入
+
+        Args:
+            file: 上传文件对象(UploadFile.file)
+            filename: 文件名,作为文档标题
+            category: 文档分类
+            keywords: 关键词列表
+
+        Returns:
+            已登记的任务
+        """
+        path = await asyncio.to_thread(self._spool, file)
+        job = UploadJob(filename, path, os.path.getsize(path), category, keywords)
+        self._jobs[job.job_id] = job
+        self._prune()
+        job.task = asyncio.create_task(self._run(job), name=f"upload-ingest-{job.job_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[UploadJob]:
+        return self._jobs.get(job_id)
+
+    @staticmethod
+    def recover_interrupted() -> int:
+        """
+        把上次进程退出时仍在导入中的文档标记为失败(其chunks不完整,需删除后重新上传),返回文档数量
+
+        任务记录只保存在内存中,启动时库中处于导入中的文档都已没有对应的任务
+        """
+        db = SessionLocal()
+        try:
+            count = db.query(KnowledgeDocument).filter(
+                KnowledgeDocument.is_vectorized == VECTORIZE_IMPORTING
+            ).update({
+                KnowledgeDocument.is_vectorized: VECTORIZE_FAILED,
+                KnowledgeDocument.vectorize_error: INTERRUPTED_ERROR
+            }, synchronize_session=False)
+            db.commit()
+            if count:
+                print(f"{count}个上传文档的导入在服务停止时中断,已标记为失败")
+            return count
+        finally:
+            db.close()
+
+    async def shutdown(self):
+        """取消未完成的任务(已写入的部分文档会被删除)"""
+        tasks = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spool(self, file: BinaryIO) -> str:
+        """分块拷贝到临时文件(请求结束后上传文件对象即被关闭)"""
+        fd, path = tempfile.mkstemp(prefix="knowledge_upload_", suffix=".txt")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                file.seek(0)
+                shutil.copyfileobj(file, out, self.read_size)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def _prune(self):
+        """只保留最近的history_size条已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: UploadJob):
+        try:
+            async with self._semaphore:
+                job.status = UPLOAD_RUNNING
+                await self._ingest(job)
+            job.status = UPLOAD_DONE
+        except asyncio.CancelledError:
+            self._fail(job, "服务停止,导入已取消")
+            raise
+        except UnicodeDecodeError:
+            self._fail(job, "文件格式不支持,请上传UTF-8编码的文本文件")
+        except Exception as e:
+            self._fail(job, str(e))
+            print(f"上传文件导入失败: {job.filename}, 错误: {str(e)}")
+        finally:
+            job.finished_at = datetime.now()
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass
+
+    def _fail(self, job: UploadJob, error: str):
+        job.status = UPLOAD_FAILED
+        job.error = error
+        if job.document_id is not None:
+            self._delete_partial_document(job.document_id)
+
+    @staticmethod
+    def _delete_partial_document(document_id: int):
+        from .knowledge_service import KnowledgeService, knowledge_generation
+
+        db = SessionLocal()
+        try:
+            service = KnowledgeService(db)
+            service._delete_chunks(document_id)
+            document = service.get_document(document_id)
+            if document:
+                db.delete(document)
+            db.commit()
+            knowledge_generation.bump()
+        except Exception as e:
+            db.rollback()
+            print(f"清理未完成的上传文档失败: document_id={document_id}, 错误: {str(e)}")
+        finally:
+            db.close()
+
+    async def _ingest(self, job: UploadJob):
+        # 延迟导入,避免与knowledge_service循环引用
+        from .knowledge_service import KnowledgeService, knowledge_generation
+
+        db = SessionLocal()
+        try:
+            service = KnowledgeService(db)
+            # 导入期间content为空且不是全文: 向量化任务和手动重试都不会按content重新切分
+            document = KnowledgeDocument(
+                title=job.filename,
+                content="",
+                category=job.category,
+                keywords=job.keywords,
+                source=job.filename,
+                is_vectorized=VECTORIZE_IMPORTING,
+                content_is_preview=True
+            )
+            db.add(document)
+            db.commit()
+            job.document_id = document.id
+
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending_batches)
+            writer = asyncio.create_task(self._write_batches(service, job, queue))
+            try:
+                preview = await self._read_and_split(service, job, queue, writer)
+                await self._put(queue, None, writer)
+                await writer
+            finally:
+                if not writer.done():
+                    writer.cancel()
+                    await asyncio.gather(writer, return_exceptions=True)
+
+            document = service.get_document(job.document_id)
+            document.content, truncated = preview
+            document.content_is_preview = truncated
+            document.chunk_count = job.chunks
+            document.is_vectorized = VECTORIZE_DONE
+            document.vectorize_error = None
+            db.commit()
+            knowledge_generation.bump()
+        finally:
+            db.close()
+
+    async def _read_and_split(
+        self,
+        service,
+        job: UploadJob,
+        queue: asyncio.Queue,
+        writer: asyncio.Task
+    ) -> Tuple[str, bool]:
+        """读取并切分文件,每攒满一批chunk放入队列,返回(内容预览, 预览是否短于全文)"""
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        stream = service._text_splitter().stream()
+        preview_parts: List[str] = []
+        preview_len = 0
+        truncated = False
+        batch: List[str] = []
+
+        with open(job.path, "rb") as f:
+            while True:
+                data = await asyncio.to_thread(f.read, self.read_size)
+                final = not data
+                text = decoder.decode(data, final=final)
+                job.bytes_read += len(data)
+
+                if text:
+                    part = text[:PREVIEW_CHARS - preview_len]
+                    truncated = truncated or len(part) < len(text)
+                    if part:
+                        preview_parts.append(part)
+                        preview_len += len(part)
+
+                chunks = stream.feed(text) if text else []
+                if final:
+                    chunks.extend(stream.finish())
+                for chunk in chunks:
+                    batch.append(chunk.text)
+                    if len(batch) >= self.batch_chunks:
+                        await self._put(queue, batch, writer)
+                        batch = []
+                if final:
+                    break
+
+        if batch:
+            await self._put(queue, batch, writer)
+        return "".join(preview_parts), truncated
+
+    @staticmethod
+    async def _put(queue: asyncio.Queue, item, writer: asyncio.Task):
+        """放入队列;写入协程已异常退出时不再等待,直接抛出其异常"""
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            writer.result()
+            raise RuntimeError("导入写入任务已退出")
+
+    async def _write_batches(self, service, job: UploadJob, queue: asyncio.Queue):
+        """
+        逐批生成embedding并写入chunks和索引
+
+        写库、MinHash和索引写入在线程中用独立会话执行,事件循环上只等待embedding
+        """
+        from .knowledge_service import chunk_content_hash, run_in_session
+
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            hashes = [chunk_content_hash(text) for text in batch]
+            embeddings = await service._embed_with_cache(batch, hashes)
+            chunk_indexes = list(range(job.chunks, job.chunks + len(batch)))
+            await asyncio.to_thread(
+                run_in_session,
+                lambda store: store._store_vectors(job.document_id, batch, embeddings, chunk_indexes, hashes)
+            )
+            job.chunks += len(batch)
+
+
+_upload_ingest_manager: Optional[UploadIngestManager] = None
+
+
+def get_upload_ingest_manager() -> UploadIngestManager:
+    """获取进程内共享的上传导入任务管理器"""
+    global _upload_ingest_manager
+    if _upload_ingest_manager is None:
+        _upload_ingest_manager = UploadIngestManager(
+            read_size=settings.KNOWLEDGE_UPLOAD_READ_SIZE,
+            batch_chunks=settings.KNOWLEDGE_UPLOAD_BATCH_CHUNKS,
+            max_pending_batches=settings.KNOWLEDGE_UPLOAD_MAX_PENDING_BATCHES,
+            max_jobs=settings.KNOWLEDGE_UPLOAD_MAX_JOBS
+        )
+    return _upload_ingest_manager
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from datetime import datetime
 from ..models.user_profile import UserProfile
 from ..schemas.user_profile import UserProfileCreate, UserProfileUpdate
+from .prompt_builder import forget_user_context
 from typing import Optional
 
 
@@ -57,6 +58,7 @@ class UserProfileService:
         
         db.commit()
         db.refresh(db_profile)
+        forget_user_context(user_id)
         return db_profile
     
     @staticmethod
@@ -68,4 +70,5 @@ class UserProfileService:
         
         db.delete(db_profile)
         db.commit()
+        forget_user_context(user_id)
         return True
\ No newline at end of file
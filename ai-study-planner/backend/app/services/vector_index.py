@@ -0,0 +1,419 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.knowledge_base import KnowledgeChunk
+from .embedding_codec import decode_mixed
+from .embedding_service import get_embedding_provider
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行做L2归一化,使点积等价于余弦相似度"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class FlatVectorIndex:
+    """
+    进程内暴力检索向量索引
+
+    所有chunk向量按行存放在一块连续的float32矩阵中(已L2归一化),
+    与之平行的数组记录chunk ID、文档ID和分类编码。
+    检索时一次矩阵乘法完成全部打分,再用argpartition取top-k,避免全量排序。
+
+    检索只在取数组引用时持有锁,打分在锁外进行: 追加写入只写检索可见范围之外的行,
+    删除时若有检索正在读取则先复制数组再修改(写时复制)。
+    """
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._size = 0
+        self._matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self._chunk_ids = np.empty(0, dtype=np.int64)
+        self._document_ids = np.empty(0, dtype=np.int64)
+        self._category_codes = np.empty(0, dtype=np.int32)
+        self._categories: Dict[str, int] = {}
+        self._id_to_row: Dict[int, int] = {}
+        self._readers = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _category_code(self, category: Optional[str]) -> int:
+        if category is None:
+            return -1
+        if category not in self._categories:
+            self._categories[category] = len(self._categories)
+        return self._categories[category]
+
+    def _reserve(self, capacity: int):
+        """按倍增策略扩容,保证追加写入的均摊复杂度为O(1)"""
+        if capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(capacity, self._matrix.shape[0] * 2, 1024)
+        n = self._size
+
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        matrix[:n] = self._matrix[:n]
+        self._matrix = matrix
+
+        for name, dtype in (
+            ("_chunk_ids", np.int64),
+            ("_document_ids", np.int64),
+            ("_category_codes", np.int32),
+        ):
+            array = np.empty(new_capacity, dtype=dtype)
+            array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+
+    def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_ids: Sequence[int],
+        categories: Sequence[Optional[str]],
+        vectors
+    ):
+        """
+        批量写入向量(已存在的chunk ID会被覆盖)
+
+        Args:
+            chunk_ids: chunk ID列表
+            document_ids: 对应的文档ID列表
+            categories: 对应的分类列表
+            vectors: 形如(n, dim)的向量矩阵
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(chunk_ids):
+            raise ValueError("向量数量与chunk数量不一致")
+        if len(chunk_ids) == 0:
+            return
+
+        with self._lock:
+            if self.dim is None or self._size == 0:
+                self.dim = self.dim or vectors.shape[1]
+                if self._matrix.shape[1] != self.dim:
+                    self._matrix = np.empty((0, self.dim), dtype=np.float32)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: 期望{self.dim}, 实际{vectors.shape[1]}")
+
+            existing = [cid for cid in chunk_ids if int(cid) in self._id_to_row]
+            if existing:
+                self.remove(existing)
+
+            start = self._size
+            end = start + len(chunk_ids)
+            self._reserve(end)
+            self._matrix[start:end] = _normalize_rows(vectors)
+            self._chunk_ids[start:end] = chunk_ids
+            self._document_ids[start:end] = document_ids
+            self._category_codes[start:end] = [self._category_code(c) for c in categories]
+            for row, chunk_id in enumerate(chunk_ids, start):
+                self._id_to_row[int(chunk_id)] = row
+            self._size = end
+
+    def remove(self, chunk_ids: Sequence[int]) -> int:
+        """
+        删除指定chunk的向量,用末尾的行填补空位(只移动与删除数量相同的行,不整体压缩)
+
+        Returns:
+            实际删除的数量
+        """
+        with self._lock:
+            rows = {self._id_to_row.pop(int(c)) for c in set(chunk_ids) if int(c) in self._id_to_row}
+            if not rows:
+                return 0
+            if self._readers:
+                self._detach()
+
+            n = self._size
+            remaining = n - len(rows)
+            holes = sorted(row for row in rows if row < remaining)
+            moved = [row for row in range(remaining, n) if row not in rows]
+            if holes:
+                for name in ("_matrix", "_chunk_ids", "_document_ids", "_category_codes"):
+                    array = getattr(self, name)
+                    array[holes] = array[moved]
+                for row in holes:
+                    self._id_to_row[int(self._chunk_ids[row])] = row
+            self._size = remaining
+            return len(rows)
+
+    def _detach(self):
+        """写时复制: 换成数组的副本再原地修改,锁外正在打分的检索继续读取原数组"""
+        for name in ("_matrix", "_chunk_ids", "_document_ids", "_category_codes"):
+            setattr(self, name, getattr(self, name).copy())
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        category: Optional[str] = None,
+        min_score: Optional[float] = None,
+        candidate_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        检索与查询向量最相似的chunk
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回结果数
+            category: 限定分类
+            min_score: 最小余弦相似度
+            candidate_ids: 预过滤得到的候选chunk ID,指定后只对这些chunk打分
+
+        Returns:
+            按得分降序排列的(chunk_id, score)列表
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0 or top_k <= 0:
+            return []
+        query = query / norm
+
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            if query.shape[0] != self.dim:
+                raise ValueError(f"查询向量维度不匹配: 期望{self.dim}, 实际{query.shape[0]}")
+
+            code = None
+            if category is not None:
+                code = self._categories.get(category)
+                if code is None:
+                    return []
+            rows = None
+            if candidate_ids is not None:
+                rows = np.array(
+                    [self._id_to_row[int(c)] for c in candidate_ids if int(c) in self._id_to_row],
+                    dtype=np.int64
+                )
+                if len(rows) == 0:
+                    return []
+            matrix, all_chunk_ids, all_codes = self._matrix, self._chunk_ids, self._category_codes
+            self._readers += 1
+
+        try:
+            scores = matrix[:n] @ query if rows is None else matrix[rows] @ query
+            if code is not None:
+                codes = all_codes[:n] if rows is None else all_codes[rows]
+                scores[codes != code] = -np.inf
+
+            m = len(scores)
+            k = min(top_k, m)
+            if k < m:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(m)
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            threshold = -np.inf if min_score is None else min_score
+            chunk_ids = all_chunk_ids[:n] if rows is None else all_chunk_ids[rows]
+            return [
+                (int(chunk_ids[i]), float(scores[i]))
+                for i in top
+                if scores[i] > -np.inf and scores[i] >= threshold
+            ]
+        finally:
+            with self._lock:
+                self._readers -= 1
+
+    def export(
+        self,
+        chunk_ids: Optional[Sequence[int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]], np.ndarray]:
+        """
+        导出索引内容的副本: (chunk_ids, document_ids, categories, 归一化后的向量矩阵)
+
+        Args:
+            chunk_ids: 只导出其中的这些chunk(不在索引中的ID忽略),默认导出全部
+        """
+        with self._lock:
+            n = self._size
+            if chunk_ids is None:
+                rows = slice(0, n)
+            else:
+                rows = np.array(
+                    [self._id_to_row[int(c)] for c in chunk_ids if int(c) in self._id_to_row],
+                    dtype=np.int64
+                )
+            names = {code: name for name, code in self._categories.items()}
+            categories = [names.get(int(code)) for code in self._category_codes[rows]]
+            return (
+                self._chunk_ids[rows].copy(),
+                self._document_ids[rows].copy(),
+                categories,
+                self._matrix[rows].copy()
+            )
+
+    def load_from_db(self, db: Session, batch_size: int = 5000):
+        """从knowledge_chunks表加载全部已向量化的chunk"""
+        chunk_ids, document_ids, categories, vectors = fetch_chunk_vectors(db, batch_size)
+        if chunk_ids:
+            self.add(chunk_ids, document_ids, categories, vectors)
+        self.loaded = True
+
+
+def vectorized_chunk_filter():
+    """已向量化且与当前embedding模型一致的chunk(不同模型的向量不可比较),不含被标记为近似重复的chunk"""
+    return (
+        or_(KnowledgeChunk.embedding_blob.isnot(None), KnowledgeChunk.embedding_vector.isnot(None)),
+        KnowledgeChunk.embedding_model == get_embedding_provider().model_name,
+        KnowledgeChunk.duplicate_of.is_(None)
+    )
+
+
+def fetch_chunk_vectors(db: Session, batch_size: int = 5000, *criteria):
+    """
+    读取当前embedding模型下的全部chunk向量(只查询检索所需的列,跳过被标记为近似重复的chunk)
+
+    二进制向量拼接后一次性解码为矩阵;尚未迁移的旧版JSON向量逐行解析
+
+    Args:
+        criteria: 附加的过滤条件(如只读取某个分类)
+
+    Returns:
+        (chunk_ids, document_ids, categories, vectors)
+    """
+    model_name = get_embedding_provider().model_name
+    chunk_ids, document_ids, categories, blobs, codecs = [], [], [], [], []
+    rows = db.query(
+        KnowledgeChunk.id,
+        KnowledgeChunk.document_id,
+        KnowledgeChunk.category,
+        KnowledgeChunk.embedding_codec,
+        KnowledgeChunk.embedding_blob
+    ).filter(
+        KnowledgeChunk.embedding_model == model_name,
+        KnowledgeChunk.embedding_blob.isnot(None),
+        KnowledgeChunk.duplicate_of.is_(None),
+        *criteria
+    ).yield_per(batch_size)
+
+    for chunk_id, document_id, category, codec, blob in rows:
+        chunk_ids.append(chunk_id)
+        document_ids.append(document_id)
+        categories.append(category)
+        blobs.append(blob)
+        codecs.append(codec)
+    matrices = [decode_mixed(blobs, codecs)] if blobs else []
+    del blobs
+
+    legacy = db.query(
+        KnowledgeChunk.id,
+        KnowledgeChunk.document_id,
+        KnowledgeChunk.category,
+        KnowledgeChunk.embedding_vector
+    ).filter(
+        KnowledgeChunk.embedding_model == model_name,
+        KnowledgeChunk.embedding_blob.is_(None),
+        KnowledgeChunk.embedding_vector.isnot(None),
+        KnowledgeChunk.duplicate_of.is_(None),
+        *criteria
+    ).yield_per(batch_size)
+
+    legacy_vectors = []
+    for chunk_id, document_id, category, vector in legacy:
+        chunk_ids.append(chunk_id)
+        document_ids.append(document_id)
+        categories.append(category)
+        legacy_vectors.append(vector)
+    if legacy_vectors:
+        print(f"有{len(legacy_vectors)}个chunk仍为JSON格式向量,建议运行scripts/migrate_embeddings.py迁移")
+        matrices.append(np.asarray(legacy_vectors, dtype=np.float32))
+
+    if not matrices:
+        return chunk_ids, document_ids, categories, np.empty((0, 0), dtype=np.float32)
+    vectors = matrices[0] if len(matrices) == 1 else np.vstack(matrices)
+    return chunk_ids, document_ids, categories, vectors
+
+
+def create_vector_index():
+    """
+    根据配置创建向量索引后端(flat: 精确检索, ivf: 倒排聚类近似检索)
+
+    KNOWLEDGE_INDEX_SHARDING=category时每个分类一个分片,分片内使用上述后端(不使用本地索引文件)
+    """
+    backend = settings.KNOWLEDGE_INDEX_BACKEND.lower()
+    if backend not in ("flat", "ivf"):
+        raise ValueError(f"不支持的向量索引类型: {settings.KNOWLEDGE_INDEX_BACKEND}")
+    sharding = settings.KNOWLEDGE_INDEX_SHARDING.lower()
+    if sharding not in ("none", "category"):
+        raise ValueError(f"不支持的索引分片方式: {settings.KNOWLEDGE_INDEX_SHARDING}")
+
+    if sharding == "category":
+        from .sharded_index import ShardedVectorIndex
+        if backend == "ivf":
+            from .ann_index import IVFVectorIndex
+
+            def shard_factory():
+                return IVFVectorIndex(nlist=settings.KNOWLEDGE_IVF_NLIST, n_probe=settings.KNOWLEDGE_IVF_NPROBE)
+        else:
+            shard_factory = FlatVectorIndex
+        return ShardedVectorIndex(shard_factory, max_workers=settings.KNOWLEDGE_INDEX_SHARD_WORKERS)
+
+    if backend == "ivf":
+        from .ann_index import IVFVectorIndex
+        return IVFVectorIndex(
+            nlist=settings.KNOWLEDGE_IVF_NLIST,
+            n_probe=settings.KNOWLEDGE_IVF_NPROBE,
+            path=settings.KNOWLEDGE_INDEX_PATH or None,
+            save_interval=settings.KNOWLEDGE_INDEX_SAVE_INTERVAL
+        )
+    return FlatVectorIndex()
+
+
+# 进程级单例:每个进程只从数据库加载一次
+_vector_index: Optional[FlatVectorIndex] = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index(db: Session):
+    """获取进程内共享的向量索引,首次调用时从数据库加载"""
+    global _vector_index
+    if _vector_index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                index = create_vector_index()
+                index.load_from_db(db)
+                _vector_index = index
+    return _vector_index
+
+
+def reset_vector_index():
+    """丢弃当前索引,下次访问时重新从数据库加载"""
+    global _vector_index
+    with _vector_index_lock:
+        _vector_index = None
+
+
+def close_vector_index():
+    """进程退出前调用: 等待索引的后台任务完成,并把尚未落盘的修改保存到本地索引文件"""
+    index = _vector_index
+    if index is not None and hasattr(index, "close"):
+        index.close()
+
+
+def rebuild_vector_index(db: Session, category: Optional[str] = None, all_categories: bool = False):
+    """
+    从数据库重建向量索引
+
+    分片索引只重建指定分类的分片(其他分类的分片不受影响);未分片的索引总是整体重建。
+
+    Args:
+        category: 要重建的分类(None表示未设置分类的chunk)
+        all_categories: 重建整个索引
+    """
+    index = get_vector_index(db)
+    if hasattr(index, "rebuild_shard") and not all_categories:
+        index.rebuild_shard(db, category)
+        return
+    reset_vector_index()
+    get_vector_index(db)
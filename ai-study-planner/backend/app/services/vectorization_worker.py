@@ -0,0 +1,209 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.knowledge_base import (
+    KnowledgeDocument,
+    VECTORIZE_FAILED,
+    VECTORIZE_PENDING,
+    VECTORIZE_RUNNING,
+)
+
+
+class VectorizationWorker:
+    """
+    文档向量化后台任务队列
+
+    文档写入接口只需enqueue文档ID即可立即返回,由若干个asyncio worker在后台消费队列。
+    同一文档在排队期间重复入队会被合并;处理过程中再次入队的文档,会在本轮结束后重新处理一次,
+    因此连续多次编辑只会触发一次(至多两次)embedding计算。
+    队列只保存在内存中,进程重启后由recover()根据数据库中的向量化状态重新入队。
+    """
+
+    def __init__(self, concurrency: int = 2, max_retries: int = 3, retry_delay: float = 5.0):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[int] = set()
+        self._running: Set[int] = set()
+        self._dirty: Set[int] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._retry_handles: Dict[int, asyncio.TimerHandle] = {}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def enqueue(self, document_id: int) -> bool:
+        """
+        提交文档向量化任务
+
+        Returns:
+            是否新加入了队列(已在排队中的文档返回False)
+        """
+        document_id = int(document_id)
+        if document_id in self._queued:
+            return False
+        if document_id in self._running:
+            self._dirty.add(document_id)
+            return False
+
+        handle = self._retry_handles.pop(document_id, None)
+        if handle is not None:
+            handle.cancel()
+        self._queued.add(document_id)
+        self._queue.put_nowait(document_id)
+        return True
+
+    def get_state(self, document_id: int) -> Optional[str]:
+        """文档在内存队列中的状态(queued/running/retry_scheduled),不在队列中返回None"""
+        document_id = int(document_id)
+        if document_id in self._running:
+            return "running"
+        if document_id in self._queued:
+            return "queued"
+        if document_id in self._retry_handles:
+            return "retry_scheduled"
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._tasks),
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "retry_scheduled": len(self._retry_handles),
+        }
+
+    async def start(self):
+        """启动worker,并把数据库中未完成的文档重新入队"""
+        if self._tasks:
+            return
+        await asyncio.to_thread(self.recover)
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"vectorization-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """停止worker(正在处理的文档保持处理中状态,下次启动时由recover()重新入队)"""
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def recover(self) -> int:
+        """把待处理和上次中断在处理中的文档重新入队,返回入队数量"""
+        db = SessionLocal()
+        try:
+            rows = db.query(KnowledgeDocument.id).filter(
+                KnowledgeDocument.is_vectorized.in_([VECTORIZE_PENDING, VECTORIZE_RUNNING])
+            ).order_by(KnowledgeDocument.id).all()
+            for (document_id,) in rows:
+                self.enqueue(document_id)
+            return len(rows)
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            document_id = await self._queue.get()
+            self._queued.discard(document_id)
+            self._running.add(document_id)
+            try:
+                await self._process(document_id)
+            except Exception as e:
+                print(f"向量化任务异常: document_id={document_id}, 错误: {str(e)}")
+            finally:
+                self._running.discard(document_id)
+                self._queue.task_done()
+
+            if document_id in self._dirty:
+                self._dirty.discard(document_id)
+                self.enqueue(document_id)
+
+    async def _process(self, document_id: int):
+        # 延迟导入,避免与knowledge_service循环引用
+        from .knowledge_service import KnowledgeService
+
+        # 数据库读写都在线程中用独立会话执行,不阻塞事件循环
+        if not await asyncio.to_thread(self._claim, document_id):
+            return
+        try:
+            await KnowledgeService()._vectorize_document(document_id)
+        except Exception as e:
+            delay = await asyncio.to_thread(self._record_failure, document_id, e)
+            if delay is not None:
+                self._retry_handles[document_id] = asyncio.get_running_loop().call_later(
+                    delay, self._retry, document_id
+                )
+
+    @staticmethod
+    def _claim(document_id: int) -> bool:
+        """把文档标记为处理中,文档不存在或不能重新切分时返回False"""
+        from .knowledge_service import KnowledgeService
+
+        db = SessionLocal()
+        try:
+            document = db.query(KnowledgeDocument).filter(
+                KnowledgeDocument.id == document_id
+            ).first()
+            if not document:
+                return False
+            # 上传导入中或content只是预览的文档不能按content重新切分
+            reason = KnowledgeService.resplit_blocked_reason(document)
+            if reason:
+                print(f"跳过向量化: document_id={document_id}, {reason}")
+                return False
+            document.is_vectorized = VECTORIZE_RUNNING
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def _record_failure(self, document_id: int, error: Exception) -> Optional[float]:
+        """记录失败次数,返回重试前的等待秒数(超过重试次数时标记为失败,返回None)"""
+        db = SessionLocal()
+        try:
+            document = db.query(KnowledgeDocument).filter(
+                KnowledgeDocument.id == document_id
+            ).first()
+            if not document:
+                return None
+
+            delay = None
+            document.vectorize_retries = (document.vectorize_retries or 0) + 1
+            document.vectorize_error = str(error)[:2000]
+            if document.vectorize_retries <= self.max_retries:
+                document.is_vectorized = VECTORIZE_PENDING
+                delay = self.retry_delay * 2 ** (document.vectorize_retries - 1)
+            else:
+                document.is_vectorized = VECTORIZE_FAILED
+            db.commit()
+            print(f"文档向量化失败: document_id={document_id}, 第{document.vectorize_retries}次, 错误: {str(error)}")
+            return delay
+        finally:
+            db.close()
+
+    def _retry(self, document_id: int):
+        self._retry_handles.pop(document_id, None)
+        self.enqueue(document_id)
+
+
+_vectorization_worker: Optional[VectorizationWorker] = None
+
+
+def get_vectorization_worker() -> VectorizationWorker:
+    """获取进程内共享的向量化任务队列"""
+    global _vectorization_worker
+    if _vectorization_worker is None:
+        _vectorization_worker = VectorizationWorker(
+            concurrency=settings.VECTORIZE_WORKERS,
+            max_retries=settings.VECTORIZE_MAX_RETRIES,
+            retry_delay=settings.VECTORIZE_RETRY_DELAY
+        )
+    return _vectorization_worker
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+知识库检索基准测试
+
+用import_knowledge.py中的预置知识扩充出指定规模的合成语料,使用确定性的本地特征哈希embedding,
+对每种检索后端测量: 切分吞吐、embedding吞吐、索引构建耗时、内存占用、查询延迟p50/p95/p99,
+以及相对精确检索(flat)的recall@k。结果写入JSON文件,便于比较不同版本/参数的运行结果。
+不连接数据库,也不调用外部embedding接口。
+
+使用方法:
+    python scripts/benchmark_knowledge.py                                # 10k和100k chunks
+    python scripts/benchmark_knowledge.py --sizes 1000000 --dim 128      # 1M chunks
+    python scripts/benchmark_knowledge.py --backends flat ivf bm25 --baseline data/benchmarks/old.json
+"""
+
+import sys
+import os
+import argparse
+import gc
+import json
+import platform
+import random
+import re
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import numpy as np
+from app.core.config import settings
+from app.services.ann_index import IVFVectorIndex
+from app.services.embedding_service import HashingEmbeddingProvider
+from app.services.lexical_index import BM25Index, build_chunk_text
+from app.services.sharded_index import ShardedVectorIndex
+from app.services.text_splitter import TextSplitter
+from app.services.vector_index import FlatVectorIndex
+from import_knowledge import KNOWLEDGE_DATA
+
+
+# 除预置知识自带的分类外,合成文档还会分配到这些学科分类(使分片后端有接近真实的分类数量)
+SUBJECT_CATEGORIES = ["政治", "英语", "数学", "专业课"]
+
+BACKENDS = ["flat", "ivf", "sharded-flat", "sharded-ivf", "bm25"]
+VECTOR_BACKENDS = {"flat", "ivf", "sharded-flat", "sharded-ivf"}
+
+
+# ==================== 合成语料 ====================
+
+class SyntheticCorpus:
+    """由预置知识扩充出的合成chunk集合(相同seed得到完全相同的语料)"""
+
+    def __init__(self):
+        self.texts = []          # 参与检索的文本(build_chunk_text的结果)
+        self.contents = []       # chunk原文(用于生成查询)
+        self.document_ids = []
+        self.categories = []
+        self.documents = 0
+        self.chars = 0
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+def template_lines():
+    """预置知识按行拆分后的语句池,以及全部标题和关键词"""
+    lines, titles, keywords = [], [], []
+    for item in KNOWLEDGE_DATA:
+        titles.append(item["title"])
+        keywords.extend(item.get("keywords") or [])
+        for line in item["content"].splitlines():
+            line = line.strip().lstrip("-*0123456789.、 ").strip("*")
+            if len(line) >= 6:
+                lines.append(line)
+    return lines, titles, sorted(set(keywords))
+
+
+def _vary(line: str, rng: random.Random) -> str:
+    """替换句中的数字并追加随机编号,使扩充后的语句互不相同"""
+    line = re.sub(r"\d+", lambda _: str(rng.randint(1, 12)), line)
+    return f"{line}(第{rng.randint(1, 500)}讲要点{rng.randint(1, 99)})"
+
+
+def generate_documents(n_documents: int, seed: int = 0):
+    """
+    生成合成文档
+
+    每篇文档随机组合预置知识中的语句(带变化),标题和关键词取自预置知识
+
+    Yields:
+        (文档ID, 标题, 分类, 关键词, 正文)
+    """
+    rng = random.Random(seed)
+    lines, titles, keywords = template_lines()
+    categories = sorted({item["category"] for item in KNOWLEDGE_DATA}) + SUBJECT_CATEGORIES
+    for document_id in range(1, n_documents + 1):
+        category = rng.choice(categories)
+        title = f"{category}-{rng.choice(titles).split('-')[-1]}({document_id})"
+        paragraphs = []
+        for _ in range(rng.randint(3, 8)):
+            sentences = [_vary(rng.choice(lines), rng) for _ in range(rng.randint(2, 6))]
+            paragraphs.append("。".join(sentences) + "。")
+        yield document_id, title, category, rng.sample(keywords, 3), "\n\n".join(paragraphs)
+
+
+def build_corpus(n_chunks: int, seed: int = 0):
+    """
+    生成恰好n_chunks个chunk的合成语料,同时测量切分吞吐
+
+    Returns:
+        (语料, 切分统计)
+    """
+    splitter = TextSplitter(
+        chunk_size=settings.KNOWLEDGE_CHUNK_SIZE,
+        chunk_overlap=settings.KNOWLEDGE_CHUNK_OVERLAP,
+        length_unit=settings.KNOWLEDGE_CHUNK_UNIT
+    )
+    corpus = SyntheticCorpus()
+    split_seconds = 0.0
+    for document_id, title, category, keywords, content in generate_documents(sys.maxsize, seed):
+        started = time.perf_counter()
+        chunks = [chunk.text for chunk in splitter.split(content)]
+        split_seconds += time.perf_counter() - started
+
+        corpus.documents += 1
+        corpus.chars += len(content)
+        for chunk in chunks[:n_chunks - len(corpus)]:
+            corpus.texts.append(build_chunk_text(chunk, title, keywords))
+            corpus.contents.append(chunk)
+            corpus.document_ids.append(document_id)
+            corpus.categories.append(category)
+        if len(corpus) >= n_chunks:
+            break
+
+    chunking = {
+        "documents": corpus.documents,
+        "chars": corpus.chars,
+        "seconds": round(split_seconds, 4),
+        "chars_per_second": round(corpus.chars / split_seconds) if split_seconds else None,
+        "chunks_per_second": round(len(corpus) / split_seconds) if split_seconds else None,
+    }
+    return corpus, chunking
+
+
+def embed_corpus(corpus: SyntheticCorpus, dim: int, batch_size: int = 4096):
+    """用特征哈希embedding生成全部chunk向量,返回(向量矩阵, 统计)"""
+    provider = HashingEmbeddingProvider(dim)
+    vectors = np.empty((len(corpus), dim), dtype=np.float32)
+    started = time.perf_counter()
+    for start in range(0, len(corpus), batch_size):
+        vectors[start:start + batch_size] = provider.embed_sync(corpus.texts[start:start + batch_size])
+    seconds = time.perf_counter() - started
+    return vectors, {
+        "model": provider.model_name,
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(len(corpus) / seconds) if seconds else None,
+    }
+
+
+def make_queries(corpus: SyntheticCorpus, n_queries: int, seed: int = 0):
+    """从随机chunk中截取一段文字作为查询,返回[(查询文本, 来源chunk的分类)]"""
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(n_queries):
+        row = rng.randrange(len(corpus))
+        content = corpus.contents[row]
+        length = min(len(content), rng.randint(8, 30))
+        start = rng.randint(0, len(content) - length)
+        queries.append((content[start:start + length], corpus.categories[row]))
+    return queries
+
+
+# ==================== 检索后端 ====================
+
+def create_backend(name: str, args):
+    if name == "flat":
+        return FlatVectorIndex()
+    if name == "ivf":
+        return IVFVectorIndex(nlist=args.nlist, n_probe=args.nprobe)
+    if name == "sharded-flat":
+        return ShardedVectorIndex(FlatVectorIndex, max_workers=args.shard_workers)
+    if name == "sharded-ivf":
+        return ShardedVectorIndex(
+            lambda: IVFVectorIndex(nlist=args.nlist, n_probe=args.nprobe),
+            max_workers=args.shard_workers
+        )
+    if name == "bm25":
+        return BM25Index()
+    raise ValueError(f"未知的检索后端: {name}")
+
+
+def build_backend(name: str, args, corpus: SyntheticCorpus, chunk_ids, vectors, batch_size: int = 50000):
+    """按批写入全部chunk(与服务启动时从数据库加载的方式一致)"""
+    index = create_backend(name, args)
+    for start in range(0, len(corpus), batch_size):
+        end = start + batch_size
+        payload = corpus.texts[start:end] if name == "bm25" else vectors[start:end]
+        index.add(chunk_ids[start:end], corpus.document_ids[start:end], corpus.categories[start:end], payload)
+    if hasattr(index, "wait"):
+        # IVF在后台线程中训练聚类中心,等训练完成后再计时检索
+        index.wait()
+    return index
+
+
+def measure_memory(name: str, args, corpus, chunk_ids, vectors):
+    """
+    单独再构建一次索引测量内存(tracemalloc会拖慢Python代码,不与构建耗时放在同一次测量中)
+
+    Returns:
+        (构建完成后索引占用的字节数, 构建过程中的峰值字节数)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        index = build_backend(name, args, corpus, chunk_ids, vectors)
+        current, peak = tracemalloc.get_traced_memory()
+        del index
+    finally:
+        tracemalloc.stop()
+    return current, peak
+
+
+def percentile_ms(samples, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def run_queries(name: str, index, queries, query_vectors, top_k: int, scoped: bool, exact=None):
+    """
+    逐条执行查询,统计延迟分位数;提供exact时计算recall@k
+
+    Args:
+        scoped: 是否限定为查询来源chunk的分类
+        exact: 每条查询的精确检索结果(chunk ID集合)
+    """
+    latencies, recalls, results = [], [], []
+    warmup = min(10, len(queries))
+    for i, (query, category) in enumerate(queries):
+        category = category if scoped else None
+        started = time.perf_counter()
+        if name == "bm25":
+            hits = index.search(query, top_k, category)
+        else:
+            hits = index.search(query_vectors[i], top_k, category, None)
+        elapsed = time.perf_counter() - started
+        if i >= warmup or len(queries) <= warmup:
+            latencies.append(elapsed)
+        ids = {chunk_id for chunk_id, _ in hits}
+        results.append(ids)
+        if exact is not None and exact[i]:
+            recalls.append(len(ids & exact[i]) / len(exact[i]))
+
+    return {
+        "queries": len(latencies),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+        f"recall_at_{top_k}": round(float(np.mean(recalls)), 4) if recalls else None,
+    }, results
+
+
+def benchmark_size(n_chunks: int, args):
+    print(f"\n--- {n_chunks} chunks ---")
+    corpus, chunking = build_corpus(n_chunks, args.seed)
+    print(f"语料: {corpus.documents}篇文档, {len(corpus)}个chunk, 切分 {chunking['chunks_per_second']} chunks/s")
+    vectors, embedding = embed_corpus(corpus, args.dim)
+    print(f"向量: {embedding['chunks_per_second']} chunks/s")
+
+    chunk_ids = np.arange(1, len(corpus) + 1, dtype=np.int64)
+    queries = make_queries(corpus, args.queries, args.seed)
+    query_vectors = HashingEmbeddingProvider(args.dim).embed_sync([query for query, _ in queries])
+
+    scopes = {"all": False, "category": True}
+    exact = {}
+    reports = []
+    # flat是精确检索,先执行以得到recall的参照结果
+    backends = sorted(args.backends, key=lambda name: name != "flat")
+    if any(name in VECTOR_BACKENDS for name in backends) and "flat" not in backends:
+        backends.insert(0, "flat")
+    for name in backends:
+        gc.collect()
+        started = time.perf_counter()
+        index = build_backend(name, args, corpus, chunk_ids, vectors)
+        build_seconds = time.perf_counter() - started
+
+        report = {"backend": name, "build_seconds": round(build_seconds, 4)}
+        for scope, scoped in scopes.items():
+            reference = exact.get(scope) if name in VECTOR_BACKENDS else None
+            stats, results = run_queries(name, index, queries, query_vectors, args.top_k, scoped, reference)
+            if name == "flat":
+                exact[scope] = results
+                stats[f"recall_at_{args.top_k}"] = 1.0
+            report[scope] = stats
+        del index
+
+        if not args.no_memory:
+            memory, peak = measure_memory(name, args, corpus, chunk_ids, vectors)
+            report["memory_bytes"] = memory
+            report["peak_memory_bytes"] = peak
+        reports.append(report)
+        print(
+            f"{name:>13}: 构建 {report['build_seconds']:.2f}s, "
+            f"p50/p95/p99 {report['all']['p50_ms']}/{report['all']['p95_ms']}/{report['all']['p99_ms']} ms, "
+            f"recall@{args.top_k} {report['all'][f'recall_at_{args.top_k}']}"
+        )
+
+    return {
+        "chunks": len(corpus),
+        "chunking": chunking,
+        "embedding": embedding,
+        "vector_bytes": int(vectors.nbytes),
+        "backends": [report for report in reports if report["backend"] in args.backends],
+    }
+
+
+# ==================== 结果输出 ====================
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=project_root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path: str, top_k: int):
+    """与之前的结果文件对比p95延迟和recall"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {
+        (size["chunks"], report["backend"]): report
+        for size in baseline["results"] for report in size["backends"]
+    }
+    recall_key = f"recall_at_{top_k}"
+    print(f"\n与基线对比({baseline_path}, commit {baseline['meta'].get('commit')}):")
+    for size in results:
+        for report in size["backends"]:
+            old = previous.get((size["chunks"], report["backend"]))
+            if old is None:
+                continue
+            p95, old_p95 = report["all"]["p95_ms"], old["all"]["p95_ms"]
+            change = f"{(p95 - old_p95) / old_p95 * 100:+.1f}%" if old_p95 else "n/a"
+            print(
+                f"  {size['chunks']:>8} {report['backend']:>13}: p95 {old_p95} -> {p95} ms ({change}), "
+                f"recall {old['all'].get(recall_key)} -> {report['all'].get(recall_key)}"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="知识库检索基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="语料规模(chunk数),如 10000 100000 1000000")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS, help="参与测试的检索后端")
+    parser.add_argument("--dim", type=int, default=256, help="embedding维度(1M chunks时建议128以控制内存)")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模的查询数")
+    parser.add_argument("--top-k", type=int, default=10, help="每次检索返回的结果数")
+    parser.add_argument("--nlist", type=int, default=settings.KNOWLEDGE_IVF_NLIST, help="IVF聚类中心数")
+    parser.add_argument("--nprobe", type=int, default=settings.KNOWLEDGE_IVF_NPROBE, help="IVF检索扫描的簇数")
+    parser.add_argument("--shard-workers", type=int, default=settings.KNOWLEDGE_INDEX_SHARD_WORKERS, help="分片并发检索线程数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子(相同种子生成相同的语料和查询)")
+    parser.add_argument("--no-memory", action="store_true", help="跳过内存测量(需要额外构建一次索引)")
+    parser.add_argument("--output", default=None, help="结果文件路径(默认data/benchmarks/knowledge_<时间>.json)")
+    parser.add_argument("--baseline", default=None, help="用于对比的历史结果文件")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print("="*60)
+    print("考研AI助手 - 知识库检索基准测试")
+    print("="*60)
+
+    started_at = datetime.now()
+    results = [benchmark_size(n, args) for n in args.sizes]
+    output = {
+        "meta": {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "chunk_size": settings.KNOWLEDGE_CHUNK_SIZE,
+            "chunk_unit": settings.KNOWLEDGE_CHUNK_UNIT,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+
+    path = args.output or f"data/benchmarks/knowledge_{started_at:%Y%m%d_%H%M%S}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {path}")
+
+    if args.baseline:
+        compare(results, args.baseline, args.top_k)
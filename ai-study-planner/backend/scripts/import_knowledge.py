@@ -3,12 +3,18 @@
 """
 知识库导入脚本
 
-用于将预置的知识库内容导入到数据库中
-使用方法: python scripts/import_knowledge.py
+用于将预置的知识库内容或JSONL/Markdown文件导入到数据库中
+使用方法:
+    python scripts/import_knowledge.py                      # 导入脚本内预置的知识库内容
+    python scripts/import_knowledge.py data/kb/ extra.jsonl # 流式导入文件/目录(支持断点续传)
+
+JSONL每行一个文档(字段同KNOWLEDGE_DATA);.md/.markdown/.txt每个文件一个文档,
+首个一级标题作为文档标题,未指定--category时以所在目录名作为分类。
 """
 
 import sys
 import os
+import argparse
 from pathlib import Path
 
 # 添加项目根目录到Python路径
@@ -19,6 +25,7 @@ from sqlalchemy.orm import Session
 from app.core.database import engine, SessionLocal
 from app.models.knowledge_base import KnowledgeDocument
 from app.services.knowledge_service import KnowledgeService
+from app.services.ingest_pipeline import IngestPipeline
 import asyncio
 
 
@@ -193,9 +200,12 @@ async def import_knowledge_base():
         knowledge_service = KnowledgeService(db)
         
         # 批量导入
-        document_ids = await knowledge_service.batch_import_documents(KNOWLEDGE_DATA)
+        result = await knowledge_service.batch_import_documents(KNOWLEDGE_DATA)
+        document_ids = result["document_ids"]
         
-        print(f"\n导入完成!共导入 {len(document_ids)} 条知识库记录")
+        print(f"\n导入完成!共导入 {result['imported']} 条知识库记录,失败 {result['failed']} 条")
+        for error in result["errors"]:
+            print(f"  - 第{error['index'] + 1}条 {error['title'] or 'unknown'}: {error['error']}")
         print("\n导入的文档ID列表:")
         for doc_id in document_ids:
             print(f"  - 文档ID: {doc_id}")
@@ -224,14 +234,71 @@ async def import_knowledge_base():
         db.close()
 
 
+async def import_files(args):
+    """流式导入JSONL/Markdown文件"""
+    pipeline = IngestPipeline(
+        args.paths,
+        default_category=args.category,
+        workers=args.workers,
+        parse_batch=args.parse_batch,
+        embed_batch=args.embed_batch,
+        embed_concurrency=args.embed_concurrency,
+        commit_batch=args.commit_batch,
+        queue_size=args.queue_size,
+        checkpoint_path=args.checkpoint,
+        reset_checkpoint=args.reset_checkpoint,
+        skip_embedding=args.skip_embedding,
+        progress_interval=args.progress_interval
+    )
+    print(f"输入文件: {len(pipeline.files)} 个, 解析进程: {pipeline.workers} 个")
+    if pipeline.checkpoint.committed_through or pipeline.checkpoint.extra:
+        print(f"从断点恢复: 已完成 {pipeline.checkpoint.imported + pipeline.checkpoint.failed} 条记录")
+    
+    result = await pipeline.run()
+    
+    pipeline.print_stats()
+    print(f"\n导入完成!共导入 {result['imported']} 篇文档,失败 {result['failed']} 篇,耗时 {result['elapsed']:.1f}s")
+    for error in result["errors"][:20]:
+        print(f"  - {error['source']}: {error['error']}")
+    if args.skip_embedding:
+        print("文档已标记为待向量化,服务启动时会自动提交到后台向量化队列")
+    else:
+        print("向量已写入数据库,正在运行的服务需要重启才能加载新向量")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="知识库导入工具")
+    parser.add_argument("paths", nargs="*", help="JSONL/Markdown文件或目录,不指定时导入脚本内预置的知识库内容")
+    parser.add_argument("--category", help="默认分类")
+    parser.add_argument("--workers", type=int, default=None, help="解析切分进程数(默认CPU核数)")
+    parser.add_argument("--parse-batch", type=int, default=64, help="每个解析任务包含的记录数")
+    parser.add_argument("--embed-batch", type=int, default=256, help="每次生成向量的chunk数")
+    parser.add_argument("--embed-concurrency", type=int, default=2, help="并发的向量生成批次数")
+    parser.add_argument("--commit-batch", type=int, default=500, help="每次提交的文档数")
+    parser.add_argument("--queue-size", type=int, default=8, help="阶段间队列长度(背压)")
+    parser.add_argument("--checkpoint", default="data/import_checkpoint.json", help="断点文件路径")
+    parser.add_argument("--reset-checkpoint", action="store_true", help="忽略已有断点,从头导入")
+    parser.add_argument("--skip-embedding", action="store_true", help="只导入文档,不写入chunk和向量(由服务启动后在后台向量化)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="吞吐统计输出间隔(秒)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    
     print("="*60)
     print("考研AI助手 - 知识库导入工具")
     print("="*60)
     print()
     
     # 运行导入
-    asyncio.run(import_knowledge_base())
+    if args.paths:
+        try:
+            asyncio.run(import_files(args))
+        except KeyboardInterrupt:
+            print("\n导入已中断,使用相同参数再次运行即可从断点继续")
+    else:
+        asyncio.run(import_knowledge_base())
     
     print("\n" + "="*60)
     print("导入流程结束")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+知识库向量迁移脚本
+
+1. 为已有数据库补齐知识库表新增的字段和索引(Base.metadata.create_all不会修改已存在的表)
+2. 把knowledge_chunks.embedding_vector中的JSON向量转换为二进制的embedding_blob
+3. 为没有MinHash签名的文档和chunk补齐签名(近似重复检测使用;只补签名,不回溯标记已有的重复内容)
+
+使用方法: python scripts/migrate_embeddings.py [--codec float32|float16|int8] [--batch-size 1000] [--keep-json] [--skip-minhash]
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import bindparam, inspect, null, text, update
+from app.core.config import settings
+from app.core.database import engine, SessionLocal, Base
+from app.models.knowledge_base import KnowledgeDocument, KnowledgeChunk, SearchHistory
+from app.services.embedding_codec import CODECS, encode_vectors
+from app.services.near_duplicate import content_signature, encode_signature
+import numpy as np
+
+
+def ensure_schema():
+    """为已存在的知识库表添加缺失的字段和索引"""
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+
+    for model in (KnowledgeDocument, KnowledgeChunk, SearchHistory):
+        table = model.__table__
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            print(f"已添加字段: {table.name}.{column.name} {column_type}")
+
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def migrate_embeddings(codec: str, batch_size: int, keep_json: bool) -> int:
+    """按主键分批把JSON向量转换为二进制向量,返回迁移的chunk数量"""
+    table = KnowledgeChunk.__table__
+    statement = update(table).where(table.c.id == bindparam("chunk_id"))
+    values = {"embedding_codec": bindparam("codec"), "embedding_blob": bindparam("blob")}
+    if not keep_json:
+        values["embedding_vector"] = null()
+    statement = statement.values(**values)
+
+    db = SessionLocal()
+    migrated = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(
+                KnowledgeChunk.id, KnowledgeChunk.embedding_vector
+            ).filter(
+                KnowledgeChunk.id > last_id,
+                KnowledgeChunk.embedding_blob.is_(None),
+                KnowledgeChunk.embedding_vector.isnot(None)
+            ).order_by(KnowledgeChunk.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            blobs = encode_vectors(np.asarray([row.embedding_vector for row in rows], dtype=np.float32), codec)
+            db.execute(statement, [
+                {"chunk_id": row.id, "codec": codec, "blob": blob}
+                for row, blob in zip(rows, blobs)
+            ])
+            db.commit()
+
+            migrated += len(rows)
+            last_id = rows[-1].id
+            print(f"已迁移 {migrated} 个chunk (最大ID: {last_id})")
+    finally:
+        db.close()
+    return migrated
+
+
+def backfill_minhash(model, batch_size: int) -> int:
+    """按主键分批为minhash为空的文档或chunk计算签名,返回处理的行数"""
+    table = model.__table__
+    statement = update(table).where(table.c.id == bindparam("row_id")).values(minhash=bindparam("signature"))
+
+    db = SessionLocal()
+    filled = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(model.id, model.content).filter(
+                model.id > last_id,
+                model.minhash.is_(None)
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            db.execute(statement, [
+                {"row_id": row.id, "signature": encode_signature(content_signature(row.content or ""))}
+                for row in rows
+            ])
+            db.commit()
+
+            filled += len(rows)
+            last_id = rows[-1].id
+            print(f"已为 {filled} 行{table.name}补齐签名 (最大ID: {last_id})")
+    finally:
+        db.close()
+    return filled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="知识库向量迁移工具")
+    parser.add_argument("--codec", choices=CODECS, default=settings.EMBEDDING_STORAGE_CODEC, help="向量存储格式")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批迁移的chunk数量")
+    parser.add_argument("--keep-json", action="store_true", help="迁移后保留原JSON向量")
+    parser.add_argument("--skip-minhash", action="store_true", help="不补齐近似重复检测的MinHash签名")
+    args = parser.parse_args()
+
+    print("="*60)
+    print("考研AI助手 - 知识库向量迁移工具")
+    print("="*60)
+
+    ensure_schema()
+    total = migrate_embeddings(args.codec, args.batch_size, args.keep_json)
+
+    print(f"\n迁移完成!共迁移 {total} 个chunk,存储格式: {args.codec}")
+    if not args.skip_minhash:
+        documents = backfill_minhash(KnowledgeDocument, args.batch_size)
+        chunks = backfill_minhash(KnowledgeChunk, args.batch_size)
+        print(f"签名补齐完成!文档 {documents} 篇,chunk {chunks} 个")
+    print("="*60)
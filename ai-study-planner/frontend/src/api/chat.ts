@@ -27,6 +27,89 @@ export const sendChatMessage = (data: ChatRequest): Promise<ChatResponse> => {
   })
 }
 
+export interface ChatStreamHandlers {
+  /** 收到一段增量文本 */
+  onDelta?: (content: string) => void
+  /** 中止请求(如组件卸载、用户点击停止),后端会随之停止生成 */
+  signal?: AbortSignal
+}
+
+/**
+ * 流式发送聊天消息(Server-Sent Events)
+ *
+ * axios在浏览器中无法逐段读取响应,这里直接用fetch读取响应流并解析SSE事件。
+ * 返回完整回复内容和结束时间;服务端返回error事件或请求失败时抛出异常。
+ */
+export const chatStream = async (
+  data: ChatRequest,
+  { onDelta, signal }: ChatStreamHandlers = {}
+): Promise<ChatResponse> => {
+  const response = await fetch('/api/chat/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify(data),
+    signal
+  })
+  if (!response.ok || !response.body) {
+    let detail = `请求失败: ${response.status}`
+    try {
+      detail = (await response.json()).detail || detail
+    } catch {
+      // 响应不是JSON时使用默认错误信息
+    }
+    throw new Error(detail)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let message = ''
+  let timestamp = ''
+
+  const handleEvent = (block: string) => {
+    let event = 'message'
+    const dataLines: string[] = []
+    for (const line of block.split('\n')) {
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim()
+      } else if (line.startsWith('data:')) {
+        dataLines.push(line.slice(5).trim())
+      }
+    }
+    if (!dataLines.length) {
+      return
+    }
+    const payload = JSON.parse(dataLines.join('\n'))
+    if (event === 'delta') {
+      message += payload.content
+      onDelta?.(payload.content)
+    } else if (event === 'done') {
+      timestamp = payload.timestamp
+    } else if (event === 'error') {
+      throw new Error(payload.detail)
+    }
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) {
+      break
+    }
+    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, '\n')
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      handleEvent(buffer.slice(0, boundary))
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+    }
+  }
+  if (buffer.trim()) {
+    handleEvent(buffer)
+  }
+
+  return { message, timestamp: timestamp || new Date().toISOString() }
+}
+
 /**
  * 获取聊天历史
  */